@@ -0,0 +1,397 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import replace
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import typer
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage, messages_to_dict
+from rich.console import Console
+from rich.table import Table
+
+from mock_project.chatbot import CustomerSupportChatbot
+from mock_project.config import VECTOR_STORAGE_TYPES, Settings
+from mock_project.docstore import CompactDocstore
+from mock_project.document_loader import load_documents, split_documents
+from mock_project.fakes import FakeChatModel, FakeEmbeddings, echo_follow_up
+from mock_project.observability import CONDENSE_SAVED_SECONDS
+from mock_project.vectorstore import VectorStoreBuilder
+
+console = Console()
+app = typer.Typer(add_completion=False)
+
+_VOCAB = (
+    "khách hàng gói Premium Growth dịch vụ hỗ trợ hotline email portal chính sách đổi trả "
+    "sandbox nâng cấp rollback SLA phản hồi ticket định tuyến agent churn NPS workflow CRM "
+    "survey dashboard báo cáo tích hợp API bảo mật hiệu năng workshop đào tạo health check"
+).split()
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": pick(0.50) * 1000,
+        "p95_ms": pick(0.95) * 1000,
+        "p99_ms": pick(0.99) * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def _timed(fn: Callable[[], object], repeat: int) -> List[float]:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def _write_corpus(docs_path: Path, files: int, paragraphs: int, seed: int) -> int:
+    rng = random.Random(seed)
+    docs_path.mkdir(parents=True, exist_ok=True)
+    total = 0
+    for index in range(files):
+        text = "\n\n".join(
+            " ".join(rng.choice(_VOCAB) for _ in range(rng.randint(40, 120))) + "."
+            for _ in range(paragraphs)
+        )
+        (docs_path / f"doc_{index:04d}.txt").write_text(text, encoding="utf-8")
+        total += len(text)
+    return total
+
+
+def _parse_cache_cases(workspace: Path, files: int, paragraphs: int, seed: int) -> Dict[str, dict]:
+    """Reload a DOCX corpus with and without the parse cache (rebuild after a chunking change)."""
+    from docx import Document as WordDocument
+
+    rng = random.Random(seed)
+    docs_path = workspace / "docx"
+    docs_path.mkdir()
+    for index in range(files):
+        word = WordDocument()
+        for _ in range(paragraphs):
+            word.add_paragraph(" ".join(rng.choice(_VOCAB) for _ in range(rng.randint(40, 120))) + ".")
+        word.save(docs_path / f"doc_{index:04d}.docx")
+    settings = Settings(
+        openai_api_key="sk-fake",
+        chat_model="fake-chat",
+        embedding_model="fake-embedding",
+        docs_path=docs_path,
+        parse_cache_path=workspace / "parse_cache",
+    )
+    load_documents(settings)
+    uncached = replace(settings, parse_cache=False)
+    return {
+        "load_documents_docx_uncached": _percentiles(_timed(lambda: load_documents(uncached), 5)),
+        "load_documents_docx_cached": _percentiles(_timed(lambda: load_documents(settings), 5)),
+    }
+
+
+def _write_sessions(history_dir: Path, sessions: int, messages: int) -> None:
+    if history_dir.exists():
+        shutil.rmtree(history_dir)
+    history_dir.mkdir(parents=True)
+    turns = []
+    for index in range(messages // 2):
+        turns.append(HumanMessage(content=f"Câu hỏi số {index} về gói Premium?"))
+        turns.append(AIMessage(content=f"Trả lời số {index}: " + " ".join(_VOCAB[:30])))
+    payload = json.dumps(messages_to_dict(turns))
+    for index in range(sessions):
+        (history_dir / f"bench-{index:05d}.json").write_text(payload, encoding="utf-8")
+
+
+def _make_bot(settings: Settings, llm_latency: float, tokens_per_second: float, embedding_latency: float):
+    def llm_factory(
+        *, streaming: bool = False, callbacks: Optional[list] = None, model: Optional[str] = None
+    ) -> FakeChatModel:
+        # Model condense (CONDENSE_MODEL) giả lập viết lại câu hỏi gần như nguyên văn
+        return FakeChatModel(
+            latency=llm_latency,
+            tokens_per_second=tokens_per_second,
+            streaming=streaming,
+            callbacks=callbacks or [],
+            reply=echo_follow_up if model else None,
+        )
+
+    return CustomerSupportChatbot(
+        settings=settings,
+        llm_factory=llm_factory,
+        embeddings=FakeEmbeddings(size=settings.embedding_dimensions or 256, latency=embedding_latency),
+    )
+
+
+def _storage_cases(settings: Settings, chunks: list, queries: List[str], k: int = 10) -> Dict[str, dict]:
+    """Index size, load time and recall@k of each VECTOR_STORAGE vs the float32 exact search."""
+
+    embeddings = FakeEmbeddings(size=settings.embedding_dimensions or 256)
+    results: Dict[str, dict] = {}
+    exact: Dict[str, set] = {}
+    for storage in VECTOR_STORAGE_TYPES:
+        root = settings.persist_index_path.parent / f"faiss-{storage}"
+        case = Settings(**{**_fields(settings), "persist_index_path": root, "vector_storage": storage})
+        builder = VectorStoreBuilder(case, embeddings=embeddings)
+        builder.build(chunks, persist_path=root)
+        load = _timed(lambda: builder.load_from_disk(root), 5)
+        store = builder.load_from_disk(root)["default"]
+
+        def top(query: str) -> set:
+            hits = store.similarity_search(query, k=k)
+            return {(doc.metadata.get("source"), doc.metadata.get("start_index")) for doc in hits}
+
+        found = {query: top(query) for query in queries}
+        if storage == "float32":
+            exact = found
+        recall = statistics.fmean(len(found[query] & exact[query]) / max(len(exact[query]), 1) for query in queries)
+        results[f"index_load_{storage}"] = {
+            **_percentiles(load),
+            "bytes": sum(path.stat().st_size for path in root.rglob("index.faiss")),
+            f"recall_at_{k}": recall,
+        }
+    return results
+
+
+def _docstore_cases(chunks: int, seed: int) -> Dict[str, dict]:
+    """Retained memory (tracemalloc) and lookup latency of the FAISS docstore for `chunks` synthetic chunks."""
+
+    def documents() -> Iterator[Tuple[str, Document]]:
+        rng = random.Random(seed)
+        for row in range(chunks):
+            text = " ".join(rng.choice(_VOCAB) for _ in range(100))
+            # Như splitter: mỗi chunk có dict metadata và chuỗi `source` riêng
+            source = str(Path("data/docs/kb") / f"collection_{row // 4000:02d}" / f"doc_{row // 40:05d}.pdf")
+            metadata = {"source": source, "page": row // 10 % 4, "collection": "default", "start_index": row % 40 * 650}
+            yield str(row), Document(page_content=text, metadata=metadata)
+
+    results: Dict[str, dict] = {}
+    for name, factory in (("docstore_inmemory", InMemoryDocstore), ("docstore_compact", CompactDocstore)):
+        tracemalloc.start()
+        store = factory()
+        store.add(dict(documents()))
+        retained = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        ids = [str(row) for row in random.Random(seed).sample(range(chunks), min(chunks, 1000))]
+        lookups = _timed(lambda: [store.search(doc_id) for doc_id in ids], 5)
+        results[name] = {
+            **_percentiles([elapsed / len(ids) for elapsed in lookups]),
+            "chunks": chunks,
+            "bytes": retained,
+        }
+        del store
+    return results
+
+
+def _fields(settings: Settings) -> dict:
+    return {name: getattr(settings, name) for name in Settings.__dataclass_fields__}
+
+
+def _compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Return human-readable regressions for every `*_ms` metric slower than baseline."""
+
+    regressions = []
+    for name, metrics in results.items():
+        previous = baseline.get(name, {})
+        for key, value in metrics.items():
+            old = previous.get(key)
+            if not key.endswith("_ms") or not isinstance(old, (int, float)) or old <= 0:
+                continue
+            if value > old * (1 + tolerance):
+                regressions.append(f"{name}.{key}: {old:.2f} -> {value:.2f} ms (+{(value / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+@app.command()
+def run(
+    output: Path = typer.Option(Path("data/benchmarks/latest.json"), "--output", help="Where to write JSON results"),
+    baseline: Optional[Path] = typer.Option(None, "--baseline", help="Previous results to compare against"),
+    tolerance: float = typer.Option(0.2, "--tolerance", help="Allowed slowdown vs baseline (0.2 = 20%)"),
+    files: int = typer.Option(20, "--files", help="Synthetic documents in the corpus"),
+    paragraphs: int = typer.Option(20, "--paragraphs", help="Paragraphs per synthetic document"),
+    iterations: int = typer.Option(20, "--iterations", help="Repetitions for ask/astream"),
+    llm_latency: float = typer.Option(0.0, "--llm-latency", help="Fake LLM delay before first token (s)"),
+    tokens_per_second: float = typer.Option(0.0, "--tokens-per-second", help="Fake LLM token rate (0 = instant)"),
+    embedding_latency: float = typer.Option(0.0, "--embedding-latency", help="Fake embedding delay per call (s)"),
+    dimensions: int = typer.Option(256, "--dimensions", help="Fake embedding dimensions (EMBEDDING_DIMENSIONS)"),
+    session_counts: str = typer.Option("10,100,1000", "--sessions", help="Session counts for list_sessions"),
+    message_counts: str = typer.Option("10,100,1000", "--messages", help="Message counts for get_history"),
+    docstore_chunks: int = typer.Option(50000, "--docstore-chunks", help="Synthetic chunks for the docstore memory case"),
+    seed: int = typer.Option(7, "--seed"),
+) -> None:
+    """Measure the project's own overhead using fake LLM/embeddings (no network)."""
+
+    output = output.resolve()
+    baseline = baseline.resolve() if baseline else None
+    results: Dict[str, dict] = {}
+    original_cwd = Path.cwd()
+
+    with tempfile.TemporaryDirectory(prefix="chatbot-bench-") as tmp:
+        workspace = Path(tmp)
+        # Lịch sử chat được ghi theo đường dẫn tương đối `data/chat_history`
+        os.chdir(workspace)
+        try:
+            docs_path = workspace / "docs"
+            corpus_chars = _write_corpus(docs_path, files, paragraphs, seed)
+            settings = Settings(
+                openai_api_key="sk-fake",
+                chat_model="fake-chat",
+                embedding_model="fake-embedding",
+                docs_path=docs_path,
+                persist_index_path=workspace / "faiss",
+                embedding_dimensions=dimensions,
+            )
+
+            # init_index: cold = load + split + embed + save, warm = load persisted FAISS
+            cold = _timed(lambda: _make_bot(settings, 0, 0, embedding_latency).init_index(), 1)
+            warm = _timed(lambda: _make_bot(settings, 0, 0, embedding_latency).init_index(), 5)
+            results["init_index_cold"] = _percentiles(cold)
+            results["init_index_warm"] = _percentiles(warm)
+
+            documents = load_documents(settings)
+            results.update(_parse_cache_cases(workspace, files, paragraphs, seed))
+            chunk_count = len(split_documents(settings, documents))
+            split = _timed(lambda: split_documents(settings, documents), 5)
+            results["split_documents"] = {
+                **_percentiles(split),
+                "chunks": chunk_count,
+                "chars_per_second": corpus_chars / statistics.fmean(split),
+            }
+            storage_queries = [f"Chính sách {_VOCAB[i % len(_VOCAB)]} {_VOCAB[(i * 7) % len(_VOCAB)]}" for i in range(50)]
+            results.update(_storage_cases(settings, split_documents(settings, documents), storage_queries))
+            if docstore_chunks:
+                results.update(_docstore_cases(docstore_chunks, seed))
+
+            bot = _make_bot(settings, llm_latency, tokens_per_second, embedding_latency)
+            bot.init_index()
+            questions = iter(f"Chính sách {_VOCAB[i % len(_VOCAB)]} số {i} là gì?" for i in range(10**6))
+            ask = _timed(lambda: bot.ask(next(questions), session_id=f"ask-{time.perf_counter_ns()}"), iterations)
+            results["ask"] = _percentiles(ask)
+            # Đường /api/search: chỉ embed + FAISS, không gọi LLM
+            results["search"] = _percentiles(_timed(lambda: bot.search([next(questions)], k=5), iterations))
+            # FAQ fast-path: khớp TF-IDF cục bộ, không retrieval/LLM
+            faq_path = workspace / "faq.json"
+            faq_entries = [{"id": "hotline", "questions": ["Hotline hỗ trợ là gì?"], "answer": "Hotline: 1900-123-456"}]
+            faq_path.write_text(json.dumps(faq_entries, ensure_ascii=False), encoding="utf-8")
+            faq_bot = _make_bot(replace(settings, faq_path=faq_path), llm_latency, tokens_per_second, embedding_latency)
+            results["ask_faq"] = _percentiles(
+                _timed(lambda: faq_bot.ask("hotline ho tro la gi?", session_id=f"faq-{time.perf_counter_ns()}"), iterations)
+            )
+
+            # Câu hỏi follow-up: condense tuần tự vs retrieval chạy song song với condense
+            for case, speculative in (("ask_follow_up", False), ("ask_follow_up_speculative", True)):
+                follow_up_settings = replace(settings, condense_model="fake-condense", speculative_retrieval=speculative)
+                follow_up_bot = _make_bot(follow_up_settings, llm_latency, tokens_per_second, embedding_latency)
+                follow_up_bot.ask(next(questions), session_id=case)
+                saved_before = CONDENSE_SAVED_SECONDS.value()
+                follow_ups = _timed(lambda: follow_up_bot.ask(next(questions), session_id=case), iterations)
+                results[case] = {
+                    **_percentiles(follow_ups),
+                    "saved_seconds": CONDENSE_SAVED_SECONDS.value() - saved_before,
+                }
+
+            async def stream_once() -> tuple[float, float]:
+                started = time.perf_counter()
+                first = None
+                async for _ in bot.astream(next(questions), session_id=f"stream-{time.perf_counter_ns()}"):
+                    if first is None:
+                        first = time.perf_counter() - started
+                total = time.perf_counter() - started
+                return (first if first is not None else total), total
+
+            streamed = [asyncio.run(stream_once()) for _ in range(iterations)]
+            results["astream_ttft"] = _percentiles([ttft for ttft, _ in streamed])
+            results["astream_total"] = _percentiles([total for _, total in streamed])
+
+            # API import khởi tạo bot toàn cục; trỏ vào thư mục rỗng để không gọi OpenAI
+            empty_docs = workspace / "empty-docs"
+            empty_docs.mkdir()
+            os.environ.update(
+                {"OPENAI_API_KEY": "sk-fake", "DOCS_PATH": str(empty_docs), "PERSIST_INDEX": "false", "LOG_LEVEL": "CRITICAL"}
+            )
+            from fastapi.testclient import TestClient
+
+            from mock_project import api
+
+            client = TestClient(api.app)
+            history_dir = workspace / "data" / "chat_history"
+            for count in [int(value) for value in session_counts.split(",") if value]:
+                _write_sessions(history_dir, count, 10)
+                results[f"list_sessions_{count}"] = _percentiles(_timed(lambda: client.get("/api/sessions"), 5))
+                etag = client.get("/api/sessions").headers["etag"]
+                results[f"list_sessions_{count}_304"] = _percentiles(
+                    _timed(lambda: client.get("/api/sessions", headers={"If-None-Match": etag}), 5)
+                )
+            for count in [int(value) for value in message_counts.split(",") if value]:
+                _write_sessions(history_dir, 1, count)
+                results[f"get_history_{count}"] = _percentiles(
+                    _timed(lambda: client.get("/api/history/bench-00000"), 10)
+                )
+        finally:
+            os.chdir(original_cwd)
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "params": {
+                "files": files,
+                "paragraphs": paragraphs,
+                "iterations": iterations,
+                "llm_latency": llm_latency,
+                "tokens_per_second": tokens_per_second,
+                "embedding_latency": embedding_latency,
+                "dimensions": dimensions,
+                "docstore_chunks": docstore_chunks,
+            },
+        },
+        "results": results,
+    }
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    table = Table(title="Benchmark")
+    for column in ("case", "p50 ms", "p95 ms", "max ms", "notes"):
+        table.add_column(column)
+    for name, metrics in results.items():
+        notes = ", ".join(
+            f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+            for key, value in metrics.items()
+            if key in ("bytes", "chunks", "saved_seconds") or key.startswith("recall_at_")
+        )
+        table.add_row(
+            name, f"{metrics['p50_ms']:.2f}", f"{metrics['p95_ms']:.2f}", f"{metrics['max_ms']:.2f}", notes
+        )
+    console.print(table)
+    console.print(f"Saved results to {output}")
+
+    if baseline:
+        previous = json.loads(baseline.read_text(encoding="utf-8")).get("results", {})
+        regressions = _compare(results, previous, tolerance)
+        for line in regressions:
+            console.print(f"[bold red]Regression:[/bold red] {line}")
+        if regressions:
+            raise typer.Exit(code=1)
+        console.print("[bold green]No regressions vs baseline.[/bold green]")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import json
+import sys
+from pathlib import Path
+from typing import Optional
+
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from mock_project.chatbot import CustomerSupportChatbot
+from mock_project.config import get_settings
+from mock_project.vectorstore import (
+    MANIFEST_FILE,
+    SNAPSHOTS_DIR,
+    activate_snapshot,
+    current_version,
+    list_snapshots,
+)
+
+console = Console()
+app = typer.Typer(add_completion=False, help="Build and manage versioned FAISS index snapshots offline.")
+
+
+@app.command()
+def build(
+    docs_path: Optional[Path] = typer.Option(None, "--docs-path", help="Folder containing the knowledge base"),
+    output: Optional[Path] = typer.Option(None, "--output", help="Index root (default: PERSIST_INDEX_PATH)"),
+    activate: bool = typer.Option(True, "--activate/--no-activate", help="Point CURRENT at the new snapshot"),
+) -> None:
+    """Embed the documents and write a new snapshot atomically, without touching the API process."""
+
+    settings = get_settings()
+    if docs_path:
+        settings.docs_path = docs_path.resolve()
+    if output:
+        settings.persist_index_path = output.resolve()
+    settings.persist_index = True
+
+    bot = CustomerSupportChatbot(settings=settings)
+    bot.build_index(activate=activate)
+    console.print(
+        f"[bold green]Built snapshot[/bold green] {bot.last_built_version} under {settings.persist_index_path}"
+    )
+    console.print("Collections: " + ", ".join(f"{name} ({count} chunks)" for name, count in bot.collections.items()))
+    report = bot.last_dedup_report
+    if report is not None:
+        console.print(
+            f"Dedup: {report.input_chunks} chunks -> {report.kept} kept "
+            f"({report.exact_duplicates} exact, {report.near_duplicates} near duplicates, "
+            f"{report.chars_removed} chars not embedded)"
+        )
+    if activate:
+        console.print("Running workers pick it up via POST /api/admin/reload-index, SIGHUP or INDEX_WATCH_INTERVAL.")
+
+
+@app.command("list")
+def list_(root: Optional[Path] = typer.Option(None, "--root", help="Index root (default: PERSIST_INDEX_PATH)")) -> None:
+    """Show available snapshots and which one is active."""
+
+    root = (root or get_settings().persist_index_path).resolve()
+    active = current_version(root)
+    table = Table(title=str(root))
+    for column in ("version", "active", "chunks", "collections", "embedding model"):
+        table.add_column(column)
+    for version in list_snapshots(root):
+        manifest_path = root / SNAPSHOTS_DIR / version / MANIFEST_FILE
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8")) if manifest_path.exists() else {}
+        table.add_row(
+            version,
+            "*" if version == active else "",
+            str(manifest.get("chunks", "")),
+            ", ".join(f"{name}={count}" for name, count in manifest.get("collections", {}).items()),
+            str(manifest.get("embedding_model", "")),
+        )
+    console.print(table)
+
+
+@app.command()
+def activate(
+    version: str = typer.Argument(..., help="Snapshot version to activate (e.g. for rollback)"),
+    root: Optional[Path] = typer.Option(None, "--root", help="Index root (default: PERSIST_INDEX_PATH)"),
+) -> None:
+    """Atomically point CURRENT at an existing snapshot."""
+
+    root = (root or get_settings().persist_index_path).resolve()
+    activate_snapshot(root, version)
+    console.print(f"[bold green]Active snapshot:[/bold green] {version}")
+
+
+if __name__ == "__main__":
+    try:
+        app()
+    except Exception as exc:  # noqa: BLE001
+        Console().print(f"[bold red]Index build failed:[/bold red] {exc}")
+        sys.exit(1)
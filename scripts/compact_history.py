@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+from typing import Optional
+
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from mock_project.config import get_settings
+from mock_project.history import HistoryStore
+
+console = Console()
+app = typer.Typer(add_completion=False, help="Archive idle chat sessions and clean up the history directory.")
+
+
+@app.command()
+def compact(
+    idle_days: Optional[float] = typer.Option(
+        None, "--idle-days", help="Archive sessions idle for this many days (default: HISTORY_ARCHIVE_AFTER_DAYS)"
+    ),
+    root: Optional[Path] = typer.Option(None, "--root", help="History directory (default: CHAT_HISTORY_PATH)"),
+) -> None:
+    """Move idle sessions into compressed segments and remove orphaned metadata files."""
+
+    settings = get_settings()
+    idle_days = settings.history_archive_after_days if idle_days is None else idle_days
+    store = HistoryStore((root or settings.chat_history_path).resolve())
+    report = store.compact(idle_days * 86400)
+
+    table = Table(title=f"{store.root} (idle > {idle_days:g} days)")
+    for column in ("archived sessions", "orphaned meta", "dead segments", "files removed", "bytes reclaimed"):
+        table.add_column(column)
+    table.add_row(
+        str(report.archived_sessions),
+        str(report.orphaned_meta_removed),
+        str(report.segments_removed),
+        str(report.files_removed),
+        f"{report.bytes_reclaimed} ({report.bytes_removed} removed, {report.bytes_written} written)",
+    )
+    console.print(table)
+    if report.segment:
+        console.print(f"Archive segment: {store.archive_dir / report.segment}")
+
+
+if __name__ == "__main__":
+    try:
+        app()
+    except Exception as exc:  # noqa: BLE001
+        Console().print(f"[bold red]History compaction failed:[/bold red] {exc}")
+        sys.exit(1)
@@ -0,0 +1,295 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import typer
+import websockets
+from rich.console import Console
+from rich.table import Table
+
+from mock_project.fakes import FakeOpenAIServer
+
+console = Console()
+app = typer.Typer(add_completion=False, help="Load-test one API replica against a local fake OpenAI server.")
+
+_QUESTIONS = (
+    "Hotline hỗ trợ khách hàng Premium là gì?",
+    "Chính sách đổi trả áp dụng trong bao lâu?",
+    "Làm sao nâng cấp từ gói Growth lên Premium?",
+    "SLA phản hồi ticket của gói Premium?",
+    "Portal khách hàng có hỗ trợ tích hợp API không?",
+    "Còn chính sách bảo mật dữ liệu thì sao?",
+)
+_ROOT = Path(__file__).resolve().parents[1]
+# CustomerSupportChatbot.ask trả HTTP 200 kèm câu này khi chain/OpenAI lỗi
+_ERROR_ANSWER = "Xin lỗi, đã xảy ra lỗi:"
+
+
+@dataclass
+class _Samples:
+    latencies: List[float] = field(default_factory=list)
+    ttfts: List[float] = field(default_factory=list)
+    errors: int = 0
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))] * 1000 if ordered else 0.0
+
+
+def _summary(samples: _Samples, elapsed: float) -> Dict[str, float]:
+    ordered, ttfts = sorted(samples.latencies), sorted(samples.ttfts)
+    total = len(ordered) + samples.errors
+    return {
+        "requests": total,
+        "errors": samples.errors,
+        "error_rate": samples.errors / total if total else 0.0,
+        "rps": len(ordered) / elapsed if elapsed else 0.0,
+        "mean_ms": statistics.fmean(ordered) * 1000 if ordered else 0.0,
+        "p50_ms": _percentile(ordered, 0.50),
+        "p95_ms": _percentile(ordered, 0.95),
+        "p99_ms": _percentile(ordered, 0.99),
+        "ttft_p50_ms": _percentile(ttfts, 0.50),
+        "ttft_p95_ms": _percentile(ttfts, 0.95),
+        "ttft_p99_ms": _percentile(ttfts, 0.99),
+    }
+
+
+def _parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() not in ("chat", "ws", "sessions"):
+            raise typer.BadParameter(f"Unknown scenario {name!r}; use chat, ws and sessions")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+async def _chat(client: httpx.AsyncClient, session_id: str, samples: _Samples) -> None:
+    started = time.perf_counter()
+    response = await client.post(
+        "/api/chat", json={"message": random.choice(_QUESTIONS), "session_id": session_id}
+    )
+    if response.status_code != 200 or response.json().get("answer", "").startswith(_ERROR_ANSWER):
+        samples.errors += 1
+        return
+    samples.latencies.append(time.perf_counter() - started)
+
+
+async def _sessions(client: httpx.AsyncClient, samples: _Samples) -> None:
+    started = time.perf_counter()
+    response = await client.get("/api/sessions")
+    if response.status_code != 200:
+        samples.errors += 1
+        return
+    samples.latencies.append(time.perf_counter() - started)
+
+
+async def _ws_turn(socket: websockets.ClientConnection, session_id: str, samples: _Samples) -> bool:
+    """One question over an open socket; False when the server reported an error (and may close it)."""
+    started = time.perf_counter()
+    first: Optional[float] = None
+    await socket.send(json.dumps({"message": random.choice(_QUESTIONS), "session_id": session_id}))
+    while True:
+        event = json.loads(await socket.recv())
+        if event["type"] == "token" and first is None:
+            first = time.perf_counter() - started
+        elif event["type"] == "error":
+            samples.errors += 1
+            return False
+        elif event["type"] == "done":
+            break
+    samples.latencies.append(time.perf_counter() - started)
+    # Không nhận được token nào (câu trả lời rỗng) thì TTFT = tổng thời gian
+    samples.ttfts.append(first if first is not None else samples.latencies[-1])
+    return True
+
+
+async def _worker(
+    number: int,
+    base_url: str,
+    mix: Dict[str, float],
+    deadline: float,
+    results: Dict[str, _Samples],
+) -> None:
+    rng = random.Random(number)
+    names, weights = list(mix), list(mix.values())
+    session_id = f"load-{number:04d}"
+    ws_url = base_url.replace("http", "ws", 1) + "/ws/chat"
+    socket = None
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        try:
+            while time.perf_counter() < deadline:
+                scenario = rng.choices(names, weights)[0]
+                try:
+                    if scenario == "chat":
+                        await _chat(client, session_id, results["chat"])
+                    elif scenario == "sessions":
+                        await _sessions(client, results["sessions"])
+                    else:
+                        # Mỗi worker giữ một WebSocket mở suốt bài test, như một tab trình duyệt
+                        if socket is None:
+                            socket = await websockets.connect(ws_url, open_timeout=30, max_size=None)
+                        if not await _ws_turn(socket, session_id, results["ws"]):
+                            await socket.close()
+                            socket = None
+                except (httpx.HTTPError, websockets.WebSocketException, OSError):
+                    results[scenario].errors += 1
+                    if scenario == "ws" and socket is not None:
+                        await socket.close()
+                        socket = None
+        finally:
+            if socket is not None:
+                await socket.close()
+
+
+async def _drive(base_url: str, concurrency: int, duration: float, mix: Dict[str, float]) -> tuple:
+    results = {name: _Samples() for name in ("chat", "ws", "sessions")}
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(_worker(number, base_url, mix, deadline, results) for number in range(concurrency)))
+    return results, time.perf_counter() - started
+
+
+def _wait_ready(base_url: str, process: Optional[subprocess.Popen], timeout: float) -> None:
+    """Wait until the replica answers and its index is loaded (`/api/collections` returns 200)."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with code {process.returncode}")
+        try:
+            if httpx.get(f"{base_url}/api/collections", timeout=5).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"API at {base_url} not ready after {timeout:.0f}s")
+
+
+@app.command()
+def run(
+    concurrency: int = typer.Option(16, "--concurrency", help="Concurrent virtual users (one open WebSocket each)"),
+    duration: float = typer.Option(30.0, "--duration", help="Seconds of load after warm-up"),
+    mix: str = typer.Option("chat=1,ws=2,sessions=1", "--mix", help="Scenario weights"),
+    latency: float = typer.Option(0.3, "--latency", help="Fake OpenAI delay before the first byte (s)"),
+    tokens_per_second: float = typer.Option(50.0, "--tokens-per-second", help="Fake OpenAI streaming rate"),
+    response_tokens: int = typer.Option(64, "--response-tokens", help="Tokens per fake completion"),
+    error_rate: float = typer.Option(0.0, "--error-rate", help="Fraction of fake OpenAI calls that fail"),
+    workers: int = typer.Option(1, "--workers", help="uvicorn worker processes"),
+    port: int = typer.Option(8765, "--port", help="Port for the API replica under test"),
+    docs_path: Path = typer.Option(_ROOT / "data" / "docs", "--docs-path", help="Knowledge base to index"),
+    url: Optional[str] = typer.Option(None, "--url", help="Load an already running API instead of starting one"),
+    output: Optional[Path] = typer.Option(None, "--output", help="Write JSON results here"),
+) -> None:
+    """Start a fake OpenAI server and one uvicorn replica, then drive mixed chat/WebSocket/session traffic."""
+
+    weights = _parse_mix(mix)
+    # Với --url, replica dùng upstream của chính nó: không cần (và không đo được) fake OpenAI
+    fake: Optional[FakeOpenAIServer] = None
+    if url is None:
+        fake = FakeOpenAIServer(
+            latency=latency, tokens_per_second=tokens_per_second, response_tokens=response_tokens, error_rate=error_rate
+        ).start()
+    process: Optional[subprocess.Popen] = None
+    with tempfile.TemporaryDirectory(prefix="chatbot-load-") as tmp:
+        workspace = Path(tmp)
+        base_url = (url or f"http://127.0.0.1:{port}").rstrip("/")
+        try:
+            if fake is not None:
+                env = {
+                    **os.environ,
+                    "OPENAI_API_KEY": "sk-loadtest",
+                    "OPENAI_BASE_URL": fake.base_url,
+                    "DOCS_PATH": str(docs_path.resolve()),
+                    "PERSIST_INDEX_PATH": str(workspace / "faiss"),
+                    "CHAT_HISTORY_PATH": str(workspace / "chat_history"),
+                    "LANGCHAIN_TRACING_V2": "false",
+                    "LOG_LEVEL": "WARNING",
+                    "PYTHONPATH": os.pathsep.join(filter(None, [str(_ROOT / "src"), os.environ.get("PYTHONPATH")])),
+                }
+                # Thư mục làm việc tạm: index/lịch sử của bài test không lẫn vào data/ của project
+                process = subprocess.Popen(
+                    [sys.executable, "-m", "uvicorn", "mock_project.api:app", "--port", str(port),
+                     "--workers", str(workers), "--log-level", "warning"],
+                    cwd=workspace,
+                    env=env,
+                )
+            console.print(f"Waiting for {base_url}" + (f" (fake OpenAI at {fake.base_url})" if fake else "") + " ...")
+            _wait_ready(base_url, process, timeout=180)
+            upstream_before = fake.requests if fake else 0
+            results, elapsed = asyncio.run(_drive(base_url, concurrency, duration, weights))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=30)
+            if fake is not None:
+                fake.stop()
+
+    report = {name: _summary(samples, elapsed) for name, samples in results.items() if name in weights}
+    total_ok = sum(len(samples.latencies) for samples in results.values())
+    payload = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "params": {
+                "concurrency": concurrency,
+                "duration": duration,
+                "mix": weights,
+                "latency": latency,
+                "tokens_per_second": tokens_per_second,
+                "response_tokens": response_tokens,
+                "error_rate": error_rate,
+                "workers": workers,
+            },
+            "elapsed": elapsed,
+            "rps": total_ok / elapsed,
+        },
+        "results": report,
+    }
+    if fake is not None:
+        payload["meta"]["upstream_requests"] = fake.requests - upstream_before
+        payload["meta"]["upstream_errors"] = fake.errors
+    if output:
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(payload, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    table = Table(title=f"{concurrency} users, {elapsed:.1f}s, {total_ok / elapsed:.1f} req/s")
+    for column in ("scenario", "requests", "req/s", "errors", "p50 ms", "p95 ms", "p99 ms", "TTFT p50/p95/p99 ms"):
+        table.add_column(column)
+    for name, metrics in report.items():
+        table.add_row(
+            name,
+            str(metrics["requests"]),
+            f"{metrics['rps']:.1f}",
+            f"{metrics['errors']} ({metrics['error_rate']:.1%})",
+            f"{metrics['p50_ms']:.0f}",
+            f"{metrics['p95_ms']:.0f}",
+            f"{metrics['p99_ms']:.0f}",
+            "/".join(f"{metrics[key]:.0f}" for key in ("ttft_p50_ms", "ttft_p95_ms", "ttft_p99_ms"))
+            if name == "ws"
+            else "",
+        )
+    console.print(table)
+    if fake is not None:
+        console.print(
+            f"Upstream (fake OpenAI): {payload['meta']['upstream_requests']} calls, {fake.errors} injected errors"
+        )
+
+
+if __name__ == "__main__":
+    try:
+        app()
+    except Exception as exc:  # noqa: BLE001
+        Console().print(f"[bold red]Load test failed:[/bold red] {exc}")
+        sys.exit(1)
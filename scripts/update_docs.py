@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import json
 from pathlib import Path
 from unicodedata import normalize
 
@@ -8,6 +9,8 @@ from fpdf import FPDF
 
 DOCX_PATH = Path("data/docs/product_faq.docx")
 PDF_PATH = Path("data/docs/product_faq.pdf")
+# Nằm cạnh data/docs (không phải bên trong) để không bị index như một tài liệu
+FAQ_PATH = Path("data/faq.json")
 
 CONTENT = {
     "title": "Product FAQ & Service Catalog",
@@ -60,11 +63,71 @@ CONTENT = {
 }
 
 
+def _kb_line(prefix: str) -> str:
+    """The CONTENT line starting with `prefix` (bullet stripped), so FAQ answers stay verbatim."""
+
+    for _, paragraphs in CONTENT["sections"]:
+        for paragraph in paragraphs:
+            line = paragraph.lstrip("•-0123456789. ")
+            if line.startswith(prefix):
+                return line
+    raise KeyError(prefix)
+
+
+# Câu hỏi thường gặp cho fast-path (data/faq.json), trả lời không cần gọi LLM
+FAQ = [
+    (
+        "greeting",
+        ["Xin chào", "Chào bạn", "Chào shop", "Hello", "Hi", "Alo"],
+        "Xin chào! Mình là trợ lý chăm sóc khách hàng. Bạn cần hỗ trợ về sản phẩm, dịch vụ hay chính sách nào?",
+    ),
+    (
+        "thanks",
+        ["Cảm ơn", "Cảm ơn bạn nhiều", "Thanks", "Thank you"],
+        "Rất vui được hỗ trợ bạn! Nếu còn câu hỏi nào khác, cứ nhắn cho mình nhé.",
+    ),
+    (
+        "hotline",
+        [
+            "Hotline hỗ trợ là gì?",
+            "Cho mình xin số hotline",
+            "Số hotline chăm sóc khách hàng?",
+            "Số điện thoại hỗ trợ?",
+            "Hotline Premium là số nào?",
+        ],
+        _kb_line("Hotline:"),
+    ),
+    (
+        "email",
+        ["Email hỗ trợ là gì?", "Email support là gì?", "Địa chỉ email chăm sóc khách hàng?", "Gửi email hỗ trợ ở đâu?"],
+        _kb_line("Email:"),
+    ),
+    ("portal", ["Portal khách hàng ở đâu?", "Link cổng thông tin khách hàng?"], _kb_line("Portal:")),
+    (
+        "sla",
+        ["SLA phản hồi là bao lâu?", "Bao lâu thì được phản hồi?", "Thời gian phản hồi ticket là bao lâu?", "SLA của gói Premium?"],
+        _kb_line("SLA:"),
+    ),
+    (
+        "returns",
+        ["Chính sách đổi trả thế nào?", "Đổi trả trong bao lâu?", "Có được đổi trả sản phẩm không?"],
+        _kb_line("Đổi trả"),
+    ),
+    ("sandbox", ["Có sandbox dùng thử không?", "Dùng thử miễn phí bao lâu?"], _kb_line("Sandbox")),
+]
+
+
 def main() -> None:
     DOCX_PATH.parent.mkdir(parents=True, exist_ok=True)
     _build_docx(DOCX_PATH)
     _build_pdf(PDF_PATH)
-    print(f"Updated knowledge base files: {DOCX_PATH.name}, {PDF_PATH.name}")
+    _build_faq(FAQ_PATH)
+    print(f"Updated knowledge base files: {DOCX_PATH.name}, {PDF_PATH.name}, {FAQ_PATH.name}")
+
+
+def _build_faq(path: Path) -> None:
+    entries = [{"id": entry_id, "questions": questions, "answer": answer} for entry_id, questions, answer in FAQ]
+    path.write_text(json.dumps(entries, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
 
 
 def _build_docx(path: Path) -> None:
@@ -1,16 +1,35 @@
 from __future__ import annotations
 
-import json
-from pathlib import Path
-from typing import AsyncIterator
-
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+import hmac
+import re
+import signal
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
+
+from fastapi import (
+    BackgroundTasks,
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    WebSocket,
+    WebSocketDisconnect,
+)
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
+from pydantic import BaseModel, Field
 
 from .chatbot import CustomerSupportChatbot
+from .http_cache import CachedStaticFiles, conditional_json, make_etag
+from .observability import ACTIVE_WEBSOCKETS, configure_logging, logger, render_metrics
+from .profiling import SamplingProfiler, profiling_authorized
+from .scheduler import SchedulerBusy
+from .vectorstore import current_version
 
 app = FastAPI(title="Customer Support Chatbot API", version="0.1.0")
 app.add_middleware(
@@ -20,8 +39,16 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+try:
+    # Brotli nếu đã cài `brotli-asgi` (tự fallback gzip cho client không hỗ trợ br)
+    from brotli_asgi import BrotliMiddleware  # type: ignore
+
+    app.add_middleware(BrotliMiddleware, minimum_size=1024)
+except ImportError:
+    app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 bot = CustomerSupportChatbot()
+configure_logging(bot.settings.log_level)
 try:
     bot.init_index()
 except Exception:
@@ -29,9 +56,96 @@ except Exception:
     pass
 
 
+def _reload_index(version: Optional[str] = None) -> None:
+    try:
+        loaded = bot.reload_index(version)
+        logger.info("index_reloaded", extra={"fields": {"version": loaded}})
+    except Exception:  # noqa: BLE001
+        logger.exception("index_reload_failed", extra={"fields": {"version": version}})
+
+
+def _watch_index(interval: float) -> None:
+    """Poll the CURRENT pointer so every worker picks up snapshots activated by the build CLI."""
+    while True:
+        time.sleep(interval)
+        try:
+            latest = current_version(bot.settings.persist_index_path)
+        except OSError:
+            continue
+        if latest and latest != bot.index_version:
+            _reload_index(latest)
+
+
+def _compact_history() -> dict:
+    idle_after = bot.settings.history_archive_after_days * 86400
+    return bot.history.compact(idle_after).as_dict()
+
+
+def _compact_history_periodically(interval: float) -> None:
+    """Archive idle chat sessions every `interval` seconds (HISTORY_COMPACT_INTERVAL)."""
+    while True:
+        time.sleep(interval)
+        try:
+            _compact_history()
+        except Exception:  # noqa: BLE001
+            logger.exception("history_compaction_failed")
+
+
+# `kill -HUP <pid>`: nạp snapshot đang active ở background, không chặn request
+if hasattr(signal, "SIGHUP") and threading.current_thread() is threading.main_thread():
+    signal.signal(
+        signal.SIGHUP,
+        lambda signum, frame: threading.Thread(target=_reload_index, name="index-reload", daemon=True).start(),
+    )
+if bot.settings.persist_index and bot.settings.index_watch_interval > 0:
+    threading.Thread(
+        target=_watch_index, args=(bot.settings.index_watch_interval,), name="index-watch", daemon=True
+    ).start()
+if bot.settings.history_compact_interval > 0 and bot.settings.history_archive_after_days > 0:
+    threading.Thread(
+        target=_compact_history_periodically,
+        args=(bot.settings.history_compact_interval,),
+        name="history-compact",
+        daemon=True,
+    ).start()
+
+
 class ChatRequest(BaseModel):
     message: str
     session_id: str = "default"
+    # Giới hạn tìm kiếm trong một/nhiều collection (thư mục con của docs) và lọc theo metadata
+    collection: Optional[Union[str, List[str]]] = None
+    filter: Optional[Dict[str, Any]] = None
+    # Hạng ưu tiên khi xếp hàng gọi LLM (PRIORITY_TIERS); header X-Priority có tác dụng tương tự
+    priority: Optional[str] = None
+
+
+def _tier_for(priority: Optional[str]) -> str:
+    try:
+        return bot.scheduler.tier_for(priority)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+def _busy(exc: SchedulerBusy) -> HTTPException:
+    retry_after = max(1, int(bot.settings.scheduler_queue_timeout))
+    return HTTPException(status_code=429, detail=str(exc), headers={"Retry-After": str(retry_after)})
+
+
+def _collections_for(collection: Optional[Union[str, List[str]]]) -> Optional[List[str]]:
+    """Normalize the request's `collection` field and reject names that have no shard."""
+    if not collection:
+        return None
+    names = [collection] if isinstance(collection, str) else list(collection)
+    try:
+        available = bot.collections
+    except Exception:  # noqa: BLE001
+        # Index chưa sẵn sàng: để chatbot tự báo lỗi như trước
+        return names
+    unknown = sorted(set(names) - set(available))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown collection(s): {', '.join(unknown)}")
+    return names
 
 
 @app.get("/health")
@@ -39,56 +153,98 @@ def health() -> dict[str, str]:
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+def metrics() -> PlainTextResponse:
+    """Prometheus scrape endpoint (stage latency histograms, tokens, cache hits, websockets)."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/collections")
+def list_collections() -> dict:
+    """Collections (one index shard each) with their chunk counts."""
+    try:
+        return {"collections": bot.collections, "index_version": bot.index_version}
+    except Exception as e:  # noqa: BLE001
+        raise HTTPException(status_code=503, detail=f"Index not available: {str(e)}")
+
+
+_MAX_SEARCH_QUERIES = 32
+
+
+class SearchRequest(BaseModel):
+    query: Optional[str] = None
+    queries: List[str] = Field(default_factory=list, max_length=_MAX_SEARCH_QUERIES)
+    k: int = Field(default=5, ge=1, le=50)
+    collection: Optional[Union[str, List[str]]] = None
+    filter: Optional[Dict[str, Any]] = None
+
+
+def _search(
+    queries: List[str],
+    k: int,
+    collection: Optional[Union[str, List[str]]],
+    metadata_filter: Optional[Dict[str, Any]],
+) -> dict:
+    queries = [query.strip() for query in queries if query and query.strip()]
+    if not queries:
+        raise HTTPException(status_code=400, detail="At least one non-empty query is required")
+    if len(queries) > _MAX_SEARCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {_MAX_SEARCH_QUERIES} queries per request")
+    collections = _collections_for(collection)
+    started = time.perf_counter()
+    try:
+        results = bot.search(queries, k, collections=collections, metadata_filter=metadata_filter)
+    except Exception as e:  # noqa: BLE001
+        logger.exception("api_search_failed")
+        raise HTTPException(status_code=500, detail=f"Search error: {str(e)}")
+    return {
+        "results": [
+            {
+                "query": query,
+                "hits": [
+                    {
+                        "content": document.page_content,
+                        # Embedding OpenAI đã chuẩn hóa: khoảng cách L2² = 2 - 2·cosine
+                        "score": round(1.0 - distance / 2.0, 6),
+                        "source": document.metadata.get("source"),
+                        "start_index": document.metadata.get("start_index"),
+                        "collection": document.metadata.get("collection"),
+                        "page": document.metadata.get("page"),
+                    }
+                    for document, distance in hits
+                ],
+            }
+            for query, hits in zip(queries, results)
+        ],
+        "index_version": bot.index_version,
+        "took_ms": round((time.perf_counter() - started) * 1000, 3),
+    }
+
+
+@app.get("/api/search")
+def search(
+    q: List[str] = Query(...),
+    k: int = Query(5, ge=1, le=50),
+    collection: Optional[List[str]] = Query(None),
+) -> dict:
+    """Related chunks for one or more `q` parameters, straight from the index (no LLM call)."""
+    return _search(q, k, collection, None)
+
+
+@app.post("/api/search")
+def search_batch(request: SearchRequest) -> dict:
+    """Batched variant of `GET /api/search`; also accepts a metadata `filter`."""
+    queries = ([request.query] if request.query else []) + request.queries
+    return _search(queries, request.k, request.collection, request.filter)
+
+
 @app.get("/api/sessions")
-def list_sessions() -> dict:
-    """List all chat sessions with metadata."""
-    history_dir = Path("data/chat_history")
-    history_dir.mkdir(parents=True, exist_ok=True)
-    
-    sessions = []
-    for file_path in history_dir.glob("*.json"):
-        # Skip metadata files
-        if file_path.name.endswith("_meta.json"):
-            continue
-            
-        session_id = file_path.stem
-        try:
-            stat = file_path.stat()
-            # Get custom title from metadata
-            metadata = _get_session_metadata(session_id)
-            custom_title = metadata.get("custom_title")
-            
-            # Get first message as title if no custom title
-            title = custom_title if custom_title else "New Chat"
-            if not custom_title:
-                from langchain_community.chat_message_histories import FileChatMessageHistory
-                chat_history = FileChatMessageHistory(str(file_path))
-                messages = chat_history.messages
-                if messages:
-                    first_msg = messages[0]
-                    content = getattr(first_msg, "content", "")
-                    if content:
-                        title = str(content)[:50] + ("..." if len(str(content)) > 50 else "")
-            
-            # Count messages
-            from langchain_community.chat_message_histories import FileChatMessageHistory
-            chat_history = FileChatMessageHistory(str(file_path))
-            messages = chat_history.messages
-            message_count = len([m for m in messages if hasattr(m, "content")])
-            
-            sessions.append({
-                "id": session_id,
-                "title": title,
-                "created_at": stat.st_ctime,
-                "updated_at": stat.st_mtime,
-                "message_count": message_count,
-            })
-        except Exception:  # noqa: BLE001
-            continue
-    
-    # Sort by updated_at descending (newest first)
-    sessions.sort(key=lambda x: x["updated_at"], reverse=True)
-    return {"sessions": sessions}
+def list_sessions(request: Request) -> Response:
+    """List all chat sessions (live and archived) with metadata; 304 when nothing changed."""
+    parts, last_modified = bot.history.listing_version()
+    return conditional_json(
+        request, make_etag(parts), last_modified, lambda: {"sessions": bot.history.summaries()}
+    )
 
 
 @app.post("/api/sessions")
@@ -96,53 +252,28 @@ def create_session() -> dict:
     """Create a new chat session."""
     import uuid
     session_id = str(uuid.uuid4())
-    # Create empty history file
-    history_dir = Path("data/chat_history")
-    history_dir.mkdir(parents=True, exist_ok=True)
-    file_path = history_dir / f"{session_id}.json"
-    file_path.write_text("[]", encoding="utf-8")
-    # Create metadata file
-    meta_path = history_dir / f"{session_id}_meta.json"
-    meta_path.write_text(json.dumps({"custom_title": None}), encoding="utf-8")
+    bot.history.create(session_id)
     return {"session_id": session_id}
 
 
 def _get_session_metadata(session_id: str) -> dict:
     """Load session metadata (custom title)."""
-    history_dir = Path("data/chat_history")
-    meta_path = history_dir / f"{session_id}_meta.json"
-    if meta_path.exists():
-        try:
-            with meta_path.open("r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception:  # noqa: BLE001
-            return {"custom_title": None}
-    return {"custom_title": None}
+    return bot.history.load_metadata(session_id)
 
 
 def _save_session_metadata(session_id: str, metadata: dict) -> None:
     """Save session metadata."""
-    history_dir = Path("data/chat_history")
-    history_dir.mkdir(parents=True, exist_ok=True)
-    meta_path = history_dir / f"{session_id}_meta.json"
-    with meta_path.open("w", encoding="utf-8") as f:
-        json.dump(metadata, f, ensure_ascii=False, indent=2)
+    bot.history.save_metadata(session_id, metadata)
 
 
 @app.delete("/api/sessions/{session_id}")
 def delete_session(session_id: str) -> dict:
     """Delete a chat session and its metadata."""
-    history_dir = Path("data/chat_history")
-    file_path = history_dir / f"{session_id}.json"
-    meta_path = history_dir / f"{session_id}_meta.json"
-    
-    if not file_path.exists():
+    if not bot.history.exists(session_id):
         raise HTTPException(status_code=404, detail="Session not found")
     
     try:
-        file_path.unlink()
-        if meta_path.exists():
-            meta_path.unlink()
+        bot.history.delete(session_id)
         return {"status": "deleted"}
     except Exception as e:  # noqa: BLE001
         raise HTTPException(status_code=500, detail=f"Error deleting session: {str(e)}")
@@ -155,10 +286,7 @@ class RenameRequest(BaseModel):
 @app.put("/api/sessions/{session_id}/rename")
 def rename_session(session_id: str, request: RenameRequest) -> dict:
     """Rename a chat session."""
-    history_dir = Path("data/chat_history")
-    file_path = history_dir / f"{session_id}.json"
-    
-    if not file_path.exists():
+    if not bot.history.exists(session_id):
         raise HTTPException(status_code=404, detail="Session not found")
     
     try:
@@ -171,17 +299,18 @@ def rename_session(session_id: str, request: RenameRequest) -> dict:
 
 
 @app.get("/api/history/{session_id}")
-def get_history(session_id: str) -> dict:
-    """Load chat history from saved file."""
-    from langchain_community.chat_message_histories import FileChatMessageHistory
-    
-    history_dir = Path("data/chat_history")
-    history_dir.mkdir(parents=True, exist_ok=True)
-    file_path = history_dir / f"{session_id}.json"
-    
+def get_history(session_id: str, request: Request) -> Response:
+    """Load chat history from the session file or, for idle sessions, the archive."""
+    version = bot.history.session_version(session_id)
+    if version is None:
+        return JSONResponse({"messages": []})
+    parts, last_modified = version
+    return conditional_json(request, make_etag(parts), last_modified, lambda: _history_payload(session_id))
+
+
+def _history_payload(session_id: str) -> dict:
     try:
-        chat_history = FileChatMessageHistory(str(file_path))
-        messages_list = chat_history.messages
+        messages_list = bot.history.messages(session_id)
         
         # Convert LangChain messages to frontend format
         messages = []
@@ -201,28 +330,100 @@ def get_history(session_id: str) -> dict:
         
         return {"messages": messages}
     except Exception as e:  # noqa: BLE001
-        # If file doesn't exist or is empty, return empty list
-        if not file_path.exists():
-            return {"messages": []}
         raise HTTPException(status_code=500, detail=f"Error loading history: {str(e)}")
 
 
+def _require_admin(token: Optional[str]) -> None:
+    expected = bot.settings.admin_token
+    if not (expected and token and hmac.compare_digest(token.encode("utf-8"), expected.encode("utf-8"))):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+def _profiler_for(token: Optional[str]) -> Optional[SamplingProfiler]:
+    """Return a profiler when the caller asked for one (header/query/payload) and is allowed to."""
+    if not token:
+        return None
+    if not profiling_authorized(bot.settings, token):
+        raise HTTPException(status_code=403, detail="Profiling is disabled or token is invalid")
+    return SamplingProfiler(interval=bot.settings.profile_interval)
+
+
 @app.post("/api/chat")
-def chat(request: ChatRequest) -> dict[str, str]:
+async def chat(request: ChatRequest, http_request: Request, response: Response) -> dict[str, str]:
+    profiler = _profiler_for(http_request.headers.get("x-profile-token") or http_request.query_params.get("profile"))
+    # bot.collections có thể phải nạp/build index: không chạy trên event loop
+    collections = await run_in_threadpool(_collections_for, request.collection)
+    tier = _tier_for(request.priority or http_request.headers.get("x-priority"))
+    options = dict(session_id=request.session_id, collections=collections, metadata_filter=request.filter, priority=tier)
     try:
-        answer = bot.ask(request.message, session_id=request.session_id)
+        if profiler is None:
+            # Chờ slot trên event loop: request xếp hàng không chiếm thread của threadpool
+            answer = await bot.aask(request.message, **options)
+        else:
+            answer = await run_in_threadpool(_ask_profiled, profiler, response, request.message, options)
         return {"answer": answer}
+    except SchedulerBusy as e:
+        raise _busy(e)
     except Exception as e:  # noqa: BLE001
-        import traceback
-        error_detail = str(e)
-        traceback_str = traceback.format_exc()
-        print(f"Error in /api/chat: {error_detail}\n{traceback_str}")
-        raise HTTPException(status_code=500, detail=f"Chat error: {error_detail}")
+        logger.exception("api_chat_failed", extra={"fields": {"session_id": request.session_id}})
+        raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
+
+
+def _ask_profiled(profiler: SamplingProfiler, response: Response, message: str, options: Dict[str, Any]) -> str:
+    # Profiler lấy mẫu thread đang chạy chain, nên cả request chạy đồng bộ trong thread này
+    profiler.thread_id = threading.get_ident()
+    profiler.start()
+    try:
+        return bot.ask(message, **options)
+    finally:
+        artifact = profiler.stop().write(bot.settings.profile_dir, "api_chat")
+        response.headers["X-Profile-Artifact"] = artifact.name
+
+
+class ReloadIndexRequest(BaseModel):
+    version: Optional[str] = None
+
+
+@app.post("/api/admin/reload-index", status_code=202)
+def reload_index(
+    background_tasks: BackgroundTasks,
+    request: Optional[ReloadIndexRequest] = None,
+    x_admin_token: Optional[str] = Header(default=None),
+) -> dict:
+    """Load a snapshot (default: the active one) in the background and swap the retriever."""
+    _require_admin(x_admin_token)
+    version = request.version if request else None
+    background_tasks.add_task(_reload_index, version)
+    return {"status": "reloading", "current_version": bot.index_version, "requested_version": version}
+
+
+@app.post("/api/admin/compact-history")
+def compact_history(x_admin_token: Optional[str] = Header(default=None)) -> dict:
+    """Archive idle sessions now and report how many files/bytes were reclaimed."""
+    _require_admin(x_admin_token)
+    if bot.settings.history_archive_after_days <= 0:
+        raise HTTPException(status_code=400, detail="History archiving is disabled (HISTORY_ARCHIVE_AFTER_DAYS=0)")
+    return _compact_history()
+
+
+@app.get("/api/admin/profiles/{name}")
+def download_profile(name: str, x_admin_token: Optional[str] = Header(default=None)) -> FileResponse:
+    """Download a saved folded-stack profile (render with speedscope/flamegraph.pl)."""
+    _require_admin(x_admin_token)
+    if not re.fullmatch(r"[\w.-]+\.folded", name):
+        raise HTTPException(status_code=400, detail="Invalid profile name")
+    path = bot.settings.profile_dir / name
+    if not path.exists():
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain")
 
 
 @app.websocket("/ws/chat")
 async def chat_ws(websocket: WebSocket) -> None:
     await websocket.accept()
+    ACTIVE_WEBSOCKETS.inc()
+    connection_profile = websocket.headers.get("x-profile-token") or websocket.query_params.get("profile")
+    connection_priority = websocket.headers.get("x-priority") or websocket.query_params.get("priority")
     try:
         while True:
             payload = await websocket.receive_json()
@@ -231,20 +432,49 @@ async def chat_ws(websocket: WebSocket) -> None:
             if not question:
                 await websocket.send_json({"type": "error", "message": "Câu hỏi trống."})
                 continue
+            try:
+                collections = await run_in_threadpool(_collections_for, payload.get("collection"))
+                tier = _tier_for(payload.get("priority") or connection_priority)
+                profiler = _profiler_for(payload.get("profile") or connection_profile)
+            except HTTPException as exc:
+                await websocket.send_json({"type": "error", "message": exc.detail})
+                continue
 
             await websocket.send_json({"type": "status", "message": "processing"})
-            async for chunk in _stream_answer(question, session_id):
-                await websocket.send_json({"type": "token", "token": chunk})
-            await websocket.send_json({"type": "done"})
+            done: dict = {"type": "done"}
+            # Lấy mẫu thread event loop: bao gồm cả các coroutine khác đang chạy đồng thời
+            if profiler is not None:
+                profiler.start()
+            try:
+                async for chunk in _stream_answer(question, session_id, collections, payload.get("filter"), tier):
+                    await websocket.send_json({"type": "token", "token": chunk})
+            except SchedulerBusy as exc:
+                # Quá tải: báo lỗi cho câu hỏi này nhưng giữ kết nối để client thử lại
+                await websocket.send_json({"type": "error", "code": 429, "message": str(exc)})
+                continue
+            finally:
+                if profiler is not None:
+                    done["profile"] = profiler.stop().write(bot.settings.profile_dir, "ws_chat").name
+            await websocket.send_json(done)
     except WebSocketDisconnect:
         return
     except Exception as exc:  # noqa: BLE001
         await websocket.send_json({"type": "error", "message": str(exc)})
         await websocket.close()
-
-
-async def _stream_answer(question: str, session_id: str) -> AsyncIterator[str]:
-    async for token in bot.astream(question, session_id=session_id):
+    finally:
+        ACTIVE_WEBSOCKETS.dec()
+
+
+async def _stream_answer(
+    question: str,
+    session_id: str,
+    collections: Optional[List[str]] = None,
+    metadata_filter: Optional[Dict[str, Any]] = None,
+    priority: Optional[str] = None,
+) -> AsyncIterator[str]:
+    async for token in bot.astream(
+        question, session_id=session_id, collections=collections, metadata_filter=metadata_filter, priority=priority
+    ):
         yield token
 
 # --- Serve frontend build (Vite) ---
@@ -253,11 +483,9 @@ from pathlib import Path as _Path
 _dist_dir = _Path("web/dist").resolve()
 if _dist_dir.exists():
     # Mount at root; API remains under /api/*
-    app.mount("/", StaticFiles(directory=str(_dist_dir), html=True), name="frontend")
+    app.mount("/", CachedStaticFiles(directory=str(_dist_dir), html=True), name="frontend")
 else:
     # Minimal placeholder when dist is missing
     @app.get("/")
     def _index_placeholder() -> dict:
         return {"message": "Frontend not built. Run 'npm ci --prefix web && npm run build --prefix web'."}
-
-
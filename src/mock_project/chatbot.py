@@ -1,174 +1,540 @@
 from __future__ import annotations
 
 import asyncio
-from pathlib import Path
-from typing import AsyncIterator, Optional
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
 import requests
 
 from langchain.callbacks.streaming_aiter import AsyncIteratorCallbackHandler
 from langchain.chains import ConversationalRetrievalChain
 from langchain.memory import ConversationSummaryBufferMemory
-from langchain_community.chat_message_histories import FileChatMessageHistory
+from langchain_community.vectorstores import FAISS
 from langchain_openai import ChatOpenAI
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
+from .condense import SpeculativeRetrievalChain, configure_speculation_pool
 from .config import Settings, get_settings
+from .dedup import DedupReport, deduplicate_chunks
 from .document_loader import load_documents, split_documents
-from .vectorstore import VectorStoreBuilder, get_retriever
+from .faq import FaqIndex
+from .history import HistoryStore
+from .observability import RequestTrace, StageTimingHandler, logger, record_cache, run_traced, stage, track
+from .profiling import SamplingProfiler
+from .resilience import DeadlineBudget, HedgedChatModel, configure_pools, deadline_budget, run_within
+from .retrieval import ShardedRetriever
+from .scheduler import FairScheduler, SchedulerBusy
+from .vectorstore import VectorStoreBuilder, get_retriever, group_by_collection, resolve_snapshot
 
 
 class CustomerSupportChatbot:
     """High-level interface that manages ingestion and Q&A interactions."""
 
-    def __init__(self, settings: Optional[Settings] = None) -> None:
+    def __init__(
+        self,
+        settings: Optional[Settings] = None,
+        *,
+        llm_factory: Optional[Callable[..., BaseChatModel]] = None,
+        embeddings: Optional[Embeddings] = None,
+    ) -> None:
         self.settings = settings or get_settings()
-        self._retriever = None
+        # Cho phép thay ChatOpenAI/OpenAIEmbeddings (benchmark, test offline)
+        self._llm_factory = llm_factory
+        self._embeddings = embeddings
+        self._builder: Optional[VectorStoreBuilder] = None
+        self._retriever: Optional[ShardedRetriever] = None
+        self._reload_lock = threading.Lock()
+        self.index_version: Optional[str] = None
+        self.last_dedup_report: Optional[DedupReport] = None
+        # Snapshot do build_index() gần nhất ghi ra (kể cả khi không activate)
+        self.last_built_version: Optional[str] = None
         self._prompt = _build_prompt()
         self._answer_cache: dict[str, str] = {}
+        self.history = HistoryStore(self.settings.chat_history_path)
+        self.scheduler = FairScheduler(
+            concurrency=self.settings.llm_concurrency,
+            tiers=self.settings.priority_tiers,
+            default_tier=self.settings.default_priority,
+            tokens_per_minute=self.settings.llm_tokens_per_minute,
+            queue_timeout=self.settings.scheduler_queue_timeout,
+            max_queue=self.settings.scheduler_max_queue,
+        )
+        self.faq = self._load_faq()
+        if self.settings.speculative_retrieval:
+            configure_speculation_pool(self.settings.speculative_pool_size)
+        if self._resilient:
+            configure_pools(
+                llm_workers=self.settings.llm_pool_size, retrieve_workers=self.settings.retrieval_pool_size
+            )
 
     def init_index(self) -> None:
         """Initialize retriever with optional FAISS persistence to reduce cold-start latency."""
         if self._retriever:
             return
-        builder = VectorStoreBuilder(self.settings)
-        vector_store = None
+        if not self.settings.profile_index_build:
+            self._init_index()
+            return
+        # Chế độ lấy mẫu liên tục, chu kỳ thưa để overhead thấp khi build index
+        profiler = SamplingProfiler(interval=max(self.settings.profile_interval, 0.02)).start()
         try:
-            if self.settings.persist_index and not self.settings.reindex_on_start:
-                persist_path = self.settings.persist_index_path
-                if persist_path.exists():
-                    vector_store = builder.load_from_disk(persist_path)
-        except Exception:
-            vector_store = None
-
-        if vector_store is None:
+            self._init_index()
+        finally:
+            artifact = profiler.stop().write(self.settings.profile_dir, "init_index")
+            logger.info("profile_saved", extra={"fields": {"operation": "init_index", "artifact": str(artifact)}})
+
+    def _init_index(self) -> None:
+        with track("init_index") as trace:
+            shards = None
+            try:
+                if self.settings.persist_index and not self.settings.reindex_on_start:
+                    with trace.stage("load_index"):
+                        shards, self.index_version = self._load_snapshot()
+            except Exception:
+                shards = None
+
+            if shards is None:
+                shards = self.build_index()
+
+            self._retriever = get_retriever(shards, k=self.settings.retriever_k, settings=self.settings)
+
+    @property
+    def collections(self) -> Dict[str, int]:
+        """Loaded collections (one FAISS shard each) and their chunk counts."""
+        retriever = self._get_retriever()
+        return {name: store.index.ntotal for name, store in sorted(retriever.shards.items())}
+
+    def build_index(self, *, activate: bool = True) -> Dict[str, FAISS]:
+        """Load, split and embed the docs; persist a new snapshot when `persist_index` is on."""
+        builder = self._get_builder()
+        with stage("load_documents"):
             documents = load_documents(self.settings)
+        with stage("split"):
             chunks = split_documents(self.settings, documents)
-            if self.settings.persist_index:
-                vector_store = builder.build(chunks, persist_path=self.settings.persist_index_path)
-            else:
-                vector_store = builder.build(chunks)
+        manifest = {}
+        if self.settings.chunk_dedup:
+            # Bỏ chunk trùng (vd. cùng nội dung ở DOCX và PDF) trước khi tốn tiền embedding.
+            # Dedup trong từng collection để mỗi shard vẫn đủ nội dung khi search theo phạm vi.
+            with stage("dedup"):
+                groups = group_by_collection(chunks)
+                chunks, report = [], DedupReport()
+                for members in groups.values():
+                    kept, partial = deduplicate_chunks(members, threshold=self.settings.chunk_dedup_threshold)
+                    chunks.extend(kept)
+                    report.merge(partial)
+            self.last_dedup_report = report
+            manifest["dedup"] = report.as_dict()
+            logger.info("chunk_dedup", extra={"fields": report.as_dict()})
+        with stage("build"):
+            persist_path = self.settings.persist_index_path if self.settings.persist_index else None
+            shards = builder.build(chunks, persist_path=persist_path, activate=activate, manifest=manifest)
+        if persist_path:
+            self.last_built_version = builder.last_version
+        if activate:
+            self.index_version = builder.last_version
+        return shards
+
+    def reload_index(self, version: Optional[str] = None) -> Optional[str]:
+        """Load a persisted snapshot (the active one by default) and swap the retriever.
+
+        The swap is a single attribute assignment: requests that already built their
+        chain keep using the old retriever until they finish.
+        """
+        with self._reload_lock:
+            with track("reload_index"):
+                shards, loaded_version = self._load_snapshot(version)
+            self._retriever = get_retriever(shards, k=self.settings.retriever_k, settings=self.settings)
+            self.index_version = loaded_version
+            self._answer_cache.clear()
+            # FAQ được sinh cùng bộ tài liệu (scripts/update_docs.py) nên nạp lại cùng lúc
+            self.faq = self._load_faq()
+            return loaded_version
 
-        self._retriever = get_retriever(vector_store, k=self.settings.retriever_k)
+    def _load_snapshot(self, version: Optional[str] = None) -> tuple[Dict[str, FAISS], str]:
+        snapshot = resolve_snapshot(self.settings.persist_index_path, version)
+        return self._get_builder().load_from_disk(snapshot), snapshot.name
 
-    def _get_retriever(self):
+    def _load_faq(self) -> Optional[FaqIndex]:
+        path = self.settings.faq_path
+        if not self.settings.faq_fast_path or not path.exists():
+            return None
+        try:
+            return FaqIndex.load(path, threshold=self.settings.faq_threshold)
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            logger.warning("faq_load_failed", extra={"fields": {"path": str(path), "error": str(exc)}})
+            return None
+
+    def _get_builder(self) -> VectorStoreBuilder:
+        # Một builder cho cả vòng đời bot để cache embedding câu hỏi sống qua các lần reload
+        if self._builder is None:
+            self._builder = VectorStoreBuilder(self.settings, embeddings=self._embeddings)
+        return self._builder
+
+    def _get_retriever(self) -> ShardedRetriever:
         if not self._retriever:
             self.init_index()
         return self._retriever
 
-    def build_chain(self, session_id: str = "default") -> ConversationalRetrievalChain:
-        retriever = self._get_retriever()
+    def build_chain(
+        self,
+        session_id: str = "default",
+        *,
+        collections: Optional[List[str]] = None,
+        metadata_filter: Optional[Dict[str, Any]] = None,
+    ) -> ConversationalRetrievalChain:
+        """Chain for one session; `collections`/`metadata_filter` restrict which chunks are retrieved."""
+        retriever = self._get_retriever().scoped(collections, metadata_filter)
         llm = self._create_llm()
 
-        history_dir = Path("data/chat_history")
-        history_dir.mkdir(parents=True, exist_ok=True)
-        file_path = history_dir / f"{session_id}.json"
-
-        chat_memory = FileChatMessageHistory(str(file_path))
+        chat_memory = self.history.chat_history(session_id)
 
         memory = ConversationSummaryBufferMemory(
             chat_memory=chat_memory,
             memory_key="chat_history",
             return_messages=True,
-            llm=self._create_llm(),
+            llm=self._create_llm(stage="summarize"),
             output_key="answer",
             max_token_limit=1200,
         )
 
         # Dùng default prompt của ConversationalRetrievalChain
         # Chain tự động xử lý chat_history với format đúng (list of messages)
-        return ConversationalRetrievalChain.from_llm(
+        return SpeculativeRetrievalChain.from_llm(
             llm=llm,
             retriever=retriever,
             memory=memory,
-            verbose=True,
+            verbose=False,
             combine_docs_chain_kwargs={"prompt": self._prompt},
+            condense_question_llm=self._create_condense_llm(),
+            speculative_retrieval=self.settings.speculative_retrieval,
+            reuse_threshold=self.settings.speculative_similarity,
         )
 
-    def ask(self, question: str, session_id: str = "default") -> str:
+    def search(
+        self,
+        queries: List[str],
+        k: Optional[int] = None,
+        *,
+        collections: Optional[List[str]] = None,
+        metadata_filter: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Tuple[Document, float]]]:
+        """Top-`k` chunks (with L2 distance) for each query straight from the index, without the LLM."""
+        with track("search", sample_rate=self.settings.log_sample_rate) as trace:
+            retriever = self._get_retriever().scoped(collections, metadata_filter)
+            with trace.stage("retrieve"):
+                return retriever.search(queries, k)
+
+    def ask(
+        self,
+        question: str,
+        session_id: str = "default",
+        *,
+        collections: Optional[List[str]] = None,
+        metadata_filter: Optional[Dict[str, Any]] = None,
+        priority: Optional[str] = None,
+    ) -> str:
+        """Answer `question`; LLM work waits for a `priority` tier slot (raises `SchedulerBusy`)."""
         if not question.strip():
             return "Vui lòng nhập câu hỏi hợp lệ."
+        tier = self.scheduler.tier_for(priority)
 
-        try:
-            cache_key = f"{session_id}|{question.strip().lower()}"
-            if cache_key in self._answer_cache:
-                return self._answer_cache[cache_key]
-            # Fallback: nếu không có dữ liệu nội bộ, gọi trực tiếp OpenAI
-            if not self.settings.docs_exist:
-                answer = self._ask_openai_direct(question)
-                self._append_history(session_id, question, answer)
+        with track("ask", session_id, sample_rate=self.settings.log_sample_rate) as trace:
+            cache_key = f"{session_id}|{_scope_key(collections, metadata_filter)}|{question.strip().lower()}"
+            try:
+                answer = self._quick_answer(trace, cache_key, question, session_id, collections, metadata_filter)
+                if answer is not None:
+                    return answer
+                # Cache hit không tốn LLM nên không phải xếp hàng
+                with self.scheduler.slot(session_id, tier, self._estimate_tokens(question)) as ticket:
+                    answer = self._answer(trace, question, session_id, collections, metadata_filter)
+                    ticket.settle(trace.tokens_in + trace.tokens_out)
                 self._answer_cache[cache_key] = answer
                 return answer
+            except SchedulerBusy:
+                # Hết chỗ: để API trả 429 thay vì một câu trả lời lỗi
+                raise
+            except Exception as e:  # noqa: BLE001
+                return self._recover(trace, e, cache_key, question, session_id)
 
-            chain = self.build_chain(session_id=session_id)
-            response = chain.invoke({"question": question})
-            answer = response.get("answer", "Xin lỗi, không thể tạo phản hồi.")
-            self._answer_cache[cache_key] = answer
-            return answer
-        except Exception as e:  # noqa: BLE001
-            # Nếu lỗi liên quan đến token counting/model không được hỗ trợ, fallback gọi trực tiếp
-            if "get_num_tokens_from_messages" in str(e) or "tiktoken" in str(e):
-                try:
-                    answer = self._ask_openai_direct(question)
-                    self._append_history(session_id, question, answer)
-                    self._answer_cache[cache_key] = answer
+    async def aask(
+        self,
+        question: str,
+        session_id: str = "default",
+        *,
+        collections: Optional[List[str]] = None,
+        metadata_filter: Optional[Dict[str, Any]] = None,
+        priority: Optional[str] = None,
+    ) -> str:
+        """Async `ask`: waits for the tier slot on the event loop and runs only the chain in a thread."""
+        if not question.strip():
+            return "Vui lòng nhập câu hỏi hợp lệ."
+        tier = self.scheduler.tier_for(priority)
+
+        with track("ask", session_id, sample_rate=self.settings.log_sample_rate) as trace:
+            cache_key = f"{session_id}|{_scope_key(collections, metadata_filter)}|{question.strip().lower()}"
+            try:
+                # Khớp FAQ và ghi lịch sử là I/O đồng bộ: chỉ việc chờ slot nằm trên event loop
+                answer = await asyncio.to_thread(
+                    self._quick_answer, trace, cache_key, question, session_id, collections, metadata_filter
+                )
+                if answer is not None:
                     return answer
-                except Exception:
-                    pass
-            import traceback
-            error_msg = f"Lỗi khi xử lý câu hỏi: {str(e)}"
-            print(f"Chatbot error: {error_msg}\n{traceback.format_exc()}")
-            return f"Xin lỗi, đã xảy ra lỗi: {str(e)}"
-
-    async def astream(self, question: str, session_id: str = "default") -> AsyncIterator[str]:
+                # Request xếp hàng không giữ thread nào; to_thread sao chép context nên trace vẫn nhận stage
+                async with self.scheduler.aslot(session_id, tier, self._estimate_tokens(question)) as ticket:
+                    answer = await asyncio.to_thread(
+                        self._answer, trace, question, session_id, collections, metadata_filter
+                    )
+                    ticket.settle(trace.tokens_in + trace.tokens_out)
+                self._answer_cache[cache_key] = answer
+                return answer
+            except SchedulerBusy:
+                raise
+            except Exception as e:  # noqa: BLE001
+                return await asyncio.to_thread(self._recover, trace, e, cache_key, question, session_id)
+
+    def _quick_answer(
+        self,
+        trace: RequestTrace,
+        cache_key: str,
+        question: str,
+        session_id: str,
+        collections: Optional[List[str]],
+        metadata_filter: Optional[Dict[str, Any]],
+    ) -> Optional[str]:
+        """Answer from the answer cache or the FAQ, or None when the question needs the LLM."""
+        cached = self._answer_cache.get(cache_key)
+        record_cache("answer", cached is not None)
+        if cached is not None:
+            return cached
+        return self._faq_answer(trace, question, session_id, collections, metadata_filter)
+
+    def _recover(self, trace: RequestTrace, error: Exception, cache_key: str, question: str, session_id: str) -> str:
+        # Nếu lỗi liên quan đến token counting/model không được hỗ trợ, fallback gọi trực tiếp
+        if "get_num_tokens_from_messages" in str(error) or "tiktoken" in str(error):
+            try:
+                answer = self._ask_direct_with_history(trace, question, session_id)
+                self._answer_cache[cache_key] = answer
+                return answer
+            except Exception:
+                pass
+        # Lỗi được ghi log có cấu trúc khi trace kết thúc
+        trace.error = error
+        return f"Xin lỗi, đã xảy ra lỗi: {str(error)}"
+
+    def _faq_answer(
+        self,
+        trace: RequestTrace,
+        question: str,
+        session_id: str,
+        collections: Optional[List[str]],
+        metadata_filter: Optional[Dict[str, Any]],
+    ) -> Optional[str]:
+        """Curated answer when the question confidently matches the FAQ (no retrieval, no LLM)."""
+        # Câu hỏi giới hạn theo collection/filter muốn câu trả lời từ đúng phạm vi đó
+        if self.faq is None or collections or metadata_filter:
+            return None
+        with trace.stage("faq"):
+            match = self.faq.match(question)
+        record_cache("faq", match is not None)
+        if match is None:
+            return None
+        with trace.stage("history_write"):
+            self._append_history(session_id, question, match.answer)
+        return match.answer
+
+    def _answer(
+        self,
+        trace: RequestTrace,
+        question: str,
+        session_id: str,
+        collections: Optional[List[str]],
+        metadata_filter: Optional[Dict[str, Any]],
+    ) -> str:
+        # Fallback: nếu không có dữ liệu nội bộ, gọi trực tiếp OpenAI
+        if not self.settings.docs_exist:
+            return self._ask_direct_with_history(trace, question, session_id)
+
+        with trace.stage("build_chain"):
+            chain = self.build_chain(session_id=session_id, collections=collections, metadata_filter=metadata_filter)
+        with deadline_budget(self._new_budget()):
+            response = chain.invoke({"question": question}, config={"callbacks": [StageTimingHandler(trace)]})
+        return response.get("answer", "Xin lỗi, không thể tạo phản hồi.")
+
+    async def astream(
+        self,
+        question: str,
+        session_id: str = "default",
+        *,
+        collections: Optional[List[str]] = None,
+        metadata_filter: Optional[Dict[str, Any]] = None,
+        priority: Optional[str] = None,
+    ) -> AsyncIterator[str]:
         if not question.strip():
             yield "Vui lòng nhập câu hỏi hợp lệ."
             return
+        tier = self.scheduler.tier_for(priority)
 
+        trace = RequestTrace(operation="astream", session_id=session_id)
+        try:
+            answer = await asyncio.to_thread(
+                self._faq_answer, trace, question, session_id, collections, metadata_filter
+            )
+            if answer is not None:
+                # Câu trả lời soạn sẵn: gửi nguyên văn trong một chunk (giữ xuống dòng, định dạng)
+                yield answer
+                return
+            # Giữ slot suốt thời gian stream: LLM vẫn đang sinh token
+            async with self.scheduler.aslot(session_id, tier, self._estimate_tokens(question)) as ticket:
+                async for token in self._astream(trace, question, session_id, collections, metadata_filter):
+                    yield token
+                ticket.settle(trace.tokens_in + trace.tokens_out)
+        except Exception as e:  # noqa: BLE001
+            trace.error = e
+            raise
+        finally:
+            trace.finish(sample_rate=self.settings.log_sample_rate)
+
+    async def _astream(
+        self,
+        trace: RequestTrace,
+        question: str,
+        session_id: str,
+        collections: Optional[List[str]],
+        metadata_filter: Optional[Dict[str, Any]],
+    ) -> AsyncIterator[str]:
         # Fallback: nếu không có dữ liệu nội bộ, trả lời trực tiếp và giả lập streaming
         if not self.settings.docs_exist:
             try:
-                answer = self._ask_openai_direct(question)
+                answer = self._ask_direct_with_history(trace, question, session_id)
                 # stream theo từ để UX tương tự
                 for tok in answer.split():
                     yield tok + " "
-                self._append_history(session_id, question, answer)
                 return
             except Exception as e:  # noqa: BLE001
+                trace.error = e
                 yield f"Lỗi gọi OpenAI: {str(e)}"
                 return
 
-        chain = self.build_chain(session_id=session_id)
+        with trace.stage("build_chain"):
+            chain = self.build_chain(
+                session_id=session_id, collections=collections, metadata_filter=metadata_filter
+            )
         handler = AsyncIteratorCallbackHandler()
         streaming_llm = self._create_llm(streaming=True, callbacks=[handler])
-        original_llm = chain.llm_chain.llm
-        chain.llm_chain.llm = streaming_llm
+        # LLM sinh câu trả lời nằm trong combine_docs_chain (StuffDocumentsChain)
+        answer_chain = chain.combine_docs_chain.llm_chain
+        original_llm = answer_chain.llm
+        answer_chain.llm = streaming_llm
 
-        task = asyncio.create_task(chain.acall({"question": question}))
+        call = chain.acall({"question": question}, callbacks=[StageTimingHandler(trace)])
+        task = asyncio.create_task(run_traced(trace, run_within(self._new_budget(), call)))
+        # Nếu chain lỗi trước khi LLM chạy, handler không bao giờ nhận on_llm_end
+        task.add_done_callback(lambda _: handler.done.set())
         try:
             async for token in handler.aiter():
                 if token:
                     yield token
             await task
         finally:
-            chain.llm_chain.llm = original_llm
+            answer_chain.llm = original_llm
 
-    def _create_llm(self, *, streaming: bool = False, callbacks: Optional[list] = None) -> ChatOpenAI:
-        return ChatOpenAI(
+    def _create_llm(
+        self, *, streaming: bool = False, callbacks: Optional[list] = None, stage: str = "generate"
+    ) -> BaseChatModel:
+        if self._llm_factory is not None:
+            llm = self._llm_factory(streaming=streaming, callbacks=[] if self._resilient else callbacks or [])
+            return self._with_resilience(llm, stage, streaming=streaming, callbacks=callbacks)
+        return self._openai_llm(
+            stage,
             model=self.settings.chat_model,
             temperature=self.settings.chat_temperature,
+            max_tokens=self.settings.max_tokens,
+            streaming=streaming,
+            callbacks=callbacks,
+        )
+
+    def _create_condense_llm(self) -> Optional[BaseChatModel]:
+        """Model used to rewrite follow-up questions; `None` reuses the answer model."""
+        if not self.settings.condense_model and not self._resilient:
+            return None
+        if self._llm_factory is not None:
+            # Factory của test/benchmark không nhất thiết nhận `model`
+            extra = {"model": self.settings.condense_model} if self.settings.condense_model else {}
+            llm = self._llm_factory(streaming=False, callbacks=[], **extra)
+            return self._with_resilience(llm, "condense")
+        # Model riêng cho condense: deterministic, câu trả lời ngắn
+        return self._openai_llm(
+            "condense",
+            model=self.settings.condense_model or self.settings.chat_model,
+            temperature=0 if self.settings.condense_model else self.settings.chat_temperature,
+            max_tokens=128 if self.settings.condense_model else self.settings.max_tokens,
+        )
+
+    @property
+    def _resilient(self) -> bool:
+        settings = self.settings
+        return settings.request_deadline > 0 or settings.llm_hedge_delay > 0 or settings.llm_hedge_adaptive
+
+    def _openai_llm(
+        self,
+        stage: str,
+        *,
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        streaming: bool = False,
+        callbacks: Optional[list] = None,
+    ) -> BaseChatModel:
+        llm = ChatOpenAI(
+            model=model,
+            temperature=temperature,
             api_key=self.settings.openai_api_key,
+            base_url=self.settings.openai_base_url,
             streaming=streaming,
-            callbacks=callbacks or [],
-            max_tokens=self.settings.max_tokens,
+            callbacks=[] if self._resilient else callbacks or [],
+            max_tokens=max_tokens,
             timeout=self.settings.llm_timeout,
             max_retries=self.settings.llm_max_retries,
         )
+        return self._with_resilience(llm, stage, streaming=streaming, callbacks=callbacks)
+
+    def _with_resilience(
+        self, llm: BaseChatModel, stage: str, *, streaming: bool = False, callbacks: Optional[list] = None
+    ) -> BaseChatModel:
+        if not self._resilient:
+            return llm
+        # Bọc để áp deadline theo stage và gửi request dự phòng (hedge) khi upstream chậm
+        return HedgedChatModel(
+            inner=llm,
+            stage=stage,
+            hedge_delay=self.settings.llm_hedge_delay,
+            adaptive_hedge=self.settings.llm_hedge_adaptive,
+            streaming=streaming,
+            callbacks=callbacks or [],
+        )
+
+    def _new_budget(self) -> Optional[DeadlineBudget]:
+        if self.settings.request_deadline <= 0:
+            return None
+        return DeadlineBudget(total=self.settings.request_deadline, shares=dict(self.settings.deadline_shares))
+
+    def _estimate_tokens(self, question: str) -> int:
+        """Upper-bound token cost charged at admission (~4 chars/token + context + answer)."""
+        return len(question) // 4 + self.settings.context_token_budget + self.settings.max_tokens
+
+    def _ask_direct_with_history(self, trace: RequestTrace, question: str, session_id: str) -> str:
+        with trace.stage("llm_direct"):
+            answer = self._ask_openai_direct(question)
+        with trace.stage("history_write"):
+            self._append_history(session_id, question, answer)
+        return answer
 
     def _ask_openai_direct(self, question: str) -> str:
         """Gọi trực tiếp OpenAI Chat Completions khi không có docs nội bộ.
 
         Sử dụng model từ biến môi trường (OPENAI_MODEL) và endpoint
-        https://api.openai.com/v1/chat/completions.
+        https://api.openai.com/v1/chat/completions (hoặc OPENAI_BASE_URL).
         """
         headers = {
             "Authorization": f"Bearer {self.settings.openai_api_key}",
@@ -187,8 +553,9 @@ class CustomerSupportChatbot:
                 {"role": "user", "content": question},
             ],
         }
+        base_url = (self.settings.openai_base_url or "https://api.openai.com/v1").rstrip("/")
         resp = requests.post(
-            "https://api.openai.com/v1/chat/completions",
+            f"{base_url}/chat/completions",
             headers=headers,
             json=payload,
             timeout=60,
@@ -199,14 +566,18 @@ class CustomerSupportChatbot:
 
     def _append_history(self, session_id: str, question: str, answer: str) -> None:
         """Ghi lịch sử vào file để UI hiển thị lại trong sidebar."""
-        history_dir = Path("data/chat_history")
-        history_dir.mkdir(parents=True, exist_ok=True)
-        file_path = history_dir / f"{session_id}.json"
-        chat_history = FileChatMessageHistory(str(file_path))
+        chat_history = self.history.chat_history(session_id)
         chat_history.add_user_message(question)
         chat_history.add_ai_message(answer)
 
 
+def _scope_key(collections: Optional[List[str]], metadata_filter: Optional[Dict[str, Any]]) -> str:
+    scope = ",".join(sorted(collections or []))
+    if metadata_filter:
+        scope += "|" + repr(sorted(metadata_filter.items()))
+    return scope
+
+
 def _build_prompt() -> ChatPromptTemplate:
     """Friendly, context-aware prompt that highlights company style."""
 
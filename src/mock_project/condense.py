@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain.chains import ConversationalRetrievalChain
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+from langchain_core.callbacks import AsyncCallbackManagerForChainRun, CallbackManagerForChainRun
+from langchain_core.documents import Document
+
+from .dedup import normalize_text
+from .observability import CONDENSE, CONDENSE_SAVED_SECONDS
+from .resilience import DeadlineExceeded
+
+
+def question_similarity(original: str, rewritten: str) -> float:
+    """Character-level similarity of two questions after case/diacritic/punctuation folding."""
+
+    return SequenceMatcher(None, normalize_text(original), normalize_text(rewritten)).ratio()
+
+
+class SpeculativeRetrievalChain(ConversationalRetrievalChain):
+    """`ConversationalRetrievalChain` that can retrieve while the question is being condensed.
+
+    First turns (empty history) skip the condense LLM call entirely, as upstream does.
+    With `speculative_retrieval` on, follow-up turns start retrieval for the raw
+    question concurrently with condensation; when the rewrite is at least
+    `reuse_threshold` similar to the raw question, those documents are used and the
+    overlapped retrieval time is counted as saved. Otherwise retrieval is re-run for
+    the rewritten question. If condensation runs out of its deadline budget, the raw
+    question is used instead of failing the turn.
+    """
+
+    speculative_retrieval: bool = False
+    reuse_threshold: float = 0.9
+
+    def _call(
+        self,
+        inputs: Dict[str, Any],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> Dict[str, Any]:
+        _run_manager = run_manager or CallbackManagerForChainRun.get_noop_manager()
+        question = inputs["question"]
+        chat_history_str = (self.get_chat_history or _get_chat_history)(inputs["chat_history"])
+        new_question, docs = self._condense_and_retrieve(question, chat_history_str, inputs, _run_manager)
+
+        answer = None
+        if self.response_if_no_docs_found is None or docs:
+            answer = self.combine_docs_chain.run(
+                input_documents=docs,
+                callbacks=_run_manager.get_child(),
+                **self._answer_inputs(inputs, new_question, chat_history_str),
+            )
+        return self._output(answer, docs, new_question)
+
+    async def _acall(
+        self,
+        inputs: Dict[str, Any],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> Dict[str, Any]:
+        _run_manager = run_manager or AsyncCallbackManagerForChainRun.get_noop_manager()
+        question = inputs["question"]
+        chat_history_str = (self.get_chat_history or _get_chat_history)(inputs["chat_history"])
+        new_question, docs = await self._acondense_and_retrieve(question, chat_history_str, inputs, _run_manager)
+
+        answer = None
+        if self.response_if_no_docs_found is None or docs:
+            answer = await self.combine_docs_chain.arun(
+                input_documents=docs,
+                callbacks=_run_manager.get_child(),
+                **self._answer_inputs(inputs, new_question, chat_history_str),
+            )
+        return self._output(answer, docs, new_question)
+
+    def _condense_and_retrieve(
+        self,
+        question: str,
+        chat_history_str: str,
+        inputs: Dict[str, Any],
+        run_manager: CallbackManagerForChainRun,
+    ) -> Tuple[str, List[Document]]:
+        if not chat_history_str:
+            CONDENSE.inc(outcome="first_turn")
+            return question, self._get_docs(question, inputs, run_manager=run_manager)
+        if not self.speculative_retrieval:
+            new_question = self._condense(question, chat_history_str, run_manager)
+            CONDENSE.inc(outcome="sequential" if new_question is not None else "deadline")
+            new_question = new_question or question
+            return new_question, self._get_docs(new_question, inputs, run_manager=run_manager)
+
+        # Chạy retrieval trong thread khác, giữ nguyên context (trace hiện tại) của request
+        context = contextvars.copy_context()
+        speculative = _speculation_pool().submit(
+            context.run, _timed, self._get_docs, question, inputs, run_manager=run_manager
+        )
+        started = time.perf_counter()
+        try:
+            new_question = self._condense(question, chat_history_str, run_manager)
+        except BaseException:
+            # Condense lỗi: retrieval dự phòng chưa chạy thì hủy luôn, không giữ worker của pool
+            speculative.cancel()
+            raise
+        if new_question is None:
+            # Hết thời gian condense: dùng luôn câu hỏi gốc và kết quả retrieval đã chạy sẵn
+            CONDENSE.inc(outcome="deadline")
+            return question, speculative.result()[0]
+        condense_seconds = time.perf_counter() - started
+        if question_similarity(question, new_question) >= self.reuse_threshold:
+            docs, retrieve_seconds = speculative.result()
+            self._record_hit(condense_seconds, retrieve_seconds)
+            return new_question, docs
+        speculative.cancel()
+        CONDENSE.inc(outcome="speculative_miss")
+        return new_question, self._get_docs(new_question, inputs, run_manager=run_manager)
+
+    async def _acondense_and_retrieve(
+        self,
+        question: str,
+        chat_history_str: str,
+        inputs: Dict[str, Any],
+        run_manager: AsyncCallbackManagerForChainRun,
+    ) -> Tuple[str, List[Document]]:
+        if not chat_history_str:
+            CONDENSE.inc(outcome="first_turn")
+            return question, await self._aget_docs(question, inputs, run_manager=run_manager)
+        if not self.speculative_retrieval:
+            new_question = await self._acondense(question, chat_history_str, run_manager)
+            CONDENSE.inc(outcome="sequential" if new_question is not None else "deadline")
+            new_question = new_question or question
+            return new_question, await self._aget_docs(new_question, inputs, run_manager=run_manager)
+
+        speculative = asyncio.create_task(_atimed(self._aget_docs(question, inputs, run_manager=run_manager)))
+        started = time.perf_counter()
+        try:
+            new_question = await self._acondense(question, chat_history_str, run_manager)
+        except BaseException:
+            speculative.cancel()
+            raise
+        if new_question is None:
+            CONDENSE.inc(outcome="deadline")
+            return question, (await speculative)[0]
+        condense_seconds = time.perf_counter() - started
+        if question_similarity(question, new_question) >= self.reuse_threshold:
+            docs, retrieve_seconds = await speculative
+            self._record_hit(condense_seconds, retrieve_seconds)
+            return new_question, docs
+        speculative.cancel()
+        CONDENSE.inc(outcome="speculative_miss")
+        return new_question, await self._aget_docs(new_question, inputs, run_manager=run_manager)
+
+    def _condense(
+        self, question: str, chat_history_str: str, run_manager: CallbackManagerForChainRun
+    ) -> Optional[str]:
+        """Standalone rewrite of `question`, or None when the condense deadline ran out."""
+        try:
+            return self.question_generator.run(
+                question=question, chat_history=chat_history_str, callbacks=run_manager.get_child()
+            )
+        except DeadlineExceeded:
+            return None
+
+    async def _acondense(
+        self, question: str, chat_history_str: str, run_manager: AsyncCallbackManagerForChainRun
+    ) -> Optional[str]:
+        try:
+            return await self.question_generator.arun(
+                question=question, chat_history=chat_history_str, callbacks=run_manager.get_child()
+            )
+        except DeadlineExceeded:
+            return None
+
+    @staticmethod
+    def _record_hit(condense_seconds: float, retrieve_seconds: float) -> None:
+        CONDENSE.inc(outcome="speculative_hit")
+        # Phần retrieval chạy chồng lên condense là thời gian tiết kiệm được
+        CONDENSE_SAVED_SECONDS.inc(min(condense_seconds, retrieve_seconds))
+
+    def _answer_inputs(self, inputs: Dict[str, Any], new_question: str, chat_history_str: str) -> Dict[str, Any]:
+        new_inputs = inputs.copy()
+        if self.rephrase_question:
+            new_inputs["question"] = new_question
+        new_inputs["chat_history"] = chat_history_str
+        return new_inputs
+
+    def _output(self, answer: Optional[str], docs: List[Document], new_question: str) -> Dict[str, Any]:
+        output: Dict[str, Any] = {
+            self.output_key: answer if answer is not None else self.response_if_no_docs_found
+        }
+        if self.return_source_documents:
+            output["source_documents"] = docs
+        if self.return_generated_question:
+            output["generated_question"] = new_question
+        return output
+
+
+def _timed(fn: Any, *args: Any, **kwargs: Any) -> Tuple[Any, float]:
+    started = time.perf_counter()
+    return fn(*args, **kwargs), time.perf_counter() - started
+
+
+async def _atimed(awaitable: Any) -> Tuple[Any, float]:
+    started = time.perf_counter()
+    return await awaitable, time.perf_counter() - started
+
+
+_POOL_SIZE = 8
+_POOL: Optional[ThreadPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+
+
+def configure_speculation_pool(workers: int) -> None:
+    """Size the pool that runs sync speculative retrieval (one worker per follow-up turn in flight)."""
+
+    global _POOL, _POOL_SIZE
+    with _POOL_LOCK:
+        workers = max(1, workers)
+        if workers != _POOL_SIZE:
+            _POOL_SIZE = workers
+            # Pool cũ chạy nốt việc đang dở; lượt hỏi mới dùng pool theo kích thước mới
+            if _POOL is not None:
+                _POOL.shutdown(wait=False)
+                _POOL = None
+
+
+def _speculation_pool() -> ThreadPoolExecutor:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ThreadPoolExecutor(max_workers=_POOL_SIZE, thread_name_prefix="speculative-retrieval")
+        return _POOL
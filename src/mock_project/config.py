@@ -1,15 +1,17 @@
 from __future__ import annotations
 
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional
 
 from dotenv import load_dotenv
 
 
 load_dotenv()
 
+VECTOR_STORAGE_TYPES = ("float32", "float16", "int8")
+
 
 @dataclass(slots=True)
 class Settings:
@@ -19,16 +21,63 @@ class Settings:
     chat_model: str
     embedding_model: str
     docs_path: Path
+    condense_model: Optional[str] = None
+    speculative_retrieval: bool = False
+    speculative_similarity: float = 0.9
+    speculative_pool_size: int = 8
+    embedding_dimensions: Optional[int] = None
+    vector_storage: str = "float32"
     chat_temperature: float = 1.0
     max_tokens: int = 512
     llm_timeout: int = 30
     llm_max_retries: int = 1
+    openai_base_url: Optional[str] = None
+    request_deadline: float = 0.0
+    deadline_shares: Dict[str, float] = field(
+        default_factory=lambda: {"condense": 0.25, "retrieve": 0.15, "generate": 0.6}
+    )
+    llm_hedge_delay: float = 0.0
+    llm_hedge_adaptive: bool = False
+    llm_pool_size: int = 32
+    retrieval_pool_size: int = 16
+    llm_concurrency: int = 0
+    llm_tokens_per_minute: int = 0
+    priority_tiers: Dict[str, float] = field(default_factory=lambda: {"premium": 4.0, "standard": 1.0})
+    default_priority: str = "standard"
+    scheduler_queue_timeout: float = 30.0
+    scheduler_max_queue: int = 0
+    faq_fast_path: bool = True
+    faq_path: Path = Path("data/faq.json")
+    faq_threshold: float = 0.7
+    parse_cache: bool = True
+    parse_cache_path: Path = Path("data/parse_cache")
+    ingest_workers: int = 0
     chunk_size: int = 800
     chunk_overlap: int = 150
+    chunk_dedup: bool = True
+    chunk_dedup_threshold: float = 0.7
     retriever_k: int = 3
+    context_packing: bool = True
+    retriever_fetch_k: int = 20
+    mmr_lambda: float = 0.5
+    dedup_threshold: float = 0.95
+    context_token_budget: int = 1500
+    query_embedding_cache_size: int = 1024
     persist_index: bool = True
     persist_index_path: Path = Path("data/faiss")
     reindex_on_start: bool = False
+    index_snapshots_keep: int = 3
+    index_watch_interval: float = 0.0
+    chat_history_path: Path = Path("data/chat_history")
+    history_archive_after_days: float = 30.0
+    history_compact_interval: float = 0.0
+    log_level: str = "INFO"
+    log_sample_rate: float = 0.1
+    admin_token: Optional[str] = None
+    profiling_enabled: bool = False
+    profile_dir: Path = Path("data/profiles")
+    profile_interval: float = 0.005
+    profile_index_build: bool = False
     langsmith_api_key: Optional[str] = None
     langsmith_endpoint: Optional[str] = "https://api.smith.langchain.com"
     langsmith_project: Optional[str] = "mock-support-chatbot"
@@ -59,14 +108,48 @@ def get_settings() -> Settings:
         if "gpt-5" in chat_model:
             chat_model = "gpt-4o-mini"
     embedding_model = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+    # Model rẻ/nhanh hơn chỉ dùng để viết lại câu hỏi follow-up (mặc định dùng OPENAI_MODEL)
+    condense_model = os.getenv("CONDENSE_MODEL") or None
     docs_path = Path(os.getenv("DOCS_PATH", "data/docs")).resolve()
+    # text-embedding-3-* hỗ trợ rút gọn số chiều (vd. 512 thay vì 1536)
+    embedding_dimensions = int(os.getenv("EMBEDDING_DIMENSIONS", 0)) or None
+    vector_storage = os.getenv("VECTOR_STORAGE", "float32").lower()
+    if vector_storage not in VECTOR_STORAGE_TYPES:
+        raise ValueError(f"VECTOR_STORAGE must be one of {', '.join(VECTOR_STORAGE_TYPES)}, got {vector_storage!r}.")
     max_tokens = int(os.getenv("MAX_TOKENS", 512))
     llm_timeout = int(os.getenv("LLM_TIMEOUT", 30))
     llm_max_retries = int(os.getenv("LLM_MAX_RETRIES", 1))
+    # Deadline tổng cho một lượt hỏi (giây, 0 = tắt), chia cho condense/retrieve/generate theo DEADLINE_SPLIT
+    request_deadline = float(os.getenv("REQUEST_DEADLINE", 0))
+    deadline_shares = _parse_shares(os.getenv("DEADLINE_SPLIT", "condense=0.25,retrieve=0.15,generate=0.6"))
     retriever_k = int(os.getenv("RETRIEVER_K", 3))
+    context_packing = os.getenv("CONTEXT_PACKING", "true").lower() == "true"
+    retriever_fetch_k = int(os.getenv("RETRIEVER_FETCH_K", 20))
+    mmr_lambda = float(os.getenv("MMR_LAMBDA", 0.5))
+    dedup_threshold = float(os.getenv("DEDUP_THRESHOLD", 0.95))
+    context_token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500))
+    # Giới hạn số lời gọi LLM đồng thời / token mỗi phút; 0 = không xếp hàng
+    llm_concurrency = int(os.getenv("LLM_CONCURRENCY", 0))
+    llm_tokens_per_minute = int(os.getenv("LLM_TOKENS_PER_MINUTE", 0))
+    tier_weights = _parse_shares(os.getenv("PRIORITY_TIERS", "premium=4,standard=1"))
+    priority_tiers = {tier.lower(): weight for tier, weight in tier_weights.items()}
+    query_embedding_cache_size = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", 1024))
     persist_index = os.getenv("PERSIST_INDEX", "true").lower() == "true"
     persist_index_path = Path(os.getenv("PERSIST_INDEX_PATH", "data/faiss")).resolve()
     reindex_on_start = os.getenv("REINDEX_ON_START", "false").lower() == "true"
+    index_snapshots_keep = int(os.getenv("INDEX_SNAPSHOTS_KEEP", 3))
+    index_watch_interval = float(os.getenv("INDEX_WATCH_INTERVAL", 0))
+    chat_history_path = Path(os.getenv("CHAT_HISTORY_PATH", "data/chat_history")).resolve()
+    # Session không hoạt động quá số ngày này được nén vào archive (0 = không archive)
+    history_archive_after_days = float(os.getenv("HISTORY_ARCHIVE_AFTER_DAYS", 30))
+    history_compact_interval = float(os.getenv("HISTORY_COMPACT_INTERVAL", 0))
+    log_level = os.getenv("LOG_LEVEL", "INFO")
+    log_sample_rate = float(os.getenv("LOG_SAMPLE_RATE", 0.1))
+    admin_token = os.getenv("ADMIN_TOKEN") or None
+    profiling_enabled = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+    profile_dir = Path(os.getenv("PROFILE_DIR", "data/profiles")).resolve()
+    profile_interval = float(os.getenv("PROFILE_INTERVAL", 0.005))
+    profile_index_build = os.getenv("PROFILE_INDEX_BUILD", "false").lower() == "true"
 
     langsmith_api_key = os.getenv("LANGCHAIN_API_KEY")
     tracing_enabled = os.getenv("LANGCHAIN_TRACING_V2", "false").lower() == "true" and bool(
@@ -80,14 +163,59 @@ def get_settings() -> Settings:
         max_tokens=max_tokens,
         llm_timeout=llm_timeout,
         llm_max_retries=llm_max_retries,
+        openai_base_url=os.getenv("OPENAI_BASE_URL") or None,
+        request_deadline=request_deadline,
+        deadline_shares=deadline_shares,
+        llm_hedge_delay=float(os.getenv("LLM_HEDGE_DELAY", 0)),
+        llm_hedge_adaptive=os.getenv("LLM_HEDGE_ADAPTIVE", "false").lower() == "true",
+        llm_pool_size=int(os.getenv("LLM_POOL_SIZE", 32)),
+        retrieval_pool_size=int(os.getenv("RETRIEVAL_POOL_SIZE", 16)),
+        llm_concurrency=llm_concurrency,
+        llm_tokens_per_minute=llm_tokens_per_minute,
+        priority_tiers=priority_tiers,
+        default_priority=os.getenv("DEFAULT_PRIORITY", "standard").lower(),
+        scheduler_queue_timeout=float(os.getenv("SCHEDULER_QUEUE_TIMEOUT", 30)),
+        scheduler_max_queue=int(os.getenv("SCHEDULER_MAX_QUEUE", 0)),
         embedding_model=embedding_model,
         docs_path=docs_path,
+        condense_model=condense_model,
+        speculative_retrieval=os.getenv("SPECULATIVE_RETRIEVAL", "false").lower() == "true",
+        speculative_similarity=float(os.getenv("SPECULATIVE_SIMILARITY", 0.9)),
+        speculative_pool_size=int(os.getenv("SPECULATIVE_POOL_SIZE", 8)),
+        embedding_dimensions=embedding_dimensions,
+        vector_storage=vector_storage,
+        faq_fast_path=os.getenv("FAQ_FAST_PATH", "true").lower() == "true",
+        faq_path=Path(os.getenv("FAQ_PATH", "data/faq.json")).resolve(),
+        faq_threshold=float(os.getenv("FAQ_THRESHOLD", 0.7)),
+        parse_cache=os.getenv("PARSE_CACHE", "true").lower() == "true",
+        parse_cache_path=Path(os.getenv("PARSE_CACHE_PATH", "data/parse_cache")).resolve(),
+        ingest_workers=int(os.getenv("INGEST_WORKERS", 0)),
         chunk_size=int(os.getenv("CHUNK_SIZE", 800)),
         chunk_overlap=int(os.getenv("CHUNK_OVERLAP", 150)),
+        chunk_dedup=os.getenv("CHUNK_DEDUP", "true").lower() == "true",
+        chunk_dedup_threshold=float(os.getenv("CHUNK_DEDUP_THRESHOLD", 0.7)),
         retriever_k=retriever_k,
+        context_packing=context_packing,
+        retriever_fetch_k=retriever_fetch_k,
+        mmr_lambda=mmr_lambda,
+        dedup_threshold=dedup_threshold,
+        context_token_budget=context_token_budget,
+        query_embedding_cache_size=query_embedding_cache_size,
         persist_index=persist_index,
         persist_index_path=persist_index_path,
         reindex_on_start=reindex_on_start,
+        index_snapshots_keep=index_snapshots_keep,
+        index_watch_interval=index_watch_interval,
+        chat_history_path=chat_history_path,
+        history_archive_after_days=history_archive_after_days,
+        history_compact_interval=history_compact_interval,
+        log_level=log_level,
+        log_sample_rate=log_sample_rate,
+        admin_token=admin_token,
+        profiling_enabled=profiling_enabled,
+        profile_dir=profile_dir,
+        profile_interval=profile_interval,
+        profile_index_build=profile_index_build,
         langsmith_api_key=langsmith_api_key,
         langsmith_endpoint=os.getenv("LANGCHAIN_ENDPOINT", "https://api.smith.langchain.com"),
         langsmith_project=os.getenv("LANGCHAIN_PROJECT", "mock-support-chatbot"),
@@ -100,6 +228,17 @@ def get_settings() -> Settings:
     return settings
 
 
+def _parse_shares(value: str) -> Dict[str, float]:
+    """Parse `name=number,...` (e.g. DEADLINE_SPLIT, PRIORITY_TIERS) into a dict."""
+
+    shares = {}
+    for item in value.split(","):
+        if "=" in item:
+            stage, fraction = item.split("=", 1)
+            shares[stage.strip()] = float(fraction)
+    return shares
+
+
 def _configure_langsmith(settings: Settings) -> None:
     """Set LangSmith environment variables if tracing is enabled."""
 
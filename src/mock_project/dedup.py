@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import hashlib
+import re
+import unicodedata
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+_MERSENNE_PRIME = (1 << 31) - 1
+_NON_WORD = re.compile(r"[^\w]+")
+
+
+@dataclass
+class DedupReport:
+    """How many chunks were dropped before embedding, and why."""
+
+    input_chunks: int = 0
+    exact_duplicates: int = 0
+    near_duplicates: int = 0
+    chars_removed: int = 0
+
+    @property
+    def kept(self) -> int:
+        return self.input_chunks - self.exact_duplicates - self.near_duplicates
+
+    def merge(self, other: "DedupReport") -> None:
+        self.input_chunks += other.input_chunks
+        self.exact_duplicates += other.exact_duplicates
+        self.near_duplicates += other.near_duplicates
+        self.chars_removed += other.chars_removed
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), "kept": self.kept}
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, strip diacritics and punctuation so DOCX and ASCII-only PDF copies compare equal."""
+
+    decomposed = unicodedata.normalize("NFKD", text.replace("đ", "d").replace("Đ", "D"))
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return _NON_WORD.sub(" ", stripped.lower()).strip()
+
+
+class MinHasher:
+    """MinHash signatures over character shingles, vectorized with NumPy."""
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 5, seed: int = 1) -> None:
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self._a = rng.integers(1, _MERSENNE_PRIME, size=num_perm, dtype=np.int64)
+        self._b = rng.integers(0, _MERSENNE_PRIME, size=num_perm, dtype=np.int64)
+
+    def signature(self, normalized: str) -> np.ndarray:
+        size = self.shingle_size
+        shingles = {normalized[i : i + size] for i in range(max(len(normalized) - size + 1, 1))}
+        hashes = np.fromiter(
+            (_shingle_hash(shingle) for shingle in shingles),
+            dtype=np.int64,
+            count=len(shingles),
+        )
+        # a*x < 2^62 nên không tràn int64
+        permuted = (self._a[:, None] * hashes[None, :] + self._b[:, None]) % _MERSENNE_PRIME
+        return permuted.min(axis=1)
+
+
+def _shingle_hash(shingle: str) -> int:
+    digest = hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % _MERSENNE_PRIME
+
+
+def deduplicate_chunks(
+    chunks: Iterable[Document],
+    *,
+    threshold: float = 0.7,
+    num_perm: int = 64,
+    bands: int = 16,
+) -> Tuple[List[Document], DedupReport]:
+    """Drop exact and near-duplicate chunks, keeping one canonical copy.
+
+    Chunks with the richest text (most non-ASCII characters, then longest) are
+    visited first so the diacritic-preserving DOCX copy wins over an ASCII-only
+    PDF export. Duplicates' sources are recorded in the canonical chunk's
+    `alternate_sources` metadata. The original chunk order is preserved.
+    """
+    documents = list(chunks)
+    report = DedupReport(input_chunks=len(documents))
+    hasher = MinHasher(num_perm=num_perm)
+    rows = num_perm // bands
+
+    order = sorted(
+        range(len(documents)),
+        key=lambda i: (
+            -sum(1 for char in documents[i].page_content if ord(char) > 127),
+            -len(documents[i].page_content),
+            str(documents[i].metadata.get("source", "")),
+            documents[i].metadata.get("start_index", 0),
+        ),
+    )
+    exact: Dict[str, int] = {}
+    buckets: Dict[Tuple[int, bytes], List[int]] = {}
+    signatures: Dict[int, np.ndarray] = {}
+    canonical_of: Dict[int, int] = {}
+
+    for index in order:
+        normalized = normalize_text(documents[index].page_content)
+        digest = hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+        if digest in exact:
+            canonical_of[index] = exact[digest]
+            report.exact_duplicates += 1
+            continue
+
+        signature = hasher.signature(normalized)
+        keys = [(band, signature[band * rows : (band + 1) * rows].tobytes()) for band in range(bands)]
+        candidates = {kept for key in keys for kept in buckets.get(key, ())}
+        match = next(
+            (kept for kept in sorted(candidates) if float(np.mean(signatures[kept] == signature)) >= threshold),
+            None,
+        )
+        if match is not None:
+            canonical_of[index] = match
+            report.near_duplicates += 1
+            continue
+
+        exact[digest] = index
+        signatures[index] = signature
+        for key in keys:
+            buckets.setdefault(key, []).append(index)
+
+    alternates: Dict[int, set] = {}
+    for duplicate, canonical in canonical_of.items():
+        report.chars_removed += len(documents[duplicate].page_content)
+        source = documents[duplicate].metadata.get("source")
+        if source and source != documents[canonical].metadata.get("source"):
+            alternates.setdefault(canonical, set()).add(str(source))
+
+    kept: List[Document] = []
+    for index, document in enumerate(documents):
+        if index in canonical_of:
+            continue
+        if index in alternates:
+            document = Document(
+                page_content=document.page_content,
+                metadata={**document.metadata, "alternate_sources": sorted(alternates[index])},
+            )
+        kept.append(document)
+    return kept, report
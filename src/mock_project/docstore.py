@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import json
+from array import array
+from typing import Any, Dict, List, Optional, Union
+
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
+
+
+class CompactDocstore(Docstore, AddableMixin):
+    """Columnar FAISS docstore that materializes `Document`s only on lookup.
+
+    Chunk texts live UTF-8 encoded in one shared buffer addressed by offset arrays,
+    `start_index` is an integer column, and the remaining metadata dicts are
+    interned: the chunks of one file (or PDF page) share a single dict, so the
+    source path is stored once instead of once per chunk. Ids equal to the row
+    number (`"0"`, `"1"`, ...) need no lookup table; other ids fall back to a dict.
+    """
+
+    def __init__(self) -> None:
+        self._blob = bytearray()
+        self._offsets = array("Q")
+        self._lengths = array("I")
+        self._start_index = array("q")
+        self._meta_ids = array("I")
+        self._metas: List[dict] = []
+        self._meta_lookup: Dict[str, int] = {}
+        self._rows: Optional[Dict[str, int]] = None
+        self._deleted: set = set()
+
+    @classmethod
+    def from_docstore(cls, docstore: InMemoryDocstore) -> "CompactDocstore":
+        """Convert a LangChain `InMemoryDocstore` (e.g. from an older snapshot)."""
+        compact = cls()
+        compact.add(docstore._dict)
+        return compact
+
+    def __len__(self) -> int:
+        return len(self._offsets) - len(self._deleted)
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        overlapping = [doc_id for doc_id in texts if self._row(doc_id) is not None]
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {set(overlapping)}")
+        for doc_id, document in texts.items():
+            row = len(self._offsets)
+            encoded = document.page_content.encode("utf-8")
+            self._offsets.append(len(self._blob))
+            self._lengths.append(len(encoded))
+            self._blob += encoded
+            metadata = dict(document.metadata)
+            start_index = metadata.pop("start_index", None)
+            self._start_index.append(-1 if start_index is None else int(start_index))
+            self._meta_ids.append(self._intern(metadata))
+            if self._rows is None and doc_id != str(row):
+                # Id không theo số thứ tự dòng: chuyển sang bảng tra cứu
+                self._rows = {str(index): index for index in range(row)}
+            if self._rows is not None:
+                self._rows[doc_id] = row
+
+    def delete(self, ids: List) -> None:
+        rows = [row for row in (self._row(doc_id) for doc_id in ids) if row is not None]
+        if not rows:
+            raise ValueError(f"Tried to delete ids that does not  exist: {ids}")
+        self._deleted.update(rows)
+        if self._rows is not None:
+            for doc_id in ids:
+                self._rows.pop(doc_id, None)
+
+    def search(self, search: str) -> Union[str, Document]:
+        row = self._row(search)
+        if row is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=self.text(row), metadata=self.metadata_at(row))
+
+    def metadata(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """Metadata of `doc_id` without decoding its text (for filtering before materializing)."""
+        row = self._row(doc_id)
+        return None if row is None else self.metadata_at(row)
+
+    def text(self, row: int) -> str:
+        offset = self._offsets[row]
+        return self._blob[offset : offset + self._lengths[row]].decode("utf-8")
+
+    def metadata_at(self, row: int) -> Dict[str, Any]:
+        metadata = dict(self._metas[self._meta_ids[row]])
+        if self._start_index[row] >= 0:
+            metadata["start_index"] = self._start_index[row]
+        return metadata
+
+    def _row(self, doc_id: Any) -> Optional[int]:
+        if self._rows is not None:
+            return self._rows.get(doc_id)
+        if not isinstance(doc_id, str) or not doc_id.isdigit():
+            return None
+        row = int(doc_id)
+        return row if row < len(self._offsets) and row not in self._deleted else None
+
+    def _intern(self, metadata: dict) -> int:
+        key = json.dumps(metadata, sort_keys=True, ensure_ascii=False, default=str)
+        meta_id = self._meta_lookup.get(key)
+        if meta_id is None:
+            meta_id = self._meta_lookup[key] = len(self._metas)
+            self._metas.append(metadata)
+        return meta_id
+
+    def __getstate__(self) -> dict:
+        # Bảng intern dựng lại được từ `_metas`, không cần ghi vào index.pkl
+        state = self.__dict__.copy()
+        state.pop("_meta_lookup")
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._meta_lookup = {
+            json.dumps(metadata, sort_keys=True, ensure_ascii=False, default=str): meta_id
+            for meta_id, metadata in enumerate(self._metas)
+        }
@@ -1,47 +1,251 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
 from pathlib import Path
-from typing import Iterable, List
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
 
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import DirectoryLoader, Docx2txtLoader, PyPDFLoader
+from langchain_community.document_loaders import CSVLoader, Docx2txtLoader, PyPDFLoader, TextLoader
 
 from .config import Settings
+from .observability import logger, record_cache
+
+DEFAULT_COLLECTION = "default"
+_UNSAFE_COLLECTION_CHARS = re.compile(r"[^\w.-]+")
+# Tăng khi thay đổi cách trích xuất text để cache cũ tự vô hiệu
+PARSE_CACHE_VERSION = 1
+
+Loader = Callable[[str], List[Document]]
+_LOADERS: Dict[str, Loader] = {}
+_UNCACHED: Set[str] = set()
+
+
+def register_loader(*suffixes: str, cache: bool = True) -> Callable[[Loader], Loader]:
+    """Register `loader(path) -> documents` for file suffixes such as `".md"` (later registrations win).
+
+    `cache=False` for formats that are cheaper to re-read than to look up in the parse cache.
+    """
+
+    def decorator(loader: Loader) -> Loader:
+        for suffix in suffixes:
+            _LOADERS[suffix.lower()] = loader
+            if cache:
+                _UNCACHED.discard(suffix.lower())
+            else:
+                _UNCACHED.add(suffix.lower())
+        return loader
+
+    return decorator
+
+
+def loader_for(path: Path | str) -> Optional[Loader]:
+    """Registered loader for `path`'s suffix, or None if the type is not supported."""
+
+    return _LOADERS.get(Path(path).suffix.lower())
 
 
 def load_documents(settings: Settings) -> List[Document]:
-    """Load PDF and DOCX documents from the configured directory."""
+    """Load every supported file under `docs_path` in parallel; unknown file types are skipped.
+
+    With `parse_cache` on, extracted documents are stored under `parse_cache_path`
+    keyed by file content, so a rebuild (e.g. after changing `chunk_size`) only
+    parses files that changed.
+    """
 
     docs_path = settings.docs_path
     if not docs_path.exists():
         raise FileNotFoundError(f"Documents directory not found: {docs_path}")
 
-    loader = DirectoryLoader(
-        str(docs_path),
-        glob="**/*",
-        show_progress=True,
-        use_multithreading=True,
-        loader_cls=_select_loader,
-    )
-    documents = loader.load()
+    files, skipped = [], []
+    for path in sorted(docs_path.rglob("*")):
+        # Bỏ file/thư mục ẩn (.DS_Store, .git, ...) như DirectoryLoader
+        if not path.is_file() or any(part.startswith(".") for part in path.relative_to(docs_path).parts):
+            continue
+        (files if loader_for(path) else skipped).append(path)
+    if skipped:
+        logger.info(
+            "documents_skipped",
+            extra={"fields": {"count": len(skipped), "suffixes": sorted({path.suffix.lower() for path in skipped})}},
+        )
+
+    cache = ParseCache(settings.parse_cache_path) if settings.parse_cache else None
+    workers = settings.ingest_workers or min(32, (os.cpu_count() or 1) + 4)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(files) or 1))) as pool:
+        loaded = list(pool.map(lambda path: _load_file(path, cache), files))
 
+    documents = [document for docs, _ in loaded for document in docs]
     if not documents:
-        raise ValueError(f"No PDF/DOCX files found under {docs_path}.")
+        supported = ", ".join(sorted(_LOADERS))
+        raise ValueError(f"No supported documents ({supported}) found under {docs_path}.")
+    if cache is not None:
+        # Chỉ giữ cache của các file còn trong docs
+        cache.prune({key for _, key in loaded})
 
+    for document in documents:
+        if "collection" not in document.metadata:
+            document.metadata["collection"] = collection_for(document.metadata.get("source"), docs_path)
     return documents
 
 
-def _select_loader(file_path: str) -> PyPDFLoader | Docx2txtLoader:
-    path = Path(file_path)
-    if path.suffix.lower() == ".pdf":
-        return PyPDFLoader(file_path)
-    if path.suffix.lower() in {".doc", ".docx"}:
-        return Docx2txtLoader(file_path)
-    if path.suffix.lower() == ".txt":
-        from langchain_community.document_loaders import TextLoader
-        return TextLoader(file_path, encoding="utf-8")
-    raise ValueError(f"Unsupported file type for loader: {file_path}")
+class ParseCache:
+    """Extracted documents on disk, one JSON file per (file content, loader) hash."""
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+
+    def key(self, path: Path, data: bytes) -> str:
+        loader = loader_for(path)
+        digest = hashlib.sha256(data)
+        digest.update(f"|{PARSE_CACHE_VERSION}|{loader.__module__}.{loader.__qualname__}".encode())
+        return digest.hexdigest()
+
+    def get(self, key: str, source: str) -> Optional[List[Document]]:
+        try:
+            entries = json.loads((self.root / f"{key}.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        # Cùng nội dung có thể nằm ở đường dẫn khác: source luôn lấy theo file hiện tại
+        return [
+            Document(page_content=entry["page_content"], metadata={**entry["metadata"], "source": source})
+            for entry in entries
+        ]
+
+    def put(self, key: str, documents: List[Document]) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        entries = [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in documents]
+        target = self.root / f"{key}.json"
+        # File trùng nội dung có cùng key và có thể được ghi song song: mỗi lần ghi dùng file tạm riêng
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=f".{key}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False, default=str)
+            os.replace(tmp, target)
+        except OSError:
+            Path(tmp).unlink(missing_ok=True)
+            # Thua race (vd. Windows khóa file đích): bản đã ghi có cùng nội dung
+            if not target.exists():
+                raise
+
+    def prune(self, keep: Set[Optional[str]]) -> int:
+        """Delete entries whose key is not in `keep`; returns how many were removed."""
+        removed = 0
+        for path in self.root.glob("*.json"):
+            if path.stem not in keep:
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+
+def _load_file(path: Path, cache: Optional[ParseCache]) -> Tuple[List[Document], Optional[str]]:
+    loader = loader_for(path)
+    if cache is None or path.suffix.lower() in _UNCACHED:
+        return loader(str(path)), None
+    key = cache.key(path, path.read_bytes())
+    documents = cache.get(key, str(path))
+    record_cache("parse", documents is not None)
+    if documents is None:
+        documents = loader(str(path))
+        cache.put(key, documents)
+    return documents, key
+
+
+def normalize_collection(name: Optional[str]) -> str:
+    """Collection names double as shard directory names, so keep them path-safe."""
+
+    cleaned = _UNSAFE_COLLECTION_CHARS.sub("_", str(name or "")).strip("._")
+    return cleaned or DEFAULT_COLLECTION
+
+
+def collection_for(source: Optional[str], docs_path: Path) -> str:
+    """First subfolder of `docs_path` containing `source`; files at the top level go to the default collection."""
+
+    if not source:
+        return DEFAULT_COLLECTION
+    try:
+        parts = Path(source).resolve().relative_to(docs_path.resolve()).parts
+    except ValueError:
+        return DEFAULT_COLLECTION
+    return normalize_collection(parts[0]) if len(parts) > 1 else DEFAULT_COLLECTION
+
+
+@register_loader(".pdf")
+def _load_pdf(path: str) -> List[Document]:
+    return PyPDFLoader(path).load()
+
+
+@register_loader(".doc", ".docx")
+def _load_docx(path: str) -> List[Document]:
+    return Docx2txtLoader(path).load()
+
+
+@register_loader(".txt", ".md", ".markdown", cache=False)
+def _load_text(path: str) -> List[Document]:
+    # Markdown giữ nguyên cú pháp: tiêu đề/danh sách vẫn là ngữ cảnh hữu ích khi chunk
+    return TextLoader(path, encoding="utf-8").load()
+
+
+@register_loader(".html", ".htm")
+def _load_html(path: str) -> List[Document]:
+    parser = _HTMLText()
+    parser.feed(Path(path).read_text(encoding="utf-8", errors="replace"))
+    parser.close()
+    metadata = {"source": path}
+    if parser.title:
+        metadata["title"] = parser.title
+    return [Document(page_content=parser.text(), metadata=metadata)]
+
+
+@register_loader(".csv", cache=False)
+def _load_csv(path: str) -> List[Document]:
+    # Mỗi dòng một document dạng "cột: giá trị", metadata có số dòng (`row`)
+    return CSVLoader(path, encoding="utf-8").load()
+
+
+class _HTMLText(HTMLParser):
+    """Visible text of an HTML page, one line per block element (stdlib only)."""
+
+    _SKIP = {"script", "style", "noscript", "template", "head"}
+    _BLOCKS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "section", "article", "table"}
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.title = ""
+        self._parts: List[str] = []
+        self._skipping = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        if tag == "title":
+            self._in_title = True
+        elif tag in self._SKIP:
+            self._skipping += 1
+        elif tag in self._BLOCKS:
+            self._parts.append("\n")
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == "title":
+            self._in_title = False
+        elif tag in self._SKIP:
+            self._skipping = max(0, self._skipping - 1)
+        elif tag in self._BLOCKS:
+            self._parts.append("\n")
+
+    def handle_data(self, data: str) -> None:
+        if self._in_title:
+            self.title += data.strip()
+        elif not self._skipping:
+            self._parts.append(data)
+
+    def text(self) -> str:
+        lines = (" ".join(line.split()) for line in "".join(self._parts).splitlines())
+        return "\n".join(line for line in lines if line)
 
 
 def split_documents(settings: Settings, documents: Iterable[Document]) -> List[Document]:
@@ -0,0 +1,351 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+_WORDS = (
+    "hỗ trợ khách hàng gói Premium dịch vụ hotline email chính sách đổi trả "
+    "sandbox SLA phản hồi ticket workflow dashboard báo cáo tích hợp API"
+).split()
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic `ChatOpenAI` stand-in with configurable latency and token rate.
+
+    The reply is derived from a hash of the prompt so repeated calls are reproducible
+    while different questions still produce different answers.
+    """
+
+    response_tokens: int = 48
+    latency: float = 0.0
+    tokens_per_second: float = 0.0
+    streaming: bool = False
+    # Thay nội dung trả lời theo prompt (vd. lặp lại câu hỏi follow-up khi giả lập condense)
+    reply: Optional[Callable[[str], str]] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def get_num_tokens(self, text: str) -> int:
+        # Avoid the default GPT-2 tokenizer (needs `transformers`); whitespace is enough here.
+        return len(text.split())
+
+    def get_token_ids(self, text: str) -> List[int]:
+        return list(range(self.get_num_tokens(text)))
+
+    def _tokens(self, messages: List[BaseMessage]) -> List[str]:
+        prompt = "\n".join(str(message.content) for message in messages)
+        if self.reply is not None:
+            return [word + " " for word in self.reply(prompt).split()]
+        seed = int.from_bytes(hashlib.blake2b(prompt.encode("utf-8"), digest_size=8).digest(), "big")
+        return [_WORDS[(seed + i * 7) % len(_WORDS)] + " " for i in range(self.response_tokens)]
+
+    def _token_delay(self) -> float:
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tokens = self._tokens(messages)
+        if self.latency:
+            time.sleep(self.latency)
+        delay = self._token_delay()
+        if self.streaming:
+            for token in tokens:
+                if delay:
+                    time.sleep(delay)
+                if run_manager:
+                    run_manager.on_llm_new_token(token)
+        elif delay:
+            time.sleep(delay * len(tokens))
+        return _chat_result(tokens, messages)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tokens = self._tokens(messages)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        delay = self._token_delay()
+        if self.streaming:
+            for token in tokens:
+                if delay:
+                    await asyncio.sleep(delay)
+                if run_manager:
+                    await run_manager.on_llm_new_token(token)
+        elif delay:
+            await asyncio.sleep(delay * len(tokens))
+        return _chat_result(tokens, messages)
+
+
+def _chat_result(tokens: List[str], messages: List[BaseMessage]) -> ChatResult:
+    text = "".join(tokens).strip()
+    prompt_tokens = sum(len(str(message.content).split()) for message in messages)
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": len(tokens),
+        "total_tokens": prompt_tokens + len(tokens),
+    }
+    return ChatResult(
+        generations=[ChatGeneration(message=AIMessage(content=text))],
+        llm_output={"token_usage": usage, "model_name": "fake-chat"},
+    )
+
+
+def echo_follow_up(prompt: str) -> str:
+    """`reply` for a condense model that returns the follow-up question unchanged."""
+
+    return prompt.rsplit("Follow Up Input:", 1)[-1].split("Standalone question:", 1)[0].strip()
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic `OpenAIEmbeddings` stand-in based on hashed bag-of-words vectors.
+
+    Texts sharing words end up close together, so similarity search still returns
+    meaningful neighbours without any network access.
+    """
+
+    def __init__(self, size: int = 256, latency: float = 0.0) -> None:
+        self.size = size
+        self.latency = latency
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in text.lower().split():
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "big") % self.size
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = float(np.linalg.norm(vector))
+        if norm:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._embed(text)
+
+
+class FakeOpenAIServer:
+    """Local OpenAI-compatible HTTP server (`/v1/chat/completions`, `/v1/embeddings`).
+
+    Point `ChatOpenAI`/`OpenAIEmbeddings` at `base_url` (or set `OPENAI_BASE_URL`) to
+    exercise the real client stack offline. `latency` delays the first byte of every
+    response; `latency_fn(request_number)` overrides it per request to inject slow
+    outliers. Streaming responses are sent as server-sent events at `tokens_per_second`.
+    A fraction `error_rate` of requests fails with `error_status`.
+    """
+
+    def __init__(
+        self,
+        *,
+        latency: float = 0.0,
+        tokens_per_second: float = 0.0,
+        response_tokens: int = 24,
+        embedding_size: int = 256,
+        latency_fn: Optional[Callable[[int], float]] = None,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        seed: int = 0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.latency_fn = latency_fn
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self.errors = 0
+        self.disconnects = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.embedding_size = embedding_size
+        self._httpd = ThreadingHTTPServer((host, port), _handler_for(self))
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.stop()
+
+    def _next_delay(self) -> float:
+        with self._lock:
+            self.requests += 1
+            number = self.requests
+        return self.latency_fn(number) if self.latency_fn else self.latency
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            failed = self.error_rate > 0 and self._random.random() < self.error_rate
+            self.errors += failed
+        return failed
+
+    def _tokens(self, body: dict) -> List[str]:
+        prompt = "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+        seed = int.from_bytes(hashlib.blake2b(prompt.encode("utf-8"), digest_size=8).digest(), "big")
+        count = min(self.response_tokens, int(body.get("max_tokens") or self.response_tokens))
+        return [_WORDS[(seed + i * 7) % len(_WORDS)] + " " for i in range(count)]
+
+
+def _handler_for(server: FakeOpenAIServer) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+            return
+
+        def do_POST(self) -> None:  # noqa: N802
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            time.sleep(server._next_delay())
+            try:
+                if server._should_fail():
+                    self._json(
+                        {"error": {"message": "Injected failure", "type": "server_error"}}, status=server.error_status
+                    )
+                elif self.path.endswith("/embeddings"):
+                    self._embeddings(body)
+                elif self.path.endswith("/chat/completions"):
+                    self._chat(body)
+                else:
+                    self._json({"error": {"message": f"Unknown path {self.path}"}}, status=404)
+            except (BrokenPipeError, ConnectionResetError):
+                # Client hủy request (vd. request hedge bị thua)
+                with server._lock:
+                    server.disconnects += 1
+
+        def _json(self, payload: dict, status: int = 200) -> None:
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _embeddings(self, body: dict) -> None:
+            inputs = body.get("input", [])
+            inputs = [inputs] if isinstance(inputs, (str, int)) or (inputs and isinstance(inputs[0], int)) else inputs
+            # OpenAIEmbeddings gửi token id (tiktoken) thay cho văn bản: băm từng id như một từ
+            texts = [item if isinstance(item, str) else " ".join(map(str, item)) for item in inputs]
+            embedder = FakeEmbeddings(size=int(body.get("dimensions") or server.embedding_size))
+            self._json(
+                {
+                    "object": "list",
+                    "model": body.get("model", "fake-embedding"),
+                    "data": [
+                        {"object": "embedding", "index": index, "embedding": embedder._embed(text)}
+                        for index, text in enumerate(texts)
+                    ],
+                    "usage": {"prompt_tokens": 0, "total_tokens": 0},
+                }
+            )
+
+        def _chat(self, body: dict) -> None:
+            tokens = server._tokens(body)
+            model = body.get("model", "fake-chat")
+            created = int(time.time())
+            if not body.get("stream"):
+                time.sleep(len(tokens) / server.tokens_per_second if server.tokens_per_second > 0 else 0)
+                prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body.get("messages", []))
+                self._json(
+                    {
+                        "id": "chatcmpl-fake",
+                        "object": "chat.completion",
+                        "created": created,
+                        "model": model,
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": {"role": "assistant", "content": "".join(tokens).strip()},
+                                "finish_reason": "stop",
+                            }
+                        ],
+                        "usage": {
+                            "prompt_tokens": prompt_tokens,
+                            "completion_tokens": len(tokens),
+                            "total_tokens": prompt_tokens + len(tokens),
+                        },
+                    }
+                )
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            delay = 1.0 / server.tokens_per_second if server.tokens_per_second > 0 else 0.0
+            deltas = [{"role": "assistant", "content": ""}] + [{"content": token} for token in tokens]
+            for position, delta in enumerate(deltas):
+                if delay and position:
+                    time.sleep(delay)
+                self._event(
+                    {
+                        "id": "chatcmpl-fake",
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+                    }
+                )
+            self._event(
+                {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                }
+            )
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+        def _event(self, payload: dict) -> None:
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+    return Handler
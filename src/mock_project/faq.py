@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import json
+import math
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .dedup import normalize_text
+
+
+@dataclass
+class FaqMatch:
+    """Best curated entry for a question and its cosine similarity."""
+
+    entry_id: str
+    question: str
+    answer: str
+    score: float
+
+
+class FaqIndex:
+    """Curated Q&A pairs matched locally with TF-IDF over character n-grams.
+
+    Every paraphrase in an entry's `questions` is one row; a question matches the
+    entry of its most similar row when the cosine similarity reaches `threshold`.
+    Text is compared after `normalize_text`, so questions typed without Vietnamese
+    diacritics still match. N-grams unseen in the curated questions still count
+    towards the query norm, which keeps long questions that merely mention a
+    stock topic below the threshold.
+    """
+
+    def __init__(self, entries: Sequence[Dict[str, Any]], *, threshold: float = 0.7, ngram_size: int = 3) -> None:
+        self.entries = list(entries)
+        self.threshold = threshold
+        self.ngram_size = ngram_size
+        self._questions: List[str] = []
+        self._owners: List[int] = []
+        for index, entry in enumerate(self.entries):
+            if not entry.get("answer") or not entry.get("questions"):
+                raise ValueError(f"FAQ entry {entry.get('id', index)!r} needs 'questions' and 'answer'")
+            for question in entry["questions"]:
+                self._questions.append(question)
+                self._owners.append(index)
+
+        counts = [self._ngrams(question) for question in self._questions]
+        self._vocab = {gram: column for column, gram in enumerate(sorted(set().union(*counts)))}
+        df = np.zeros(len(self._vocab), dtype=np.float32)
+        for row in counts:
+            df[[self._vocab[gram] for gram in row]] += 1
+        rows = len(self._questions)
+        self._idf = np.log((1 + rows) / (1 + df)) + 1
+        # N-gram chưa từng xuất hiện: idf lớn nhất (df = 0)
+        self._unseen_idf = math.log(1 + rows) + 1
+        self._matrix = np.zeros((rows, len(self._vocab)), dtype=np.float32)
+        for row, grams in enumerate(counts):
+            for gram, count in grams.items():
+                column = self._vocab[gram]
+                self._matrix[row, column] = (1 + math.log(count)) * self._idf[column]
+        self._matrix /= np.maximum(np.linalg.norm(self._matrix, axis=1, keepdims=True), 1e-12)
+
+    @classmethod
+    def load(cls, path: Path, *, threshold: float = 0.7) -> "FaqIndex":
+        """Read `[{"id", "questions": [...], "answer"}, ...]` (or `{"entries": [...]}`) from JSON."""
+        payload = json.loads(path.read_text(encoding="utf-8"))
+        entries = payload["entries"] if isinstance(payload, dict) else payload
+        return cls(entries, threshold=threshold)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def match(self, question: str) -> Optional[FaqMatch]:
+        """Stored answer for `question`, or None when no entry is similar enough."""
+        grams = self._ngrams(question)
+        if not grams or not self._questions:
+            return None
+        query = np.zeros(len(self._vocab), dtype=np.float32)
+        unseen = 0.0
+        for gram, count in grams.items():
+            weight = 1 + math.log(count)
+            column = self._vocab.get(gram)
+            if column is None:
+                unseen += (weight * self._unseen_idf) ** 2
+            else:
+                query[column] = weight * self._idf[column]
+        norm = math.sqrt(float(query @ query) + unseen)
+        scores = self._matrix @ query / norm
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        entry = self.entries[self._owners[best]]
+        return FaqMatch(
+            entry_id=str(entry.get("id", self._owners[best])),
+            question=self._questions[best],
+            answer=entry["answer"],
+            score=float(scores[best]),
+        )
+
+    def _ngrams(self, text: str) -> Counter:
+        normalized = normalize_text(text)
+        if not normalized:
+            return Counter()
+        padded = f" {normalized} "
+        size = min(self.ngram_size, len(padded))
+        return Counter(padded[i : i + size] for i in range(len(padded) - size + 1))
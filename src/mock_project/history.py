@@ -0,0 +1,388 @@
+from __future__ import annotations
+
+import gzip
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from langchain_community.chat_message_histories import FileChatMessageHistory
+from langchain_core.messages import BaseMessage, messages_from_dict
+
+from .observability import HISTORY_ARCHIVED, HISTORY_RECLAIMED_BYTES, logger
+
+ARCHIVE_DIR = "archive"
+ARCHIVE_INDEX = "index.json"
+META_SUFFIX = "_meta.json"
+SEGMENT_GLOB = "segment-*.jsonl.gz"
+
+
+@dataclass
+class CompactionReport:
+    """What one compaction pass archived and removed."""
+
+    archived_sessions: int = 0
+    orphaned_meta_removed: int = 0
+    segments_removed: int = 0
+    files_removed: int = 0
+    bytes_removed: int = 0
+    bytes_written: int = 0
+    segment: Optional[str] = None
+
+    @property
+    def bytes_reclaimed(self) -> int:
+        return self.bytes_removed - self.bytes_written
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), "bytes_reclaimed": self.bytes_reclaimed}
+
+
+class HistoryStore:
+    """Per-session chat history files plus a gzip archive of idle sessions.
+
+    Live sessions stay as `<session_id>.json` (the `FileChatMessageHistory` format)
+    with an optional `<session_id>_meta.json`. `compact()` moves sessions idle for
+    longer than a threshold into append-only `archive/segment-*.jsonl.gz` files and
+    records them in `archive/index.json` together with the summary the session list
+    needs, so listing never has to open a segment. Reads fall back to the archive
+    transparently and writing to an archived session restores it first.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = Path(root)
+        self.archive_dir = self.root / ARCHIVE_DIR
+        self._lock = threading.RLock()
+        self._summary_cache: Dict[str, Tuple[tuple, dict]] = {}
+
+    def session_path(self, session_id: str) -> Path:
+        return self.root / f"{session_id}.json"
+
+    def meta_path(self, session_id: str) -> Path:
+        return self.root / f"{session_id}{META_SUFFIX}"
+
+    def chat_history(self, session_id: str) -> FileChatMessageHistory:
+        """Writable history for `session_id`, un-archiving it if needed."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.restore(session_id)
+        return FileChatMessageHistory(str(self.session_path(session_id)))
+
+    def create(self, session_id: str) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.session_path(session_id).write_text("[]", encoding="utf-8")
+        self.save_metadata(session_id, {"custom_title": None})
+
+    def exists(self, session_id: str) -> bool:
+        return self.session_path(session_id).exists() or session_id in self._load_index()
+
+    def messages(self, session_id: str) -> List[BaseMessage]:
+        """Messages of a live or archived session (empty when unknown; never creates files)."""
+        path = self.session_path(session_id)
+        if path.exists():
+            return messages_from_dict(json.loads(path.read_text(encoding="utf-8") or "[]"))
+        entry = self._load_index().get(session_id)
+        if entry is None:
+            return []
+        return messages_from_dict(self._read_archived(entry["segment"], session_id))
+
+    def load_metadata(self, session_id: str) -> dict:
+        meta_path = self.meta_path(session_id)
+        if meta_path.exists():
+            try:
+                return json.loads(meta_path.read_text(encoding="utf-8"))
+            except Exception:  # noqa: BLE001
+                return {"custom_title": None}
+        entry = self._load_index().get(session_id)
+        return dict(entry.get("metadata") or {"custom_title": None}) if entry else {"custom_title": None}
+
+    def save_metadata(self, session_id: str, metadata: dict) -> None:
+        with self._lock:
+            index = self._load_index()
+            if session_id in index and not self.session_path(session_id).exists():
+                # Session đã archive: cập nhật trong index, không tạo lại file _meta.json
+                index[session_id]["metadata"] = metadata
+                index[session_id]["title"] = _title(metadata, None, index[session_id]["title"])
+                self._save_index(index)
+                return
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self.meta_path(session_id).open("w", encoding="utf-8") as f:
+            json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+    def delete(self, session_id: str) -> bool:
+        """Remove a live or archived session; False when it does not exist."""
+        with self._lock:
+            found = self.session_path(session_id).exists()
+            for path in (self.session_path(session_id), self.meta_path(session_id)):
+                path.unlink(missing_ok=True)
+            index = self._load_index()
+            if index.pop(session_id, None) is not None:
+                found = True
+                self._save_index(index)
+            return found
+
+    def restore(self, session_id: str) -> bool:
+        """Move an archived session back to a live file; True if it was archived."""
+        with self._lock:
+            if self.session_path(session_id).exists():
+                return False
+            index = self._load_index()
+            entry = index.get(session_id)
+            if entry is None:
+                return False
+            messages = self._read_archived(entry["segment"], session_id)
+            self.root.mkdir(parents=True, exist_ok=True)
+            self.session_path(session_id).write_text(json.dumps(messages), encoding="utf-8")
+            if entry.get("metadata"):
+                self.meta_path(session_id).write_text(
+                    json.dumps(entry["metadata"], ensure_ascii=False, indent=2), encoding="utf-8"
+                )
+            del index[session_id]
+            self._save_index(index)
+            # Segment cũ vẫn giữ bản sao; compact() sau sẽ xóa segment không còn được tham chiếu
+            return True
+
+    def listing_version(self) -> Tuple[List[str], Optional[float]]:
+        """Stat-only fingerprint of the session list (for ETags) and its newest mtime."""
+        parts: List[str] = []
+        latest: Optional[float] = None
+        paths = list(self.root.glob("*.json")) if self.root.exists() else []
+        index_path = self.archive_dir / ARCHIVE_INDEX
+        if index_path.exists():
+            paths.append(index_path)
+        for path in sorted(paths):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            parts.append(f"{path.name}:{stat.st_mtime_ns}:{stat.st_size}")
+            latest = stat.st_mtime if latest is None else max(latest, stat.st_mtime)
+        return parts, latest
+
+    def session_version(self, session_id: str) -> Optional[Tuple[List[str], float]]:
+        """Fingerprint and mtime of one session's messages, or None when it does not exist."""
+        try:
+            stat = self.session_path(session_id).stat()
+            return [session_id, str(stat.st_mtime_ns), str(stat.st_size)], stat.st_mtime
+        except FileNotFoundError:
+            entry = self._load_index().get(session_id)
+            if entry is None:
+                return None
+            return [session_id, entry["segment"], str(entry["updated_at"])], entry["updated_at"]
+
+    def summaries(self) -> List[dict]:
+        """`{id, title, created_at, updated_at, message_count, archived}` for every session, newest first."""
+        sessions = []
+        seen = set()
+        for path in self._live_files():
+            session_id = path.stem
+            seen.add(session_id)
+            try:
+                summary = self._live_summary(session_id, path)
+            except Exception:  # noqa: BLE001
+                continue
+            sessions.append(summary)
+        for stale in set(self._summary_cache) - seen:
+            self._summary_cache.pop(stale, None)
+        live = {session["id"] for session in sessions}
+        for session_id, entry in self._load_index().items():
+            if session_id in live:
+                continue
+            sessions.append(
+                {
+                    "id": session_id,
+                    "title": entry["title"],
+                    "created_at": entry["created_at"],
+                    "updated_at": entry["updated_at"],
+                    "message_count": entry["message_count"],
+                    "archived": True,
+                }
+            )
+        sessions.sort(key=lambda session: session["updated_at"], reverse=True)
+        return sessions
+
+    def _live_summary(self, session_id: str, path: Path) -> dict:
+        stat = path.stat()
+        meta_path = self.meta_path(session_id)
+        key = (stat.st_mtime_ns, stat.st_size, meta_path.stat().st_mtime_ns if meta_path.exists() else None)
+        cached = self._summary_cache.get(session_id)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        # Chỉ parse lại file có mtime/kích thước thay đổi kể từ lần liệt kê trước
+        messages = messages_from_dict(json.loads(path.read_text(encoding="utf-8") or "[]"))
+        summary = {
+            "id": session_id,
+            "title": _title(self.load_metadata(session_id), messages),
+            "created_at": stat.st_ctime,
+            "updated_at": stat.st_mtime,
+            "message_count": len(messages),
+            "archived": False,
+        }
+        self._summary_cache[session_id] = (key, summary)
+        return summary
+
+    def compact(self, idle_after: float, *, now: Optional[float] = None) -> CompactionReport:
+        """Archive sessions untouched for `idle_after` seconds, drop orphaned metadata and dead segments."""
+        report = CompactionReport()
+        if not self.root.exists():
+            return report
+        cutoff = (now if now is not None else time.time()) - idle_after
+        with self._lock:
+            index = self._load_index()
+            records = []
+            for path in self._live_files():
+                try:
+                    stat = path.stat()
+                    if stat.st_mtime >= cutoff:
+                        continue
+                    messages = json.loads(path.read_text(encoding="utf-8") or "[]")
+                except FileNotFoundError:
+                    # Phiên vừa bị xóa
+                    continue
+                except (OSError, ValueError):
+                    logger.warning("history_unreadable", extra={"fields": {"path": str(path)}})
+                    continue
+                records.append((path, stat, messages))
+
+            if records:
+                segment = self._write_segment(records)
+                report.segment = segment.name
+                report.bytes_written = segment.stat().st_size
+                archived = []
+                for path, stat, messages in records:
+                    session_id = path.stem
+                    if not _unchanged(path, stat):
+                        # Bị xóa hoặc có tin nhắn mới trong lúc archive: giữ nguyên, bỏ bản trong segment
+                        continue
+                    metadata = self.load_metadata(session_id)
+                    index[session_id] = {
+                        "segment": segment.name,
+                        "title": _title(metadata, messages_from_dict(messages)),
+                        "created_at": stat.st_ctime,
+                        "updated_at": stat.st_mtime,
+                        "message_count": len(messages),
+                        "metadata": metadata,
+                    }
+                    archived.append((path, stat))
+                if archived:
+                    # Lưu index trước khi xóa file live: dừng giữa chừng thì phiên vẫn đọc được
+                    # (file live được ưu tiên hơn bản trong segment)
+                    self._save_index(index)
+                    rolled_back = False
+                    for path, stat in archived:
+                        session_id = path.stem
+                        if not _unchanged(path, stat):
+                            index.pop(session_id, None)
+                            rolled_back = True
+                            continue
+                        for file_path in (path, self.meta_path(session_id)):
+                            size = _unlink(file_path)
+                            if size is not None:
+                                report.bytes_removed += size
+                                report.files_removed += 1
+                        report.archived_sessions += 1
+                    if rolled_back:
+                        self._save_index(index)
+                if not report.archived_sessions:
+                    # Mọi phiên đều vừa thay đổi: không giữ segment rỗng
+                    segment.unlink()
+                    report.segment = None
+                    report.bytes_written = 0
+
+            for meta_path in self.root.glob(f"*{META_SUFFIX}"):
+                session_id = meta_path.name[: -len(META_SUFFIX)]
+                if self.session_path(session_id).exists():
+                    continue
+                if session_id in index:
+                    # Metadata ghi sau khi archive: chuyển vào index
+                    index[session_id]["metadata"] = self.load_metadata(session_id)
+                    self._save_index(index)
+                size = _unlink(meta_path)
+                if size is None:
+                    continue
+                if session_id not in index:
+                    report.orphaned_meta_removed += 1
+                report.bytes_removed += size
+                report.files_removed += 1
+
+            referenced = {entry["segment"] for entry in index.values()}
+            for segment_path in self.archive_dir.glob(SEGMENT_GLOB):
+                if segment_path.name in referenced or segment_path.name == report.segment:
+                    continue
+                size = _unlink(segment_path)
+                if size is not None:
+                    report.bytes_removed += size
+                    report.files_removed += 1
+                    report.segments_removed += 1
+
+        HISTORY_ARCHIVED.inc(report.archived_sessions)
+        HISTORY_RECLAIMED_BYTES.inc(max(report.bytes_reclaimed, 0))
+        logger.info("history_compacted", extra={"fields": report.as_dict()})
+        return report
+
+    def _live_files(self) -> Iterator[Path]:
+        if not self.root.exists():
+            return iter(())
+        return (path for path in self.root.glob("*.json") if not path.name.endswith(META_SUFFIX))
+
+    def _write_segment(self, records: List[Tuple[Path, os.stat_result, list]]) -> Path:
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime())
+        segment = self.archive_dir / f"segment-{stamp}-{time.time_ns() % 1_000_000:06d}.jsonl.gz"
+        tmp = segment.with_suffix(".tmp")
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            for path, _, messages in records:
+                f.write(json.dumps({"session_id": path.stem, "messages": messages}, ensure_ascii=False) + "\n")
+        os.replace(tmp, segment)
+        return segment
+
+    def _read_archived(self, segment: str, session_id: str) -> list:
+        with gzip.open(self.archive_dir / segment, "rt", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if record["session_id"] == session_id:
+                    return record["messages"]
+        raise KeyError(f"Session {session_id} missing from archive segment {segment}")
+
+    def _load_index(self) -> Dict[str, dict]:
+        path = self.archive_dir / ARCHIVE_INDEX
+        if not path.exists():
+            return {}
+        return json.loads(path.read_text(encoding="utf-8"))
+
+    def _save_index(self, index: Dict[str, dict]) -> None:
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        path = self.archive_dir / ARCHIVE_INDEX
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(index, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+
+
+def _unchanged(path: Path, stat: os.stat_result) -> bool:
+    """False when `path` was modified or deleted since `stat` was taken."""
+    try:
+        current = path.stat()
+    except FileNotFoundError:
+        return False
+    return (current.st_mtime, current.st_size) == (stat.st_mtime, stat.st_size)
+
+
+def _unlink(path: Path) -> Optional[int]:
+    """Delete `path` and return its size, or None when it is already gone."""
+    try:
+        size = path.stat().st_size
+        path.unlink()
+    except FileNotFoundError:
+        return None
+    return size
+
+
+def _title(metadata: dict, messages: Optional[List[BaseMessage]], default: str = "New Chat") -> str:
+    """Custom title, else the first message truncated to 50 characters."""
+    if metadata.get("custom_title"):
+        return metadata["custom_title"]
+    content = str(getattr(messages[0], "content", "")) if messages else ""
+    if not content:
+        return default
+    return content[:50] + ("..." if len(content) > 50 else "")
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Callable, Iterable, Optional
+
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.staticfiles import StaticFiles
+from starlette.types import Scope
+
+# Vite đặt hash nội dung vào tên file trong `assets/` nên có thể cache vĩnh viễn
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+def make_etag(parts: Iterable[str]) -> str:
+    """Weak ETag over `parts` (weak because compression middleware changes the bytes on the wire)."""
+
+    digest = hashlib.blake2b("\n".join(parts).encode("utf-8"), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[float]) -> bool:
+    """RFC 9110 conditional GET: If-None-Match wins over If-Modified-Since."""
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or etag.removeprefix("W/") in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # Last-Modified chỉ có độ phân giải giây
+        return int(last_modified) <= since
+    return False
+
+
+def conditional_json(
+    request: Request,
+    etag: str,
+    last_modified: Optional[float],
+    payload: Callable[[], Any],
+) -> Response:
+    """JSON response with validators; `payload()` is only built when the client copy is stale."""
+
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE_CACHE_CONTROL}
+    if last_modified is not None:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(payload(), headers=headers)
+
+
+class CachedStaticFiles(StaticFiles):
+    """`StaticFiles` that lets browsers keep hashed build assets forever and revalidate the rest."""
+
+    def __init__(self, *args: Any, immutable_prefix: str = "assets/", **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.immutable_prefix = immutable_prefix
+
+    def file_response(self, full_path: Any, stat_result: Any, scope: Scope, status_code: int = 200) -> Response:
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        path = self.get_path(scope)
+        immutable = path.startswith(self.immutable_prefix) and status_code == 200
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+        return response
@@ -0,0 +1,454 @@
+from __future__ import annotations
+
+import bisect
+import contextvars
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+from langchain_core.outputs import LLMResult
+
+logger = logging.getLogger("mock_project")
+
+T = TypeVar("T")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+# --- Prometheus metrics (text exposition format, không cần prometheus_client) ---
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _format_labels(self, key: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        body = ",".join(f'{name}="{_escape(value)}"' for name, value in pairs)
+        return "{" + body + "}"
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self._values: Dict[Tuple[str, ...], float] = {}
+        super().__init__(name, documentation, labelnames)
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{self._format_labels(key)} {_number(value)}" for key, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, **labels: str) -> int:
+        state = self._values.get(self._key(labels))
+        return int(state[-1]) if state else 0
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        for key, state in items:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self._format_labels(key, ('le', _number(bound)))} {_number(cumulative)}")
+            lines.append(f"{self.name}_bucket{self._format_labels(key, ('le', '+Inf'))} {_number(state[-1])}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {_number(state[-2])}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {_number(state[-1])}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = Histogram("chatbot_request_seconds", "End-to-end latency per operation.", ["operation"])
+STAGE_SECONDS = Histogram("chatbot_stage_seconds", "Latency per pipeline stage.", ["operation", "stage"])
+REQUESTS = Counter("chatbot_requests_total", "Requests per operation and outcome.", ["operation", "outcome"])
+TOKENS = Counter("chatbot_tokens_total", "LLM tokens consumed.", ["direction"])
+CACHE_REQUESTS = Counter("chatbot_cache_requests_total", "Cache lookups by cache and result.", ["cache", "result"])
+CONTEXT_TOKENS = Counter(
+    "chatbot_context_tokens_total", "Retrieved context tokens: plain top-k vs after dedup/MMR/packing.", ["kind"]
+)
+CONDENSE = Counter(
+    "chatbot_condense_total",
+    "Question condensation outcomes (first_turn, sequential, speculative_hit, speculative_miss, deadline).",
+    ["outcome"],
+)
+CONDENSE_SAVED_SECONDS = Counter(
+    "chatbot_condense_saved_seconds_total", "Retrieval time overlapped with condensation by speculative retrieval."
+)
+LLM_REQUESTS = Counter(
+    "chatbot_llm_requests_total",
+    "Upstream LLM calls by stage and whether a hedge request was sent.",
+    ["stage", "hedged"],
+)
+HEDGE_WINS = Counter(
+    "chatbot_llm_hedge_wins_total", "Hedged LLM calls by which request answered first.", ["stage", "winner"]
+)
+DEADLINE_EXCEEDED = Counter("chatbot_deadline_exceeded_total", "Stages that ran out of their deadline budget.", ["stage"])
+HISTORY_ARCHIVED = Counter("chatbot_history_archived_sessions_total", "Idle chat sessions moved to the archive.")
+HISTORY_RECLAIMED_BYTES = Counter(
+    "chatbot_history_reclaimed_bytes_total", "Bytes freed in the chat history directory by compaction."
+)
+SCHEDULER_QUEUE_DEPTH = Gauge("chatbot_scheduler_queue_depth", "Requests waiting for LLM capacity.", ["tier"])
+SCHEDULER_WAIT_SECONDS = Histogram(
+    "chatbot_scheduler_wait_seconds", "Time spent queued before an LLM slot was granted.", ["tier"]
+)
+SCHEDULER_REQUESTS = Counter(
+    "chatbot_scheduler_requests_total", "Scheduler decisions (admitted, rejected, timeout, cancelled).", ["tier", "outcome"]
+)
+SCHEDULER_TOKENS = Gauge("chatbot_scheduler_tokens_available", "Tokens left in the global tokens-per-minute bucket.")
+ACTIVE_WEBSOCKETS = Gauge("chatbot_active_websockets", "Currently open /ws/chat connections.")
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+    trace = current_trace()
+    if trace is not None and cache == "answer":
+        trace.cache_hit = hit
+
+
+# --- Per-request stage timings ---
+
+
+_CURRENT_TRACE: contextvars.ContextVar[Optional["RequestTrace"]] = contextvars.ContextVar(
+    "mock_project_trace", default=None
+)
+
+
+@dataclass
+class RequestTrace:
+    """Stage timings and counters collected while serving one operation."""
+
+    operation: str
+    session_id: Optional[str] = None
+    stages: Dict[str, float] = field(default_factory=dict)
+    tokens_in: int = 0
+    tokens_out: int = 0
+    cache_hit: Optional[bool] = None
+    error: Optional[BaseException] = None
+    started: float = field(default_factory=time.perf_counter)
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def finish(self, *, sample_rate: float = 1.0, error: Optional[BaseException] = None) -> None:
+        """Publish stage histograms/counters and emit a sampled structured log line."""
+
+        total = time.perf_counter() - self.started
+        error = error or self.error
+        # FAISS search = retrieve - embedding truy vấn
+        # (embed vắng mặt khi embedding câu hỏi lấy từ cache: search = toàn bộ retrieve)
+        if "retrieve" in self.stages:
+            self.stages["search"] = max(self.stages["retrieve"] - self.stages.get("embed", 0.0), 0.0)
+
+        outcome = "error" if error else "ok"
+        REQUEST_SECONDS.observe(total, operation=self.operation)
+        REQUESTS.inc(operation=self.operation, outcome=outcome)
+        for stage, seconds in self.stages.items():
+            STAGE_SECONDS.observe(seconds, operation=self.operation, stage=stage)
+        TOKENS.inc(self.tokens_in, direction="in")
+        TOKENS.inc(self.tokens_out, direction="out")
+
+        if error is None and random.random() >= sample_rate:
+            return
+        record = {
+            "operation": self.operation,
+            "session_id": self.session_id,
+            "outcome": outcome,
+            "duration_ms": round(total * 1000, 2),
+            "stages_ms": {stage: round(seconds * 1000, 2) for stage, seconds in self.stages.items()},
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "cache_hit": self.cache_hit,
+        }
+        if error is not None:
+            record["error"] = repr(error)
+            logger.error("request_failed", extra={"fields": record}, exc_info=error)
+        else:
+            logger.info("request_completed", extra={"fields": record})
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _CURRENT_TRACE.get()
+
+
+@contextmanager
+def track(operation: str, session_id: Optional[str] = None, *, sample_rate: float = 1.0) -> Iterator[RequestTrace]:
+    """Collect stage timings for the enclosed block and publish them on exit."""
+
+    trace = RequestTrace(operation=operation, session_id=session_id)
+    token = _CURRENT_TRACE.set(trace)
+    try:
+        yield trace
+    except BaseException as exc:
+        trace.finish(sample_rate=sample_rate, error=exc)
+        raise
+    else:
+        trace.finish(sample_rate=sample_rate)
+    finally:
+        _CURRENT_TRACE.reset(token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a block into the active trace (no-op outside `track`)."""
+
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    with trace.stage(name):
+        yield
+
+
+async def run_traced(trace: RequestTrace, awaitable: Awaitable[T]) -> T:
+    """Await `awaitable` with `trace` active; use inside `asyncio.create_task`."""
+
+    token = _CURRENT_TRACE.set(trace)
+    try:
+        return await awaitable
+    finally:
+        _CURRENT_TRACE.reset(token)
+
+
+class StageTimingHandler(BaseCallbackHandler):
+    """Map ConversationalRetrievalChain callbacks onto pipeline stages.
+
+    history_load: from invoke until the root chain starts (memory `prep_inputs`).
+    condense / retrieve / generate: question generator, retriever and answer chain runs.
+    ttft: first streamed token, measured from the start of the request.
+    history_write: from the end of generation until the root chain ends (memory save).
+    """
+
+    run_inline = True
+
+    def __init__(self, trace: RequestTrace) -> None:
+        self.trace = trace
+        self._created = time.perf_counter()
+        self._root: Optional[UUID] = None
+        self._open: Dict[UUID, Tuple[str, float]] = {}
+        self._generate_end: Optional[float] = None
+        self._first_token = False
+        self._streamed_tokens = 0
+
+    def on_chain_start(
+        self,
+        serialized: Optional[Dict[str, Any]],
+        inputs: Dict[str, Any],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any,
+    ) -> None:
+        now = time.perf_counter()
+        if parent_run_id is None and self._root is None:
+            self._root = run_id
+            self.trace.add("history_load", now - self._created)
+            return
+        if parent_run_id != self._root:
+            return
+        name = kwargs.get("name") or ""
+        if name == "LLMChain":
+            self._open[run_id] = ("condense", now)
+        elif name.endswith("DocumentsChain"):
+            self._open[run_id] = ("generate", now)
+
+    def on_chain_end(self, outputs: Dict[str, Any], *, run_id: UUID, **kwargs: Any) -> None:
+        now = time.perf_counter()
+        if run_id == self._root:
+            if self._generate_end is not None:
+                self.trace.add("history_write", now - self._generate_end)
+            return
+        opened = self._open.pop(run_id, None)
+        if opened:
+            stage_name, started = opened
+            self.trace.add(stage_name, now - started)
+            if stage_name == "generate":
+                self._generate_end = now
+
+    def on_retriever_start(self, serialized: Dict[str, Any], query: str, *, run_id: UUID, **kwargs: Any) -> None:
+        self._open[run_id] = ("retrieve", time.perf_counter())
+
+    def on_retriever_end(self, documents: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        opened = self._open.pop(run_id, None)
+        if opened:
+            self.trace.add(opened[0], time.perf_counter() - opened[1])
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self._streamed_tokens += 1
+        if not self._first_token:
+            self._first_token = True
+            self.trace.add("ttft", time.perf_counter() - self.trace.started)
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage:
+            self.trace.tokens_in += int(usage.get("prompt_tokens", 0))
+            self.trace.tokens_out += int(usage.get("completion_tokens", 0))
+        else:
+            # Streaming của OpenAI không trả usage; đếm số token đã nhận
+            self.trace.tokens_out += self._streamed_tokens
+        self._streamed_tokens = 0
+
+
+class TimedEmbeddings(Embeddings):
+    """Delegate to another `Embeddings` and record the `embed` stage on the active trace."""
+
+    def __init__(self, inner: Embeddings) -> None:
+        self.inner = inner
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with stage("embed"):
+            return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with stage("embed"):
+            return self.inner.embed_query(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        with stage("embed"):
+            return await self.inner.aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        with stage("embed"):
+            return await self.inner.aembed_query(text)
+
+
+# --- Structured logging ---
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; structured fields come from `extra={"fields": {...}}`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload: Dict[str, Any] = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        payload.update(getattr(record, "fields", {}) or {})
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def configure_logging(level: str = "INFO") -> None:
+    """Attach a JSON stdout handler to the package logger (idempotent)."""
+
+    if any(getattr(handler, "_mock_project_json", False) for handler in logger.handlers):
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    handler._mock_project_json = True  # type: ignore[attr-defined]
+    logger.addHandler(handler)
+    logger.setLevel(level.upper())
+    logger.propagate = False
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import hmac
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from types import FrameType
+from typing import Optional, Tuple
+
+from .config import Settings
+
+
+class SamplingProfiler:
+    """Periodically sample the Python stack of one thread from a background thread.
+
+    Output is in "folded stacks" format (`root;child;leaf count` per line), which
+    flamegraph.pl, speedscope and inferno render directly. Sampling the event-loop
+    thread of an async handler also captures any other coroutine running on it.
+    """
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = 0.005) -> None:
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.samples: Counter[Tuple[str, ...]] = Counter()
+        self.started_at: Optional[float] = None
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "SamplingProfiler":
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> "SamplingProfiler":
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.started_at is not None:
+            self.duration = time.perf_counter() - self.started_at
+        return self
+
+    def __enter__(self) -> "SamplingProfiler":
+        return self.start()
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.stop()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[_stack(frame)] += 1
+
+    def folded(self) -> str:
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.samples.most_common())
+
+    def write(self, directory: Path, label: str) -> Path:
+        """Save the folded stacks as `<directory>/<label>-<utc timestamp>.folded`."""
+
+        directory.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        path = directory / f"{label}-{stamp}.folded"
+        path.write_text(self.folded(), encoding="utf-8")
+        return path
+
+
+def _stack(frame: Optional[FrameType]) -> Tuple[str, ...]:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+        frame = frame.f_back
+    names.reverse()
+    return tuple(names)
+
+
+def profiling_authorized(settings: Settings, token: Optional[str]) -> bool:
+    """True when on-demand profiling is enabled and `token` matches ADMIN_TOKEN."""
+
+    if not (settings.profiling_enabled and settings.admin_token and token):
+        return False
+    return hmac.compare_digest(token.encode("utf-8"), settings.admin_token.encode("utf-8"))
@@ -0,0 +1,360 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterator, List, Optional, TypeVar
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel, agenerate_from_stream
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+from .observability import DEADLINE_EXCEEDED, HEDGE_WINS, LLM_REQUESTS
+
+T = TypeVar("T")
+
+# Thứ tự các stage trong một lượt hỏi; thời gian dư của stage trước được chuyển cho stage sau
+STAGE_ORDER = ("condense", "retrieve", "generate")
+DEFAULT_DEADLINE_SHARES = {"condense": 0.25, "retrieve": 0.15, "generate": 0.6}
+
+
+class DeadlineExceeded(TimeoutError):
+    def __init__(self, stage: str, timeout: float) -> None:
+        super().__init__(f"{stage} stage exceeded its {timeout:.2f}s deadline")
+        self.stage = stage
+
+
+@dataclass
+class DeadlineBudget:
+    """Per-request time budget split across `STAGE_ORDER` by `shares`.
+
+    A stage may use whatever is left of the request budget minus the shares
+    reserved for the stages after it, so time saved early rolls over to generation.
+    """
+
+    total: float
+    shares: Dict[str, float] = field(default_factory=lambda: dict(DEFAULT_DEADLINE_SHARES))
+    started: float = field(default_factory=time.perf_counter)
+
+    def remaining(self) -> float:
+        return self.total - (time.perf_counter() - self.started)
+
+    def timeout_for(self, stage: str) -> Optional[float]:
+        """Seconds `stage` may take, or None for stages outside the budget (e.g. memory summaries)."""
+        if stage not in STAGE_ORDER:
+            return None
+        later = STAGE_ORDER[STAGE_ORDER.index(stage) + 1 :]
+        reserved = sum(self.shares.get(name, 0.0) for name in later) * self.total
+        return max(self.remaining() - reserved, 0.0)
+
+
+_CURRENT_BUDGET: contextvars.ContextVar[Optional[DeadlineBudget]] = contextvars.ContextVar(
+    "mock_project_deadline", default=None
+)
+
+
+def current_budget() -> Optional[DeadlineBudget]:
+    return _CURRENT_BUDGET.get()
+
+
+@contextmanager
+def deadline_budget(budget: Optional[DeadlineBudget]) -> Iterator[Optional[DeadlineBudget]]:
+    """Make `budget` the active deadline for the enclosed block (no-op when None)."""
+
+    token = _CURRENT_BUDGET.set(budget)
+    try:
+        yield budget
+    finally:
+        _CURRENT_BUDGET.reset(token)
+
+
+async def run_within(budget: Optional[DeadlineBudget], awaitable: Awaitable[T]) -> T:
+    """Await `awaitable` with `budget` active; use inside `asyncio.create_task`."""
+
+    with deadline_budget(budget):
+        return await awaitable
+
+
+def stage_timeout(stage: str) -> Optional[float]:
+    budget = current_budget()
+    return budget.timeout_for(stage) if budget is not None else None
+
+
+def call_with_deadline(stage: str, fn: Callable[..., T], *args: Any) -> T:
+    """Run `fn(*args)` bounded by the active budget for `stage` (inline when there is none)."""
+
+    timeout = stage_timeout(stage)
+    if timeout is None:
+        return fn(*args)
+    future = _pool("retrieve").submit(contextvars.copy_context().run, fn, *args)
+    done, _ = wait([future], timeout=timeout)
+    if not done:
+        DEADLINE_EXCEEDED.inc(stage=stage)
+        raise DeadlineExceeded(stage, timeout)
+    return future.result()
+
+
+async def acall_with_deadline(stage: str, awaitable: Awaitable[T]) -> T:
+    timeout = stage_timeout(stage)
+    if timeout is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        DEADLINE_EXCEEDED.inc(stage=stage)
+        raise DeadlineExceeded(stage, timeout) from None
+
+
+class _LatencyWindow:
+    """Recent successful call latencies per stage, for an adaptive (p95) hedge delay."""
+
+    def __init__(self, size: int = 200) -> None:
+        self._samples: Dict[str, Deque[float]] = {}
+        self._size = size
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(stage, deque(maxlen=self._size)).append(seconds)
+
+    def percentile(self, stage: str, q: float, min_samples: int = 20) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(stage, ()))
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+LATENCIES = _LatencyWindow()
+
+
+class HedgedChatModel(BaseChatModel):
+    """Wrap a chat model with a stage deadline and hedged (duplicate) requests.
+
+    When the first request has not answered (or, when streaming, produced its first
+    token) within the hedge delay, an identical second request is sent; whichever
+    responds first wins and the other is cancelled. In async code cancellation
+    closes the HTTP request; synchronous losers are abandoned and their result
+    discarded. Callbacks belong to this wrapper, not to `inner`.
+    """
+
+    inner: BaseChatModel
+    stage: str = "generate"
+    hedge_delay: float = 0.0
+    adaptive_hedge: bool = False
+    streaming: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return f"hedged-{self.inner._llm_type}"
+
+    def get_num_tokens(self, text: str) -> int:
+        return self.inner.get_num_tokens(text)
+
+    def get_token_ids(self, text: str) -> List[int]:
+        return self.inner.get_token_ids(text)
+
+    def get_num_tokens_from_messages(self, messages: List[BaseMessage], tools: Optional[Any] = None) -> int:
+        return self.inner.get_num_tokens_from_messages(messages)
+
+    def _latency_key(self, ttft: bool) -> str:
+        # Stream đua tới token đầu tiên, không phải tới hết câu trả lời: hai phân phối tách riêng
+        return f"{self.stage}:ttft" if ttft else self.stage
+
+    def _hedge_after(self, ttft: bool = False) -> Optional[float]:
+        if self.adaptive_hedge:
+            observed = LATENCIES.percentile(self._latency_key(ttft), 0.95)
+            if observed is not None:
+                return observed
+        return self.hedge_delay if self.hedge_delay > 0 else None
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        started = time.perf_counter()
+        timeout = stage_timeout(self.stage)
+        hedge_after = self._hedge_after()
+        call = lambda: self.inner._generate(messages, stop=stop, **kwargs)  # noqa: E731
+        if timeout is None and hedge_after is None:
+            LLM_REQUESTS.inc(stage=self.stage, hedged="false")
+            return self._observed(call(), started)
+
+        pool = _pool("llm")
+        futures: List[Future] = [pool.submit(call)]
+        if hedge_after is not None and (timeout is None or hedge_after < timeout):
+            done, _ = wait(futures, timeout=hedge_after)
+            if not done:
+                futures.append(pool.submit(call))
+        LLM_REQUESTS.inc(stage=self.stage, hedged=str(len(futures) > 1).lower())
+
+        pending = set(futures)
+        error: Optional[BaseException] = None
+        while pending:
+            left = None if timeout is None else max(timeout - (time.perf_counter() - started), 0.0)
+            done, pending = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    self._record_winner(futures, future)
+                    return self._observed(future.result(), started)
+                error = future.exception()
+        if error is not None and not pending:
+            raise error
+        DEADLINE_EXCEEDED.inc(stage=self.stage)
+        raise DeadlineExceeded(self.stage, timeout or 0.0)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.streaming:
+            return await agenerate_from_stream(self._astream(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+        started = time.perf_counter()
+        winner, _ = await self._race(lambda: self.inner._agenerate(messages, stop=stop, **kwargs))
+        return self._observed(winner, started)
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        started = time.perf_counter()
+        streams: List[AsyncIterator[ChatGenerationChunk]] = []
+
+        def start() -> Awaitable[Optional[ChatGenerationChunk]]:
+            stream = self.inner._astream(messages, stop=stop, **kwargs)
+            streams.append(stream)
+            return _next_chunk(stream)
+
+        # Đua tới token đầu tiên; luồng thua bị hủy (đóng request HTTP)
+        first, index = await self._race(start, ttft=True)
+        LATENCIES.add(self._latency_key(ttft=True), time.perf_counter() - started)
+
+        timeout = stage_timeout(self.stage)
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        chunk: Optional[ChatGenerationChunk] = first
+        winner = streams[index]
+        try:
+            while chunk is not None:
+                if run_manager:
+                    await run_manager.on_llm_new_token(str(chunk.message.content), chunk=chunk)
+                yield chunk
+                left = None if deadline is None else max(deadline - time.perf_counter(), 0.0)
+                try:
+                    chunk = await asyncio.wait_for(_next_chunk(winner), left)
+                except asyncio.TimeoutError:
+                    DEADLINE_EXCEEDED.inc(stage=self.stage)
+                    raise DeadlineExceeded(self.stage, timeout or 0.0) from None
+        finally:
+            await _aclose(winner)
+
+    async def _race(self, start: Callable[[], Awaitable[T]], *, ttft: bool = False) -> tuple[T, int]:
+        """Run `start()`, hedge with a second `start()` after the hedge delay, return the first success."""
+        started = time.perf_counter()
+        timeout = stage_timeout(self.stage)
+        hedge_after = self._hedge_after(ttft)
+        tasks = [asyncio.ensure_future(start())]
+        try:
+            if hedge_after is not None and (timeout is None or hedge_after < timeout):
+                done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+                if not done:
+                    tasks.append(asyncio.ensure_future(start()))
+            LLM_REQUESTS.inc(stage=self.stage, hedged=str(len(tasks) > 1).lower())
+
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                left = None if timeout is None else max(timeout - (time.perf_counter() - started), 0.0)
+                done, pending = await asyncio.wait(pending, timeout=left, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        self._record_winner(tasks, task)
+                        return task.result(), tasks.index(task)
+                    error = task.exception()
+            if error is not None and not pending:
+                raise error
+            DEADLINE_EXCEEDED.inc(stage=self.stage)
+            raise DeadlineExceeded(self.stage, timeout or 0.0)
+        finally:
+            losers = [task for task in tasks if not task.done()]
+            for task in losers:
+                task.cancel()
+            # Chờ request bị hủy dọn dẹp xong (đóng kết nối) trước khi trả về
+            await asyncio.gather(*losers, return_exceptions=True)
+
+    def _record_winner(self, candidates: List[Any], winner: Any) -> None:
+        if len(candidates) > 1:
+            HEDGE_WINS.inc(stage=self.stage, winner="primary" if winner is candidates[0] else "hedge")
+
+    def _observed(self, result: ChatResult, started: float) -> ChatResult:
+        LATENCIES.add(self._latency_key(ttft=False), time.perf_counter() - started)
+        return result
+
+
+async def _next_chunk(stream: AsyncIterator[ChatGenerationChunk]) -> Optional[ChatGenerationChunk]:
+    try:
+        return await stream.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def _aclose(stream: AsyncIterator[Any]) -> None:
+    close = getattr(stream, "aclose", None)
+    if close is not None:
+        try:
+            await close()
+        except Exception:  # noqa: BLE001
+            pass
+
+
+_POOL_SIZES = {"llm": 32, "retrieve": 16}
+_POOLS: Dict[str, ThreadPoolExecutor] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def configure_pools(*, llm_workers: int, retrieve_workers: int) -> None:
+    """Size the pools for sync hedged/deadline-bound LLM calls and deadline-bound retrieval.
+
+    Abandoned hedge losers keep a worker until their HTTP request returns, so the LLM
+    pool should allow roughly twice the expected concurrent sync requests.
+    """
+    with _POOLS_LOCK:
+        sizes = {"llm": max(1, llm_workers), "retrieve": max(1, retrieve_workers)}
+        for kind, size in sizes.items():
+            if _POOL_SIZES[kind] != size:
+                _POOL_SIZES[kind] = size
+                # Pool cũ chạy nốt việc đang dở; request mới dùng pool theo kích thước mới
+                stale = _POOLS.pop(kind, None)
+                if stale is not None:
+                    stale.shutdown(wait=False)
+
+
+def _pool(kind: str) -> ThreadPoolExecutor:
+    # LLM và retrieval dùng pool riêng: LLM chậm không chiếm chỗ của retrieval
+    with _POOLS_LOCK:
+        pool = _POOLS.get(kind)
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers=_POOL_SIZES[kind], thread_name_prefix=f"{kind}-deadline")
+            _POOLS[kind] = pool
+        return pool
@@ -0,0 +1,414 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+from .observability import CONTEXT_TOKENS, record_cache
+from .resilience import acall_with_deadline, call_with_deadline
+
+
+@lru_cache(maxsize=1)
+def _token_counter() -> Callable[[str], int]:
+    try:
+        import tiktoken  # type: ignore
+
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(encoding.encode(text))
+    except Exception:
+        # Không tải được BPE (offline): ước lượng ~4 ký tự/token
+        return lambda text: max(1, len(text) // 4)
+
+
+def count_tokens(text: str) -> int:
+    return _token_counter()(text)
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """LRU cache for query embeddings in front of another `Embeddings`.
+
+    Only queries are cached (documents are embedded once per build). Batched
+    lookups embed all misses in a single `embed_documents` call.
+    """
+
+    def __init__(self, inner: Embeddings, maxsize: int = 1024) -> None:
+        self.inner = inner
+        self.maxsize = maxsize
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, text: str) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._cache.get(text)
+            if vector is not None:
+                self._cache.move_to_end(text)
+        record_cache("query_embedding", vector is not None)
+        return vector
+
+    def _put(self, text: str, vector: List[float]) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._cache[text] = vector
+            self._cache.move_to_end(text)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.inner.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self._get(text)
+        if vector is None:
+            vector = self.inner.embed_query(text)
+            self._put(text, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vector = self._get(text)
+        if vector is None:
+            vector = await self.inner.aembed_query(text)
+            self._put(text, vector)
+        return vector
+
+    def embed_queries(self, texts: Sequence[str]) -> List[List[float]]:
+        cached = {text: self._get(text) for text in dict.fromkeys(texts)}
+        misses = [text for text, vector in cached.items() if vector is None]
+        if misses:
+            for text, vector in zip(misses, self.inner.embed_documents(misses)):
+                cached[text] = vector
+                self._put(text, vector)
+        return [cached[text] for text in texts]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def mmr_select(
+    query: np.ndarray,
+    vectors: np.ndarray,
+    k: int,
+    lambda_mult: float = 0.5,
+    duplicate_threshold: float = 0.95,
+) -> List[int]:
+    """Pick up to `k` row indices of `vectors` by maximal marginal relevance.
+
+    Candidates whose cosine similarity to an already kept, more relevant candidate
+    reaches `duplicate_threshold` are dropped first. Returned indices are in
+    selection order (most relevant first).
+    """
+    if len(vectors) == 0 or k <= 0:
+        return []
+    unit = _normalize(np.asarray(vectors, dtype=np.float32))
+    relevance = unit @ _normalize(np.asarray(query, dtype=np.float32))
+    similarity = unit @ unit.T
+
+    kept: List[int] = []
+    for index in np.argsort(-relevance, kind="stable"):
+        if kept and similarity[index, kept].max() >= duplicate_threshold:
+            continue
+        kept.append(int(index))
+
+    kept_array = np.array(kept)
+    kept_relevance = relevance[kept_array]
+    kept_similarity = similarity[np.ix_(kept_array, kept_array)]
+    selected = [0]
+    redundancy = kept_similarity[0].copy()
+    available = np.ones(len(kept), dtype=bool)
+    available[0] = False
+    while len(selected) < min(k, len(kept)):
+        scores = lambda_mult * kept_relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        choice = int(np.argmax(scores))
+        selected.append(choice)
+        available[choice] = False
+        redundancy = np.maximum(redundancy, kept_similarity[choice])
+    return [kept[choice] for choice in selected]
+
+
+def merge_adjacent(documents: Sequence[Document]) -> List[Document]:
+    """Merge chunks of the same source/page whose `start_index` ranges touch or overlap.
+
+    Output keeps the rank of the best-ranked member of each merged group.
+    """
+    groups: Dict[Tuple[object, object], List[Tuple[int, Document]]] = {}
+    standalone: List[Tuple[int, Document]] = []
+    for rank, document in enumerate(documents):
+        if "start_index" not in document.metadata:
+            standalone.append((rank, document))
+            continue
+        key = (document.metadata.get("source"), document.metadata.get("page"))
+        groups.setdefault(key, []).append((rank, document))
+
+    merged: List[Tuple[int, Document]] = list(standalone)
+    for members in groups.values():
+        members.sort(key=lambda item: item[1].metadata["start_index"])
+        rank, current = members[0]
+        text = current.page_content
+        start = current.metadata["start_index"]
+        for next_rank, following in members[1:]:
+            next_start = following.metadata["start_index"]
+            end = start + len(text)
+            if next_start <= end:
+                text += following.page_content[end - next_start :]
+                rank = min(rank, next_rank)
+                continue
+            merged.append((rank, Document(page_content=text, metadata={**current.metadata, "start_index": start})))
+            rank, current, text, start = next_rank, following, following.page_content, next_start
+        merged.append((rank, Document(page_content=text, metadata={**current.metadata, "start_index": start})))
+
+    merged.sort(key=lambda item: item[0])
+    return [document for _, document in merged]
+
+
+def pack_to_budget(documents: Sequence[Document], token_budget: int) -> List[Document]:
+    """Keep documents in rank order while they fit in `token_budget` tokens.
+
+    If even the best document does not fit, it is truncated so the prompt never
+    ends up without context.
+    """
+    packed: List[Document] = []
+    remaining = token_budget
+    for document in documents:
+        tokens = count_tokens(document.page_content)
+        if tokens <= remaining:
+            packed.append(document)
+            remaining -= tokens
+        elif not packed:
+            ratio = remaining / tokens
+            text = document.page_content[: int(len(document.page_content) * ratio)]
+            packed.append(Document(page_content=text, metadata=document.metadata))
+            remaining = 0
+    return packed
+
+
+def matches_filter(metadata: Dict[str, Any], metadata_filter: Optional[Dict[str, Any]]) -> bool:
+    """Equality match per key; a list value matches any of its items."""
+    if not metadata_filter:
+        return True
+    for key, expected in metadata_filter.items():
+        value = metadata.get(key)
+        if isinstance(expected, (list, tuple, set)):
+            if value not in expected:
+                return False
+        elif value != expected:
+            return False
+    return True
+
+
+@dataclass
+class _Candidates:
+    distances: List[float] = field(default_factory=list)
+    vectors: List[np.ndarray] = field(default_factory=list)
+    documents: List[Document] = field(default_factory=list)
+
+
+def search_shard(
+    vector_store: FAISS,
+    query_vector: np.ndarray,
+    fetch_k: int,
+    metadata_filter: Optional[Dict[str, Any]] = None,
+    *,
+    need_vectors: bool = True,
+) -> _Candidates:
+    """Top `fetch_k` chunks of one shard with their L2 distances (and stored vectors when `need_vectors`)."""
+    index = vector_store.index
+    query = np.asarray([query_vector], dtype=np.float32)
+    if getattr(vector_store, "_normalize_L2", False):
+        query = _normalize(query)
+    # Lọc metadata sau khi search nên phải lấy dư ứng viên
+    limit = min(fetch_k * (4 if metadata_filter else 1), index.ntotal)
+    found = _Candidates()
+    if limit == 0:
+        return found
+    distances, ids = index.search(query, limit)
+    positions = []
+    for distance, position in zip(distances[0], ids[0]):
+        if position < 0:
+            continue
+        doc_id = vector_store.index_to_docstore_id[int(position)]
+        # CompactDocstore trả metadata mà không giải mã text: chỉ tạo Document cho chunk qua được filter
+        if metadata_filter and hasattr(vector_store.docstore, "metadata"):
+            if not matches_filter(vector_store.docstore.metadata(doc_id) or {}, metadata_filter):
+                continue
+            document = vector_store.docstore.search(doc_id)
+        else:
+            document = vector_store.docstore.search(doc_id)
+            if not matches_filter(document.metadata, metadata_filter):
+                continue
+        positions.append(int(position))
+        found.distances.append(float(distance))
+        found.documents.append(document)
+        if len(positions) == fetch_k:
+            break
+    # reconstruct tốn thêm (index lượng tử hóa phải giải nén): chỉ đọc khi MMR/bỏ gần trùng dùng tới
+    if positions and need_vectors:
+        found.vectors = list(index.reconstruct_batch(np.asarray(positions, dtype=np.int64)))
+    return found
+
+
+class ShardedRetriever(BaseRetriever):
+    """Search per-collection FAISS shards concurrently and merge the results.
+
+    Every shard is embedded with the same model, so L2 distances are comparable and
+    the global top `fetch_k` is a plain merge. With `packing` on, the merged
+    candidates are then de-duplicated, re-ranked with MMR and packed into the token
+    budget; candidate vectors are read back from FAISS, so the query is the only
+    embedding call. `collections` and `metadata_filter` scope a single request
+    (see `scoped`).
+    """
+
+    shards: Dict[str, FAISS]
+    collections: Optional[List[str]] = None
+    metadata_filter: Optional[Dict[str, Any]] = None
+    k: int = 3
+    fetch_k: int = 20
+    packing: bool = True
+    lambda_mult: float = 0.5
+    duplicate_threshold: float = 0.95
+    token_budget: int = 1500
+
+    def scoped(
+        self,
+        collections: Optional[List[str]] = None,
+        metadata_filter: Optional[Dict[str, Any]] = None,
+    ) -> "ShardedRetriever":
+        """Shallow copy restricted to `collections` and `metadata_filter` (shards are shared)."""
+        if not collections and not metadata_filter:
+            return self
+        unknown = sorted(set(collections or ()) - set(self.shards))
+        if unknown:
+            raise ValueError(f"Unknown collection(s): {', '.join(unknown)}")
+        return self.model_copy(update={"collections": list(collections or []) or None, "metadata_filter": metadata_filter})
+
+    def _selected(self) -> List[FAISS]:
+        names = self.collections or sorted(self.shards)
+        return [self.shards[name] for name in names if name in self.shards]
+
+    def _embedder(self):
+        return next(iter(self.shards.values())).embedding_function
+
+    def _search(
+        self, store: FAISS, query: np.ndarray, fetch_k: Optional[int] = None, *, need_vectors: Optional[bool] = None
+    ) -> _Candidates:
+        if fetch_k is None:
+            fetch_k = max(self.fetch_k, self.k) if self.packing else self.k
+        if need_vectors is None:
+            need_vectors = self.packing
+        return search_shard(store, query, fetch_k, self.metadata_filter, need_vectors=need_vectors)
+
+    def _fan_out(self, query_vector: List[float]) -> List[_Candidates]:
+        query = np.asarray(query_vector, dtype=np.float32)
+        stores = self._selected()
+        if len(stores) <= 1:
+            return [self._search(store, query) for store in stores]
+        # FAISS nhả GIL khi search nên các shard chạy song song thật sự
+        return list(_search_pool().map(lambda store: self._search(store, query), stores))
+
+    async def _afan_out(self, query_vector: List[float]) -> List[_Candidates]:
+        query = np.asarray(query_vector, dtype=np.float32)
+        loop = asyncio.get_running_loop()
+        return list(
+            await asyncio.gather(
+                *(loop.run_in_executor(_search_pool(), self._search, store, query) for store in self._selected())
+            )
+        )
+
+    def search(self, queries: Sequence[str], k: Optional[int] = None) -> List[List[Tuple[Document, float]]]:
+        """Raw top-`k` chunks per query with their L2 distance, skipping MMR/packing and the LLM.
+
+        All (query, shard) searches of the batch run concurrently and misses of the
+        query-embedding cache are embedded in one call.
+        """
+        k = k or self.k
+        stores = self._selected()
+        if not queries or not stores:
+            return [[] for _ in queries]
+        embedder = self._embedder()
+        if isinstance(embedder, CachedQueryEmbeddings):
+            vectors = embedder.embed_queries(queries)
+        else:
+            vectors = [embedder.embed_query(query) for query in queries]
+        jobs = [(row, store) for row in range(len(queries)) for store in stores]
+        found = list(
+            _search_pool().map(
+                lambda job: self._search(
+                    job[1], np.asarray(vectors[job[0]], dtype=np.float32), k, need_vectors=False
+                ),
+                jobs,
+            )
+        )
+        merged: List[List[Tuple[Document, float]]] = [[] for _ in queries]
+        for (row, _), candidates in zip(jobs, found):
+            merged[row].extend(zip(candidates.documents, candidates.distances))
+        return [sorted(hits, key=lambda hit: hit[1])[:k] for hits in merged]
+
+    def _select(self, query_vector: List[float], results: List[_Candidates]) -> List[Document]:
+        merged = sorted(
+            (
+                (distance, vector, document)
+                for found in results
+                for distance, vector, document in zip(
+                    found.distances, found.vectors or [None] * len(found.documents), found.documents
+                )
+            ),
+            key=lambda item: item[0],
+        )
+        if not self.packing:
+            return [document for _, _, document in merged[: self.k]]
+
+        merged = merged[: max(self.fetch_k, self.k)]
+        if not merged:
+            return []
+        documents = [document for _, _, document in merged]
+        vectors = np.stack([vector for _, vector, _ in merged])
+        order = mmr_select(np.asarray(query_vector), vectors, self.k, self.lambda_mult, self.duplicate_threshold)
+        packed = pack_to_budget(merge_adjacent([documents[i] for i in order]), self.token_budget)
+
+        baseline = sum(count_tokens(document.page_content) for document in documents[: self.k])
+        CONTEXT_TOKENS.inc(baseline, kind="top_k")
+        CONTEXT_TOKENS.inc(sum(count_tokens(document.page_content) for document in packed), kind="packed")
+        return packed
+
+    def _retrieve(self, query: str) -> List[Document]:
+        query_vector = self._embedder().embed_query(query)
+        return self._select(query_vector, self._fan_out(query_vector))
+
+    async def _aretrieve(self, query: str) -> List[Document]:
+        query_vector = await self._embedder().aembed_query(query)
+        return self._select(query_vector, await self._afan_out(query_vector))
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        if not self._selected():
+            return []
+        return call_with_deadline("retrieve", self._retrieve, query)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        if not self._selected():
+            return []
+        return await acall_with_deadline("retrieve", self._aretrieve(query))
+
+
+@lru_cache(maxsize=1)
+def _search_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="faiss-shard")
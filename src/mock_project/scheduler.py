@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+from .observability import SCHEDULER_QUEUE_DEPTH, SCHEDULER_REQUESTS, SCHEDULER_TOKENS, SCHEDULER_WAIT_SECONDS
+
+DEFAULT_TIERS = {"premium": 4.0, "standard": 1.0}
+
+
+class SchedulerBusy(RuntimeError):
+    """The request waited longer than the queue timeout (or the queue is full)."""
+
+    def __init__(self, tier: str, reason: str) -> None:
+        super().__init__(f"LLM capacity exhausted for tier {tier!r}: {reason}")
+        self.tier = tier
+
+
+@dataclass(order=True)
+class _Waiter:
+    finish: float
+    seq: int
+    tier: str = field(compare=False)
+    session_id: str = field(compare=False)
+    cost: int = field(compare=False)
+    enqueued: float = field(compare=False)
+    event: Optional[threading.Event] = field(default=None, compare=False)
+    future: Optional[asyncio.Future] = field(default=None, compare=False)
+    loop: Optional[asyncio.AbstractEventLoop] = field(default=None, compare=False)
+    granted: bool = field(default=False, compare=False)
+
+
+@dataclass
+class Ticket:
+    """An admitted request; `settle()` replaces the token estimate with real usage."""
+
+    scheduler: "FairScheduler"
+    tier: str
+    estimate: int
+    settled: bool = False
+
+    def settle(self, tokens: int) -> None:
+        if tokens > 0 and not self.settled:
+            self.settled = True
+            self.scheduler._adjust(self.tier, self.estimate - tokens)
+
+
+class FairScheduler:
+    """Admission control for LLM work: weighted fair queuing across sessions and tiers.
+
+    At most `concurrency` requests run at once (0 = unlimited). Waiting requests are
+    served in order of their self-clocked virtual finish time, `max(V, last finish
+    of the session) + cost / tier weight`, so a session with many queued requests
+    only competes with its own backlog and higher tiers get proportionally more
+    capacity without starving the rest. `tokens_per_minute` adds a global token
+    bucket; admission is charged with an estimate that `Ticket.settle()` corrects
+    once the real usage is known.
+    """
+
+    def __init__(
+        self,
+        *,
+        concurrency: int = 0,
+        tiers: Optional[Dict[str, float]] = None,
+        default_tier: str = "standard",
+        tokens_per_minute: int = 0,
+        queue_timeout: float = 30.0,
+        max_queue: int = 0,
+    ) -> None:
+        self.tiers = dict(tiers or DEFAULT_TIERS)
+        if default_tier not in self.tiers:
+            raise ValueError(f"Default tier {default_tier!r} is not one of {', '.join(self.tiers)}")
+        self.concurrency = concurrency
+        self.default_tier = default_tier
+        self.tokens_per_minute = tokens_per_minute
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._active = 0
+        self._virtual_time = 0.0
+        self._last_finish: Dict[str, float] = {}
+        self._tokens = float(tokens_per_minute)
+        self._refilled = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.concurrency > 0 or self.tokens_per_minute > 0
+
+    def tier_for(self, priority: Optional[str]) -> str:
+        """Validate a requested tier (None = default tier)."""
+        tier = (priority or self.default_tier).strip().lower()
+        if tier not in self.tiers:
+            raise ValueError(f"Unknown priority tier {priority!r}; use one of {', '.join(self.tiers)}")
+        return tier
+
+    @contextmanager
+    def slot(self, session_id: str, tier: str, cost: int) -> Iterator[Ticket]:
+        """Block until the request may call the LLM, then hold a slot for the enclosed block."""
+        if not self.enabled:
+            yield Ticket(self, tier, cost)
+            return
+        waiter = self._enqueue(session_id, tier, cost, event=threading.Event())
+        deadline = waiter.enqueued + self.queue_timeout
+        while True:
+            with self._lock:
+                delay = self._dispatch()
+                if waiter.granted:
+                    break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._give_up(waiter, "timeout")
+                if waiter.granted:
+                    break
+                raise SchedulerBusy(tier, f"waited {self.queue_timeout:g}s")
+            waiter.event.wait(min(remaining, delay) if delay is not None else remaining)
+        try:
+            yield Ticket(self, tier, cost)
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def aslot(self, session_id: str, tier: str, cost: int) -> AsyncIterator[Ticket]:
+        """`slot()` for coroutines: waits without blocking the event loop."""
+        if not self.enabled:
+            yield Ticket(self, tier, cost)
+            return
+        loop = asyncio.get_running_loop()
+        waiter = self._enqueue(session_id, tier, cost, future=loop.create_future(), loop=loop)
+        deadline = waiter.enqueued + self.queue_timeout
+        try:
+            while True:
+                with self._lock:
+                    delay = self._dispatch()
+                    if waiter.granted:
+                        break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._give_up(waiter, "timeout")
+                    raise SchedulerBusy(tier, f"waited {self.queue_timeout:g}s")
+                try:
+                    await asyncio.wait_for(
+                        asyncio.shield(waiter.future), min(remaining, delay) if delay is not None else remaining
+                    )
+                except asyncio.TimeoutError:
+                    continue
+        except BaseException:
+            # Hết giờ chờ hoặc client ngắt kết nối khi đang xếp hàng
+            self._give_up(waiter, "cancelled")
+            if waiter.granted:
+                self._release()
+            raise
+        try:
+            yield Ticket(self, tier, cost)
+        finally:
+            self._release()
+
+    def _enqueue(self, session_id: str, tier: str, cost: int, **wakeup: object) -> _Waiter:
+        with self._lock:
+            if self.max_queue and len(self._queue) >= self.max_queue:
+                SCHEDULER_REQUESTS.inc(tier=tier, outcome="rejected")
+                raise SchedulerBusy(tier, "queue full")
+            start = max(self._virtual_time, self._last_finish.get(session_id, 0.0))
+            finish = start + cost / self.tiers[tier]
+            self._last_finish[session_id] = finish
+            waiter = _Waiter(finish, next(self._seq), tier, session_id, cost, time.monotonic(), **wakeup)
+            heapq.heappush(self._queue, waiter)
+            SCHEDULER_QUEUE_DEPTH.inc(tier=tier)
+            return waiter
+
+    def _dispatch(self) -> Optional[float]:
+        """Admit queued requests while capacity allows; seconds until the token bucket can admit the head."""
+        now = time.monotonic()
+        if self.tokens_per_minute:
+            rate = self.tokens_per_minute / 60.0
+            self._tokens = min(self.tokens_per_minute, self._tokens + (now - self._refilled) * rate)
+            self._refilled = now
+        while self._queue and (not self.concurrency or self._active < self.concurrency):
+            head = self._queue[0]
+            if self.tokens_per_minute:
+                need = min(head.cost, self.tokens_per_minute)
+                if self._tokens < need:
+                    SCHEDULER_TOKENS.set(self._tokens)
+                    return (need - self._tokens) / (self.tokens_per_minute / 60.0)
+                self._tokens -= need
+                SCHEDULER_TOKENS.set(self._tokens)
+            heapq.heappop(self._queue)
+            self._active += 1
+            self._virtual_time = max(self._virtual_time, head.finish)
+            head.granted = True
+            SCHEDULER_QUEUE_DEPTH.dec(tier=head.tier)
+            SCHEDULER_REQUESTS.inc(tier=head.tier, outcome="admitted")
+            SCHEDULER_WAIT_SECONDS.observe(now - head.enqueued, tier=head.tier)
+            self._wake(head)
+        if len(self._last_finish) > 4 * (len(self._queue) + 64):
+            # Session không còn backlog không ảnh hưởng thứ tự: bỏ để dict không phình mãi
+            self._last_finish = {
+                session: finish for session, finish in self._last_finish.items() if finish > self._virtual_time
+            }
+        return None
+
+    def _wake(self, waiter: _Waiter) -> None:
+        if waiter.event is not None:
+            waiter.event.set()
+        elif waiter.loop is not None and waiter.future is not None:
+            waiter.loop.call_soon_threadsafe(_resolve, waiter.future)
+
+    def _give_up(self, waiter: _Waiter, outcome: str) -> None:
+        with self._lock:
+            if waiter.granted or waiter not in self._queue:
+                return
+            self._queue.remove(waiter)
+            heapq.heapify(self._queue)
+            SCHEDULER_QUEUE_DEPTH.dec(tier=waiter.tier)
+            SCHEDULER_REQUESTS.inc(tier=waiter.tier, outcome=outcome)
+
+    def _release(self) -> None:
+        with self._lock:
+            self._active -= 1
+            self._dispatch()
+
+    def _adjust(self, tier: str, tokens: float) -> None:
+        if not self.tokens_per_minute:
+            return
+        with self._lock:
+            # Ước lượng dư thì trả lại bucket, thiếu thì trừ thêm (bucket có thể âm)
+            self._tokens = min(self.tokens_per_minute, self._tokens + tokens)
+            SCHEDULER_TOKENS.set(self._tokens)
+            self._dispatch()
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
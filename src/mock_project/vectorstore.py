@@ -1,44 +1,297 @@
 from __future__ import annotations
 
+import json
+import os
+import re
+import shutil
+import time
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Iterable, Optional
+from typing import Dict, Iterable, List, Optional
 
+import numpy as np
 from langchain_openai import OpenAIEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document
-from langchain_core.retrievers import BaseRetriever
+from langchain_core.embeddings import Embeddings
 
 from .config import Settings
+from .docstore import CompactDocstore
+from .document_loader import DEFAULT_COLLECTION, normalize_collection
+from .observability import TimedEmbeddings, logger, stage
+from .retrieval import CachedQueryEmbeddings, ShardedRetriever
+
+SNAPSHOTS_DIR = "snapshots"
+SHARDS_DIR = "shards"
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+_VERSION_PATTERN = re.compile(r"\d{8}T\d{12}Z")
+# Kiểu lưu vector -> scalar quantizer của FAISS (None = IndexFlatL2 float32)
+_QUANTIZERS = {"float32": None, "float16": "QT_fp16", "int8": "QT_8bit"}
+# Số chiều model trả về khi không đặt EMBEDDING_DIMENSIONS
+_DEFAULT_DIMENSIONS = {"text-embedding-3-small": 1536, "text-embedding-3-large": 3072, "text-embedding-ada-002": 1536}
 
 
 class VectorStoreBuilder:
     """Wrap FAISS construction for easier testing and swapping."""
 
-    def __init__(self, settings: Settings) -> None:
+    def __init__(self, settings: Settings, embeddings: Optional[Embeddings] = None) -> None:
         self.settings = settings
-        self._embeddings = OpenAIEmbeddings(
-            model=settings.embedding_model,
-            api_key=settings.openai_api_key,
+        self.last_version: Optional[str] = None
+        # Cache bọc ngoài: câu hỏi lặp lại không tốn lượt gọi embedding (và không tính vào stage embed)
+        self._embeddings = CachedQueryEmbeddings(
+            TimedEmbeddings(
+                embeddings
+                or OpenAIEmbeddings(
+                    model=settings.embedding_model,
+                    api_key=settings.openai_api_key,
+                    dimensions=settings.embedding_dimensions,
+                    base_url=settings.openai_base_url,
+                )
+            ),
+            maxsize=settings.query_embedding_cache_size,
         )
 
-    def build(self, documents: Iterable[Document], persist_path: Optional[Path] = None) -> FAISS:
-        vector_store = FAISS.from_documents(documents=list(documents), embedding=self._embeddings)
+    def build(
+        self,
+        documents: Iterable[Document],
+        persist_path: Optional[Path] = None,
+        *,
+        activate: bool = True,
+        manifest: Optional[dict] = None,
+    ) -> Dict[str, FAISS]:
+        """Embed `documents` into one FAISS shard per `collection` metadata value."""
+        chunks = list(documents)
+        shards = {name: self._from_documents(members) for name, members in group_by_collection(chunks).items()}
 
         if persist_path:
-            persist_path.parent.mkdir(parents=True, exist_ok=True)
-            vector_store.save_local(str(persist_path))
+            with stage("save"):
+                self.last_version = self.save_snapshot(
+                    shards, persist_path, activate=activate, chunks=len(chunks), manifest=manifest
+                )
 
-        return vector_store
+        return shards
+
+    def _from_documents(self, documents: List[Document]) -> FAISS:
+        import faiss
 
-    def load_from_disk(self, persist_path: Path) -> FAISS:
-        return FAISS.load_local(
-            str(persist_path),
-            embeddings=self._embeddings,
-            allow_dangerous_deserialization=True,
+        texts = [document.page_content for document in documents]
+        vectors = np.asarray(self._embeddings.embed_documents(texts), dtype=np.float32)
+        quantizer = _QUANTIZERS[self.settings.vector_storage]
+        if quantizer is None:
+            index = faiss.IndexFlatL2(vectors.shape[1])
+        else:
+            # Scalar quantizer: float16 giảm 2x, int8 giảm 4x dung lượng; int8 cần train min/max từng chiều
+            index = faiss.IndexScalarQuantizer(
+                vectors.shape[1], getattr(faiss.ScalarQuantizer, quantizer), faiss.METRIC_L2
+            )
+            index.train(vectors)
+        vector_store = FAISS(
+            embedding_function=self._embeddings,
+            index=index,
+            docstore=CompactDocstore(),
+            index_to_docstore_id={},
         )
+        # Id = số thứ tự dòng: CompactDocstore không cần bảng tra cứu id
+        vector_store.add_embeddings(
+            list(zip(texts, vectors.tolist())),
+            metadatas=[document.metadata for document in documents],
+            ids=[str(row) for row in range(len(documents))],
+        )
+        return vector_store
+
+    def save_snapshot(
+        self,
+        shards: Dict[str, FAISS],
+        root: Path,
+        *,
+        activate: bool = True,
+        chunks: int = 0,
+        manifest: Optional[dict] = None,
+    ) -> str:
+        """Persist `shards` as a new versioned snapshot under `root/snapshots`.
+
+        Files are written to a temporary directory and renamed into place, and the
+        `CURRENT` pointer is swapped with `os.replace`, so a crash mid-save never
+        leaves a half-written index behind the pointer.
+        """
+        if not shards:
+            # Snapshot rỗng mà được activate thì mọi worker nạp lại sẽ không trả lời được
+            raise ValueError("No chunks to index: refusing to save an empty snapshot")
+        snapshots = root / SNAPSHOTS_DIR
+        snapshots.mkdir(parents=True, exist_ok=True)
+        version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        staging = snapshots / f".tmp-{version}"
+        staging.mkdir()
+        for name, vector_store in shards.items():
+            vector_store.save_local(str(staging / SHARDS_DIR / name))
+        manifest = {
+            **(manifest or {}),
+            "version": version,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "embedding_model": self.settings.embedding_model,
+            "embedding_dimensions": next(iter(shards.values())).index.d,
+            "vector_storage": self.settings.vector_storage,
+            "chunk_size": self.settings.chunk_size,
+            "chunk_overlap": self.settings.chunk_overlap,
+            "chunks": chunks,
+            "collections": {name: vector_store.index.ntotal for name, vector_store in sorted(shards.items())},
+        }
+        (staging / MANIFEST_FILE).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+        os.rename(staging, snapshots / version)
+
+        if activate:
+            activate_snapshot(root, version)
+        prune_snapshots(root, keep=self.settings.index_snapshots_keep)
+        return version
+
+    def load_from_disk(self, persist_path: Path) -> Dict[str, FAISS]:
+        """Load every shard of a snapshot directory, or of the active snapshot when given the index root.
+
+        Snapshots from before sharding (a single `index.faiss`) load as the default collection.
+        """
+        snapshot = resolve_snapshot(persist_path)
+        self._check_manifest(snapshot)
+        shard_dirs = {DEFAULT_COLLECTION: snapshot}
+        if (snapshot / SHARDS_DIR).is_dir():
+            shard_dirs = {path.name: path for path in sorted((snapshot / SHARDS_DIR).iterdir()) if path.is_dir()}
+        shards = {
+            name: FAISS.load_local(str(path), embeddings=self._embeddings, allow_dangerous_deserialization=True)
+            for name, path in shard_dirs.items()
+        }
+        for store in shards.values():
+            if isinstance(store.docstore, InMemoryDocstore):
+                # Snapshot build trước khi có CompactDocstore
+                store.docstore = CompactDocstore.from_docstore(store.docstore)
+        return shards
+
+    def _check_manifest(self, snapshot: Path) -> None:
+        """Refuse snapshots whose vectors cannot be compared with this process's query embeddings."""
+        manifest_path = snapshot / MANIFEST_FILE
+        if not manifest_path.exists():
+            return
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        built_model = manifest.get("embedding_model")
+        if built_model and built_model != self.settings.embedding_model:
+            raise ValueError(
+                f"Snapshot {snapshot.name} was embedded with {built_model}, "
+                f"but OPENAI_EMBEDDING_MODEL is {self.settings.embedding_model}"
+            )
+        built_dimensions = manifest.get("embedding_dimensions")
+        wanted = self.settings.embedding_dimensions
+        if built_dimensions and wanted and built_dimensions != wanted:
+            raise ValueError(
+                f"Snapshot {snapshot.name} has {built_dimensions}-dim vectors, but EMBEDDING_DIMENSIONS is {wanted}"
+            )
+        if built_dimensions and not wanted:
+            # Không đặt EMBEDDING_DIMENSIONS: so với số chiều mặc định của model (model lạ thì embed thử một câu)
+            default = _DEFAULT_DIMENSIONS.get(self.settings.embedding_model)
+            if default is None:
+                default = len(self._embeddings.embed_query("dimension probe"))
+            if built_dimensions != default:
+                raise ValueError(
+                    f"Snapshot {snapshot.name} has {built_dimensions}-dim vectors, but "
+                    f"{self.settings.embedding_model} returns {default}-dim embeddings (EMBEDDING_DIMENSIONS is unset)"
+                )
+        # Kiểu lưu nằm trong chính file index nên chỉ cảnh báo, vẫn nạp được
+        built_storage = manifest.get("vector_storage", "float32")
+        if built_storage != self.settings.vector_storage:
+            logger.warning(
+                "index_storage_mismatch",
+                extra={
+                    "fields": {
+                        "snapshot": snapshot.name,
+                        "stored": built_storage,
+                        "configured": self.settings.vector_storage,
+                    }
+                },
+            )
+
+
+def group_by_collection(chunks: Iterable[Document]) -> Dict[str, List[Document]]:
+    groups: Dict[str, List[Document]] = {}
+    for chunk in chunks:
+        name = normalize_collection(chunk.metadata.get("collection"))
+        chunk.metadata["collection"] = name
+        groups.setdefault(name, []).append(chunk)
+    return groups
+
+
+def _has_index(path: Path) -> bool:
+    return (path / "index.faiss").exists() or (path / SHARDS_DIR).is_dir()
+
+
+def current_version(root: Path) -> Optional[str]:
+    pointer = root / CURRENT_FILE
+    if not pointer.exists():
+        return None
+    return pointer.read_text(encoding="utf-8").strip() or None
+
+
+def list_snapshots(root: Path) -> List[str]:
+    snapshots = root / SNAPSHOTS_DIR
+    if not snapshots.exists():
+        return []
+    return sorted(path.name for path in snapshots.iterdir() if _VERSION_PATTERN.fullmatch(path.name))
+
+
+def resolve_snapshot(root: Path, version: Optional[str] = None) -> Path:
+    """Map an index root (plus optional version) to the snapshot directory holding the shards.
+
+    A snapshot directory itself resolves to itself, and the legacy layout where
+    `index.faiss` sits directly in `root` is still accepted.
+    """
+    if version is not None:
+        if not _VERSION_PATTERN.fullmatch(version):
+            raise ValueError(f"Invalid index snapshot version: {version}")
+    else:
+        version = current_version(root)
+    if version is None:
+        if _has_index(root):
+            return root
+        raise FileNotFoundError(f"No FAISS index found under {root}")
+    path = root / SNAPSHOTS_DIR / version
+    if not _has_index(path):
+        raise FileNotFoundError(f"Index snapshot not found: {path}")
+    return path
+
+
+def activate_snapshot(root: Path, version: str) -> None:
+    resolve_snapshot(root, version)
+    staging = root / f".{CURRENT_FILE}.tmp"
+    staging.write_text(version, encoding="utf-8")
+    os.replace(staging, root / CURRENT_FILE)
 
 
-def get_retriever(vector_store: FAISS, k: int = 4) -> BaseRetriever:
-    return vector_store.as_retriever(search_kwargs={"k": k})
+def prune_snapshots(root: Path, keep: int) -> None:
+    """Delete old snapshots (and abandoned staging dirs), never the active one."""
+    snapshots = root / SNAPSHOTS_DIR
+    # Staging dir còn mới có thể thuộc một lần build khác đang chạy
+    stale_before = time.time() - 3600
+    for staging in snapshots.glob(".tmp-*"):
+        if staging.stat().st_mtime < stale_before:
+            shutil.rmtree(staging, ignore_errors=True)
+    active = current_version(root)
+    versions = list_snapshots(root)
+    for version in versions[: max(len(versions) - keep, 0)]:
+        if version != active:
+            shutil.rmtree(snapshots / version, ignore_errors=True)
 
 
+def get_retriever(
+    shards: Dict[str, FAISS] | FAISS, k: int = 4, settings: Optional[Settings] = None
+) -> ShardedRetriever:
+    if isinstance(shards, FAISS):
+        shards = {DEFAULT_COLLECTION: shards}
+    if settings is None:
+        return ShardedRetriever(shards=shards, k=k, packing=False)
+    return ShardedRetriever(
+        shards=shards,
+        k=k,
+        fetch_k=settings.retriever_fetch_k,
+        packing=settings.context_packing,
+        lambda_mult=settings.mmr_lambda,
+        duplicate_threshold=settings.dedup_threshold,
+        token_budget=settings.context_token_budget,
+    )
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import pytest
+
+from mock_project import condense
+from mock_project.chatbot import CustomerSupportChatbot
+from mock_project.config import Settings
+from mock_project.fakes import FakeChatModel, FakeEmbeddings, echo_follow_up
+from mock_project.observability import CONDENSE
+from mock_project.scheduler import FairScheduler
+
+
+def _settings_for(tmp_path: Path) -> Settings:
+    docs_path = tmp_path / "docs"
+    docs_path.mkdir()
+    (docs_path / "faq.txt").write_text(
+        "Hotline hỗ trợ khách hàng Premium: 1900-123-456.\n\nĐổi trả trong 30 ngày cho mọi sản phẩm.",
+        encoding="utf-8",
+    )
+    return Settings(
+        openai_api_key="sk-test",
+        chat_model="gpt-test",
+        embedding_model="text-embedding-test",
+        docs_path=docs_path,
+        persist_index_path=tmp_path / "faiss",
+        parse_cache_path=tmp_path / "parse_cache",
+        chunk_size=200,
+        chunk_overlap=50,
+    )
+
+
+@pytest.fixture()
+def offline_bot(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> CustomerSupportChatbot:
+    monkeypatch.chdir(tmp_path)
+
+    def llm_factory(*, streaming: bool = False, callbacks: Optional[list] = None) -> FakeChatModel:
+        return FakeChatModel(response_tokens=8, streaming=streaming, callbacks=callbacks or [])
+
+    return CustomerSupportChatbot(settings=_settings_for(tmp_path), llm_factory=llm_factory, embeddings=FakeEmbeddings())
+
+
+def test_ask_uses_injected_models(offline_bot: CustomerSupportChatbot) -> None:
+    answer = offline_bot.ask("Hotline Premium là gì?", session_id="offline")
+
+    assert len(answer.split()) == 8
+    assert offline_bot.settings.persist_index_path.exists()
+
+
+def test_astream_yields_tokens_from_answer_llm(offline_bot: CustomerSupportChatbot) -> None:
+    async def collect() -> list[str]:
+        return [token async for token in offline_bot.astream("Chính sách đổi trả?", session_id="stream")]
+
+    tokens = asyncio.run(collect())
+
+    assert len(tokens) == 8
+
+
+def test_aask_queues_on_the_event_loop_without_holding_threads(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+
+    def llm_factory(*, streaming: bool = False, callbacks: Optional[list] = None) -> FakeChatModel:
+        return FakeChatModel(response_tokens=8, latency=0.05, streaming=streaming, callbacks=callbacks or [])
+
+    bot = CustomerSupportChatbot(settings=_settings_for(tmp_path), llm_factory=llm_factory, embeddings=FakeEmbeddings())
+    bot.ask("Hotline Premium là gì?", session_id="warm-up")
+    bot.scheduler = FairScheduler(concurrency=1, queue_timeout=10)
+
+    async def burst() -> tuple:
+        # Hai thread cho cả request: request chờ slot mà giữ thread thì hàng đợi không thể lên 7
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=2))
+        tasks = [asyncio.create_task(bot.aask(f"Đổi trả đơn số {n}?", session_id=f"s{n}")) for n in range(8)]
+        queued = 0
+        for _ in range(400):
+            queued = max(queued, len(bot.scheduler._queue))
+            if queued == 7:
+                break
+            await asyncio.sleep(0.005)
+        return await asyncio.gather(*tasks), queued
+
+    answers, queued = asyncio.run(burst())
+
+    assert queued == 7
+    assert all(len(answer.split()) == 8 for answer in answers)
+
+
+@pytest.mark.parametrize(("reply", "outcome"), [(echo_follow_up, "speculative_hit"), (None, "speculative_miss")])
+def test_follow_up_uses_speculative_retrieval(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, reply, outcome: str
+) -> None:
+    monkeypatch.chdir(tmp_path)
+    settings = _settings_for(tmp_path)
+    settings.condense_model = "gpt-fast"
+    settings.speculative_retrieval = True
+    models = []
+
+    def llm_factory(*, streaming: bool = False, callbacks: Optional[list] = None, model: Optional[str] = None):
+        models.append(model)
+        return FakeChatModel(
+            response_tokens=8, streaming=streaming, callbacks=callbacks or [], reply=reply if model else None
+        )
+
+    bot = CustomerSupportChatbot(settings=settings, llm_factory=llm_factory, embeddings=FakeEmbeddings())
+    bot.ask("Hotline Premium là gì?", session_id="follow-up")
+    first_turns, before = CONDENSE.value(outcome="first_turn"), CONDENSE.value(outcome=outcome)
+
+    answer = bot.ask("Còn chính sách đổi trả thì sao?", session_id="follow-up")
+
+    assert len(answer.split()) == 8
+    assert "gpt-fast" in models
+    assert CONDENSE.value(outcome="first_turn") == first_turns
+    assert CONDENSE.value(outcome=outcome) == before + 1
+
+
+def test_failed_condense_cancels_the_pending_speculative_retrieval(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.chdir(tmp_path)
+    settings = _settings_for(tmp_path)
+    settings.condense_model = "gpt-fast"
+    settings.speculative_retrieval = True
+    settings.speculative_pool_size = 1
+
+    def broken(prompt: str) -> str:
+        raise RuntimeError("condense model unavailable")
+
+    def llm_factory(*, streaming: bool = False, callbacks: Optional[list] = None, model: Optional[str] = None):
+        return FakeChatModel(
+            response_tokens=8, streaming=streaming, callbacks=callbacks or [], reply=broken if model else None
+        )
+
+    bot = CustomerSupportChatbot(settings=settings, llm_factory=llm_factory, embeddings=FakeEmbeddings())
+    bot.ask("Hotline Premium là gì?", session_id="follow-up")
+    retrieved = []
+    get_docs = condense.SpeculativeRetrievalChain._get_docs
+
+    def counting_get_docs(self, question, inputs, **kwargs):
+        retrieved.append(question)
+        return get_docs(self, question, inputs, **kwargs)
+
+    monkeypatch.setattr(condense.SpeculativeRetrievalChain, "_get_docs", counting_get_docs)
+    # Worker duy nhất đang bận: retrieval dự phòng phải nằm chờ trong hàng đợi của pool
+    release = threading.Event()
+    blocker = condense._speculation_pool().submit(release.wait)
+
+    answer = bot.ask("Còn chính sách đổi trả thì sao?", session_id="follow-up")
+    release.set()
+    blocker.result()
+    condense._speculation_pool().submit(lambda: None).result()
+
+    assert answer.startswith("Xin lỗi, đã xảy ra lỗi")
+    assert retrieved == []
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+from langchain_core.documents import Document
+
+from mock_project.dedup import deduplicate_chunks, normalize_text
+
+FAQ = (
+    "Đổi trả 30 ngày cho mọi sản phẩm (điều kiện: chưa kích hoạt vĩnh viễn hoặc phần cứng không hư hại). "
+    "Sandbox miễn phí 60 ngày để thử tính năng mới. Thông báo nâng cấp phần mềm trước 14 ngày, hỗ trợ rollback khi cần."
+)
+
+
+def test_ascii_pdf_copy_is_an_exact_duplicate_of_docx() -> None:
+    ascii_copy = normalize_text(FAQ)
+
+    chunks = [
+        Document(page_content=ascii_copy, metadata={"source": "faq.pdf"}),
+        Document(page_content=FAQ, metadata={"source": "faq.docx"}),
+    ]
+    kept, report = deduplicate_chunks(chunks)
+
+    assert [chunk.metadata["source"] for chunk in kept] == ["faq.docx"]
+    assert kept[0].metadata["alternate_sources"] == ["faq.pdf"]
+    assert report.exact_duplicates == 1 and report.kept == 1
+
+
+def test_shifted_chunk_boundaries_are_near_duplicates() -> None:
+    chunks = [
+        Document(page_content=FAQ, metadata={"source": "faq.docx", "start_index": 0}),
+        Document(page_content=FAQ[12:] + " Liên hệ", metadata={"source": "faq.pdf", "start_index": 10}),
+        Document(page_content="Hotline: 1900-123-456 (nhánh 2 cho Premium).", metadata={"source": "faq.docx"}),
+    ]
+
+    kept, report = deduplicate_chunks(chunks)
+
+    assert len(kept) == 2
+    assert report.near_duplicates == 1
+    assert report.chars_removed == len(chunks[1].page_content)
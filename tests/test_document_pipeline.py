@@ -1,11 +1,14 @@
 from __future__ import annotations
 
+import time
+from dataclasses import replace
 from pathlib import Path
 
 import pytest
 from docx import Document as WordDocument
 from fpdf import FPDF
 
+from mock_project import document_loader
 from mock_project.config import Settings
 from mock_project.document_loader import load_documents, split_documents
 
@@ -31,6 +34,7 @@ def _settings_for(tmp_path: Path) -> Settings:
         chat_model="gpt-test",
         embedding_model="text-embedding-test",
         docs_path=tmp_path,
+        parse_cache_path=tmp_path / ".parse_cache",
         chunk_size=200,
         chunk_overlap=50,
     )
@@ -59,3 +63,72 @@ def test_split_documents_creates_chunks(populated_docs: Settings) -> None:
     assert all("Sản phẩm" in chunk.page_content or "Gói dịch vụ" in chunk.page_content for chunk in chunks)
 
 
+def test_registry_loads_markdown_html_csv_and_skips_unknown_types(tmp_path: Path) -> None:
+    (tmp_path / "guide.md").write_text("# Hướng dẫn\n\nĐổi trả trong 30 ngày.", encoding="utf-8")
+    (tmp_path / "page.html").write_text(
+        "<html><head><title>SLA</title><script>var x = 1;</script></head>"
+        "<body><h1>SLA Premium</h1><p>Phản hồi trong 2&nbsp;giờ.</p></body></html>",
+        encoding="utf-8",
+    )
+    (tmp_path / "plans.csv").write_text("plan,price\nGrowth,49\nPremium,99\n", encoding="utf-8")
+    (tmp_path / "logo.png").write_bytes(b"\x89PNG")
+    (tmp_path / ".DS_Store").write_bytes(b"\x00")
+
+    documents = load_documents(_settings_for(tmp_path))
+    by_suffix = {}
+    for document in documents:
+        by_suffix.setdefault(Path(document.metadata["source"]).suffix, []).append(document)
+
+    assert set(by_suffix) == {".md", ".html", ".csv"}
+    html = by_suffix[".html"][0]
+    assert html.page_content == "SLA Premium\nPhản hồi trong 2 giờ."
+    assert html.metadata["title"] == "SLA"
+    assert [doc.page_content for doc in by_suffix[".csv"]] == ["plan: Growth\nprice: 49", "plan: Premium\nprice: 99"]
+
+
+def test_parse_cache_skips_extraction_when_only_chunking_changes(tmp_path: Path, monkeypatch) -> None:
+    docs_path = tmp_path / "docs"
+    (docs_path / "billing").mkdir(parents=True)
+    note = docs_path / "billing" / "refunds.note"
+    note.write_text("Hoàn tiền trong 7 ngày làm việc.", encoding="utf-8")
+    parsed = []
+
+    def parse_note(path: str):
+        parsed.append(path)
+        return document_loader._load_text(path)
+
+    monkeypatch.setitem(document_loader._LOADERS, ".note", parse_note)
+    settings = replace(_settings_for(docs_path), parse_cache_path=tmp_path / "parse_cache")
+
+    first = load_documents(settings)
+    again = load_documents(replace(settings, chunk_size=50, chunk_overlap=10))
+    assert len(parsed) == 1
+    assert [doc.page_content for doc in again] == [doc.page_content for doc in first]
+    assert again[0].metadata == {"source": str(note), "collection": "billing"}
+
+    note.write_text("Hoàn tiền trong 5 ngày làm việc.", encoding="utf-8")
+    assert "5 ngày" in load_documents(settings)[0].page_content
+    assert len(parsed) == 2
+    # Bản cache của nội dung cũ bị dọn
+    assert len(list((tmp_path / "parse_cache").glob("*.json"))) == 1
+
+
+def test_duplicate_files_share_one_parse_cache_entry(tmp_path: Path, monkeypatch) -> None:
+    docs_path = tmp_path / "docs"
+    docs_path.mkdir()
+    for number in range(8):
+        (docs_path / f"copy-{number}.note").write_text("Hotline Premium: 1900-123-456.", encoding="utf-8")
+
+    def parse_note(path: str):
+        # Giữ các worker chạy đồng thời để các lần ghi cache cùng key chồng lên nhau
+        time.sleep(0.05)
+        return document_loader._load_text(path)
+
+    monkeypatch.setitem(document_loader._LOADERS, ".note", parse_note)
+    settings = replace(_settings_for(docs_path), parse_cache_path=tmp_path / "parse_cache", ingest_workers=8)
+
+    documents = load_documents(settings)
+
+    assert len(documents) == 8
+    assert {Path(doc.metadata["source"]).name for doc in documents} == {f"copy-{n}.note" for n in range(8)}
+    assert [path.suffix for path in (tmp_path / "parse_cache").iterdir()] == [".json"]
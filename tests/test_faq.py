@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from pathlib import Path
+from typing import Optional
+
+from mock_project.chatbot import CustomerSupportChatbot
+from mock_project.config import Settings
+from mock_project.faq import FaqIndex
+from mock_project.fakes import FakeChatModel, FakeEmbeddings
+from mock_project.observability import CACHE_REQUESTS
+
+ENTRIES = [
+    {"id": "greeting", "questions": ["Xin chào", "Chào bạn"], "answer": "Xin chào! Bạn cần hỗ trợ gì?"},
+    {
+        "id": "hotline",
+        "questions": ["Hotline hỗ trợ là gì?", "Số điện thoại hỗ trợ?"],
+        "answer": "Hotline: 1900-123-456 (nhánh 2 cho Premium)",
+    },
+    {"id": "returns", "questions": ["Chính sách đổi trả thế nào?"], "answer": "Đổi trả 30 ngày cho mọi sản phẩm."},
+]
+
+
+def test_paraphrases_match_and_unrelated_questions_fall_through() -> None:
+    index = FaqIndex(ENTRIES)
+
+    assert index.match("xin chao").entry_id == "greeting"
+    assert index.match("hotline ho tro la gi").answer.startswith("Hotline: 1900-123-456")
+    assert index.match("Chính sách đổi trả?").entry_id == "returns"
+    assert index.match("Làm sao nâng cấp từ gói Growth lên Premium?") is None
+    # Câu dài chỉ nhắc tới hotline vẫn phải qua RAG
+    assert index.match("Tôi gọi hotline mãi không được, ticket của tôi quá hạn rồi thì xử lý sao?") is None
+    assert index.match("???") is None
+
+
+def test_faq_hits_skip_the_llm_and_are_recorded(tmp_path: Path, monkeypatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    docs_path = tmp_path / "docs"
+    docs_path.mkdir()
+    (docs_path / "faq.txt").write_text("Hotline hỗ trợ khách hàng Premium: 1900-123-456.", encoding="utf-8")
+    faq_path = tmp_path / "faq.json"
+    faq_path.write_text(json.dumps(ENTRIES, ensure_ascii=False), encoding="utf-8")
+    settings = Settings(
+        openai_api_key="sk-test",
+        chat_model="gpt-test",
+        embedding_model="text-embedding-test",
+        docs_path=docs_path,
+        persist_index_path=tmp_path / "faiss",
+        parse_cache_path=tmp_path / "parse_cache",
+        chat_history_path=tmp_path / "chat_history",
+        faq_path=faq_path,
+    )
+    calls = []
+
+    def llm_factory(*, streaming: bool = False, callbacks: Optional[list] = None) -> FakeChatModel:
+        calls.append(streaming)
+        return FakeChatModel(response_tokens=8, streaming=streaming, callbacks=callbacks or [])
+
+    bot = CustomerSupportChatbot(settings=settings, llm_factory=llm_factory, embeddings=FakeEmbeddings())
+    hits = CACHE_REQUESTS.value(cache="faq", result="hit")
+
+    assert bot.ask("Hotline hỗ trợ là gì?", session_id="faq") == ENTRIES[1]["answer"]
+
+    async def collect() -> list:
+        return [token async for token in bot.astream("xin chao", session_id="faq")]
+
+    assert asyncio.run(collect()) == [ENTRIES[0]["answer"]]
+    assert calls == []
+    assert CACHE_REQUESTS.value(cache="faq", result="hit") == hits + 2
+    assert [message.content for message in bot.history.messages("faq")][:2] == [
+        "Hotline hỗ trợ là gì?",
+        ENTRIES[1]["answer"],
+    ]
+
+    assert len(bot.ask("Gói Premium có những tính năng gì?", session_id="rag").split()) == 8
+    assert calls
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from mock_project.history import HistoryStore
+
+
+def _age(path: Path, days: float) -> None:
+    stamp = time.time() - days * 86400
+    os.utime(path, (stamp, stamp))
+
+
+def test_compaction_archives_idle_sessions_and_keeps_them_readable(tmp_path: Path) -> None:
+    store = HistoryStore(tmp_path / "chat_history")
+    for session_id in ("idle", "active"):
+        history = store.chat_history(session_id)
+        history.add_user_message(f"Hotline Premium cho phiên {session_id}?")
+        history.add_ai_message("1900-123-456")
+    store.save_metadata("idle", {"custom_title": "Hỏi hotline"})
+    store.save_metadata("deleted-long-ago", {"custom_title": None})
+    _age(store.session_path("idle"), 45)
+
+    report = store.compact(30 * 86400)
+
+    assert report.archived_sessions == 1
+    assert report.orphaned_meta_removed == 1
+    assert report.files_removed == 3
+    assert report.bytes_removed > 0 and report.segment
+    assert sorted(path.name for path in store.root.glob("*.json")) == ["active.json"]
+    assert [message.content for message in store.messages("idle")][-1] == "1900-123-456"
+    sessions = {session["id"]: session for session in store.summaries()}
+    assert sessions["idle"]["archived"] and sessions["idle"]["title"] == "Hỏi hotline"
+    assert sessions["idle"]["message_count"] == 2
+    assert store.messages("unknown") == [] and not store.session_path("unknown").exists()
+
+
+def test_writing_to_an_archived_session_restores_it(tmp_path: Path) -> None:
+    store = HistoryStore(tmp_path / "chat_history")
+    store.chat_history("old").add_user_message("Chính sách đổi trả?")
+    _age(store.session_path("old"), 90)
+    segment = store.compact(30 * 86400).segment
+
+    store.chat_history("old").add_ai_message("Đổi trả trong 30 ngày.")
+
+    assert len(store.messages("old")) == 2
+    assert not store.summaries()[0]["archived"]
+    # Segment không còn được tham chiếu sẽ bị xóa ở lần compact sau
+    report = store.compact(30 * 86400)
+    assert report.segments_removed == 1
+    assert not (store.archive_dir / segment).exists()
+
+
+def test_compaction_without_idle_sessions_writes_no_segment(tmp_path: Path, monkeypatch) -> None:
+    store = HistoryStore(tmp_path / "chat_history")
+    store.chat_history("active").add_user_message("Hotline Premium?")
+
+    report = store.compact(30 * 86400)
+
+    assert report.segment is None and report.bytes_written == 0
+    assert not list(store.archive_dir.glob("segment-*"))
+    assert [session["id"] for session in store.summaries()] == ["active"]
+
+    # Phiên idle nhận tin nhắn mới trong lúc đang ghi segment
+    _age(store.session_path("active"), 45)
+    write_segment = store._write_segment
+
+    def racing_write(records):
+        segment = write_segment(records)
+        store.chat_history("active").add_ai_message("1900-123-456")
+        return segment
+
+    monkeypatch.setattr(store, "_write_segment", racing_write)
+    report = store.compact(30 * 86400)
+
+    assert report.segment is None and report.archived_sessions == 0
+    assert not list(store.archive_dir.glob("segment-*"))
+    assert len(store.messages("active")) == 2
+
+
+def test_interrupted_compaction_loses_no_session(tmp_path: Path, monkeypatch) -> None:
+    store = HistoryStore(tmp_path / "chat_history")
+    for session_id in ("a", "b", "gone"):
+        store.chat_history(session_id).add_user_message(f"Câu hỏi của phiên {session_id}")
+        _age(store.session_path(session_id), 45)
+    write_segment = store._write_segment
+
+    def deleting_write(records):
+        segment = write_segment(records)
+        # Người dùng xóa phiên trong lúc đang archive
+        store.session_path("gone").unlink()
+        return segment
+
+    unlink = Path.unlink
+
+    def crashing_unlink(self: Path, *args, **kwargs) -> None:
+        if self.name == "b.json":
+            raise OSError("disk error")
+        unlink(self, *args, **kwargs)
+
+    monkeypatch.setattr(store, "_write_segment", deleting_write)
+    monkeypatch.setattr(Path, "unlink", crashing_unlink)
+    with pytest.raises(OSError):
+        store.compact(30 * 86400)
+    monkeypatch.undo()
+
+    # Index đã lưu trước khi xóa file live: cả hai phiên vẫn đọc được
+    assert [message.content for message in store.messages("a")] == ["Câu hỏi của phiên a"]
+    assert [message.content for message in store.messages("b")] == ["Câu hỏi của phiên b"]
+    assert store.messages("gone") == []
+    report = store.compact(30 * 86400)
+    assert report.archived_sessions == 1 and not store.session_path("b").exists()
+    assert sorted(session["id"] for session in store.summaries()) == ["a", "b"]
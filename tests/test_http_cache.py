@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from fastapi import FastAPI, Request, Response
+from fastapi.testclient import TestClient
+
+from mock_project.history import HistoryStore
+from mock_project.http_cache import IMMUTABLE_CACHE_CONTROL, CachedStaticFiles, conditional_json, make_etag
+
+
+def test_session_listing_revalidates_until_history_changes(tmp_path: Path) -> None:
+    store = HistoryStore(tmp_path / "chat_history")
+    store.create("s1")
+    app = FastAPI()
+    builds = []
+
+    @app.get("/sessions")
+    def sessions(request: Request) -> Response:
+        parts, last_modified = store.listing_version()
+        return conditional_json(
+            request, make_etag(parts), last_modified, lambda: builds.append(1) or {"sessions": store.summaries()}
+        )
+
+    client = TestClient(app)
+    first = client.get("/sessions")
+    etag = first.headers["etag"]
+
+    assert client.get("/sessions", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/sessions", headers={"If-Modified-Since": first.headers["last-modified"]}).status_code == 304
+    assert len(builds) == 1
+
+    store.chat_history("s1").add_user_message("Hotline Premium?")
+    changed = client.get("/sessions", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.json()["sessions"][0]["title"] == "Hotline Premium?"
+
+
+def test_hashed_assets_are_immutable_and_index_revalidates(tmp_path: Path) -> None:
+    (tmp_path / "assets").mkdir()
+    (tmp_path / "assets" / "index-3f9a1c.js").write_text("console.log(1)", encoding="utf-8")
+    (tmp_path / "index.html").write_text("<html></html>", encoding="utf-8")
+    app = FastAPI()
+    app.mount("/", CachedStaticFiles(directory=str(tmp_path), html=True), name="frontend")
+    client = TestClient(app)
+
+    asset = client.get("/assets/index-3f9a1c.js")
+    assert asset.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+    assert client.get("/").headers["cache-control"] == "no-cache"
+    revalidated = client.get("/assets/index-3f9a1c.js", headers={"If-None-Match": asset.headers["etag"]})
+    assert revalidated.status_code == 304
+    assert revalidated.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
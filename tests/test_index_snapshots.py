@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from mock_project.chatbot import CustomerSupportChatbot
+from mock_project.config import Settings
+from mock_project.docstore import CompactDocstore
+from mock_project.fakes import FakeEmbeddings
+from mock_project.vectorstore import (
+    VectorStoreBuilder,
+    activate_snapshot,
+    current_version,
+    list_snapshots,
+    resolve_snapshot,
+)
+
+
+def _settings_for(tmp_path: Path) -> Settings:
+    docs_path = tmp_path / "docs"
+    docs_path.mkdir()
+    (docs_path / "faq.txt").write_text("Hotline Premium: 1900-123-456.", encoding="utf-8")
+    return Settings(
+        openai_api_key="sk-test",
+        chat_model="gpt-test",
+        embedding_model="text-embedding-test",
+        docs_path=docs_path,
+        persist_index_path=tmp_path / "faiss",
+        parse_cache_path=tmp_path / "parse_cache",
+        index_snapshots_keep=2,
+    )
+
+
+def test_snapshots_are_versioned_activated_and_pruned(tmp_path: Path) -> None:
+    settings = _settings_for(tmp_path)
+    builder = VectorStoreBuilder(settings, embeddings=FakeEmbeddings())
+    root = settings.persist_index_path
+
+    for text in ("một", "hai", "ba"):
+        builder.build([Document(page_content=text)], persist_path=root)
+
+    versions = list_snapshots(root)
+    assert len(versions) == 2
+    assert current_version(root) == versions[-1]
+    assert resolve_snapshot(root) == root / "snapshots" / versions[-1]
+    assert builder.load_from_disk(root)["default"].similarity_search("ba", k=1)[0].page_content == "ba"
+
+    activate_snapshot(root, versions[0])
+    assert current_version(root) == versions[0]
+    with pytest.raises(FileNotFoundError):
+        activate_snapshot(root, "20000101T000000000000Z")
+    with pytest.raises(ValueError, match="empty snapshot"):
+        builder.build([], persist_path=root)
+    assert list_snapshots(root) == versions and not list((root / "snapshots").glob(".tmp-*"))
+
+
+def test_build_index_reports_the_snapshot_it_wrote(tmp_path: Path) -> None:
+    settings = _settings_for(tmp_path)
+    bot = CustomerSupportChatbot(settings=settings, embeddings=FakeEmbeddings())
+    bot.build_index()
+    active = bot.last_built_version
+
+    bot.build_index(activate=False)
+
+    assert bot.last_built_version != active
+    assert list_snapshots(settings.persist_index_path) == sorted([active, bot.last_built_version])
+    assert current_version(settings.persist_index_path) == active == bot.index_version
+
+
+def test_legacy_layout_still_loads(tmp_path: Path) -> None:
+    settings = _settings_for(tmp_path)
+    builder = VectorStoreBuilder(settings, embeddings=FakeEmbeddings())
+    shards = builder.build([Document(page_content="cũ")])
+    shards["default"].save_local(str(settings.persist_index_path))
+
+    assert resolve_snapshot(settings.persist_index_path) == settings.persist_index_path
+    assert list(builder.load_from_disk(settings.persist_index_path)) == ["default"]
+
+
+def test_chunks_are_stored_compactly_and_legacy_docstores_are_converted(tmp_path: Path) -> None:
+    settings = _settings_for(tmp_path)
+    builder = VectorStoreBuilder(settings, embeddings=FakeEmbeddings())
+    chunks = [
+        Document(page_content=f"Đổi trả mục {index}", metadata={"source": "faq.pdf", "start_index": index * 20})
+        for index in range(5)
+    ]
+    legacy = FAISS.from_documents(chunks, FakeEmbeddings())
+    legacy.save_local(str(settings.persist_index_path))
+
+    store = builder.load_from_disk(settings.persist_index_path)["default"]
+    docstore = store.docstore
+
+    assert isinstance(docstore, CompactDocstore)
+    assert len(docstore._metas) == 1  # cùng source: một dict metadata dùng chung
+    hit = store.similarity_search("Đổi trả mục 3", k=1)[0]
+    assert hit.page_content == "Đổi trả mục 3"
+    assert hit.metadata == {"source": "faq.pdf", "start_index": 60}
+    assert isinstance(builder.build(chunks)["default"].docstore, CompactDocstore)
+
+
+def test_subfolders_become_collection_shards(tmp_path: Path) -> None:
+    settings = _settings_for(tmp_path)
+    (settings.docs_path / "billing").mkdir()
+    (settings.docs_path / "billing" / "invoices.txt").write_text("Hóa đơn xuất ngày 5 hằng tháng.", encoding="utf-8")
+    bot = CustomerSupportChatbot(settings=settings, llm_factory=lambda **_: None, embeddings=FakeEmbeddings())
+    bot.init_index()
+
+    assert bot.collections == {"billing": 1, "default": 1}
+    assert sorted(path.name for path in (resolve_snapshot(settings.persist_index_path) / "shards").iterdir()) == [
+        "billing",
+        "default",
+    ]
+    documents = bot._retriever.scoped(["billing"]).invoke("hóa đơn")
+    assert [document.metadata["collection"] for document in documents] == ["billing"]
+
+
+def test_reload_index_swaps_retriever(tmp_path: Path) -> None:
+    settings = _settings_for(tmp_path)
+    bot = CustomerSupportChatbot(settings=settings, llm_factory=lambda **_: None, embeddings=FakeEmbeddings())
+    bot.init_index()
+    first_version, first_retriever = bot.index_version, bot._retriever
+
+    bot.build_index(activate=True)
+    loaded = bot.reload_index()
+
+    assert loaded == current_version(settings.persist_index_path) != first_version
+    assert bot._retriever is not first_retriever
+
+
+def test_quantized_storage_is_recorded_and_checked(tmp_path: Path) -> None:
+    settings = _settings_for(tmp_path)
+    settings.vector_storage = "int8"
+    settings.embedding_dimensions = 64
+    builder = VectorStoreBuilder(settings, embeddings=FakeEmbeddings(size=64))
+    root = settings.persist_index_path
+    texts = [f"gói {name} hỗ trợ {i}" for i, name in enumerate(("basic", "growth", "premium", "enterprise"))]
+    builder.build([Document(page_content=text) for text in texts], persist_path=root)
+
+    manifest = json.loads((resolve_snapshot(root) / "manifest.json").read_text(encoding="utf-8"))
+    store = builder.load_from_disk(root)["default"]
+    assert (manifest["vector_storage"], manifest["embedding_dimensions"]) == ("int8", 64)
+    assert type(store.index).__name__ == "IndexScalarQuantizer"
+    assert store.similarity_search("gói premium hỗ trợ 2", k=1)[0].page_content == texts[2]
+
+    settings.embedding_dimensions = 128
+    with pytest.raises(ValueError, match="EMBEDDING_DIMENSIONS"):
+        builder.load_from_disk(root)
+    # Không đặt EMBEDDING_DIMENSIONS: so với số chiều thật của query embedding
+    settings.embedding_dimensions = None
+    with pytest.raises(ValueError, match="256-dim embeddings"):
+        VectorStoreBuilder(settings, embeddings=FakeEmbeddings()).load_from_disk(root)
+    assert list(VectorStoreBuilder(settings, embeddings=FakeEmbeddings(size=64)).load_from_disk(root)) == ["default"]
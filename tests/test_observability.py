@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import pytest
+
+from mock_project.observability import Counter, Histogram, Registry, track
+import mock_project.observability as observability
+
+
+@pytest.fixture()
+def registry(monkeypatch: pytest.MonkeyPatch) -> Registry:
+    fresh = Registry()
+    monkeypatch.setattr(observability, "REGISTRY", fresh)
+    return fresh
+
+
+def test_histogram_renders_cumulative_buckets(registry: Registry) -> None:
+    histogram = Histogram("demo_seconds", "Demo.", ["stage"], buckets=(0.1, 1.0))
+    histogram.observe(0.05, stage="embed")
+    histogram.observe(0.5, stage="embed")
+    histogram.observe(5.0, stage="embed")
+
+    text = registry.render()
+
+    assert 'demo_seconds_bucket{stage="embed",le="0.1"} 1' in text
+    assert 'demo_seconds_bucket{stage="embed",le="1"} 2' in text
+    assert 'demo_seconds_bucket{stage="embed",le="+Inf"} 3' in text
+    assert 'demo_seconds_count{stage="embed"} 3' in text
+
+
+def test_counter_escapes_label_values(registry: Registry) -> None:
+    counter = Counter("demo_total", "Demo.", ["name"])
+    counter.inc(name='say "hi"')
+
+    assert 'demo_total{name="say \\"hi\\""} 1' in registry.render()
+
+
+def test_track_records_stages_and_errors() -> None:
+    with pytest.raises(RuntimeError):
+        with track("unit", sample_rate=0.0) as trace:
+            with trace.stage("retrieve"):
+                pass
+            trace.add("embed", 0.0)
+            raise RuntimeError("boom")
+
+    assert {"retrieve", "embed", "search"} <= set(trace.stages)
+    assert observability.REQUESTS.value(operation="unit", outcome="error") == 1
+
+
+def test_search_stage_is_derived_when_query_embedding_is_cached() -> None:
+    with track("unit-cached", sample_rate=0.0) as trace:
+        trace.add("retrieve", 0.25)
+
+    assert trace.stages["search"] == 0.25
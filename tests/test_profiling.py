@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+import time
+from pathlib import Path
+
+from mock_project.config import Settings
+from mock_project.profiling import SamplingProfiler, profiling_authorized
+
+
+def _busy_loop(seconds: float) -> None:
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        sum(range(100))
+
+
+def test_sampling_profiler_writes_folded_stacks(tmp_path: Path) -> None:
+    with SamplingProfiler(interval=0.001) as profiler:
+        _busy_loop(0.1)
+
+    artifact = profiler.write(tmp_path, "unit")
+    lines = artifact.read_text(encoding="utf-8").splitlines()
+
+    assert artifact.name.startswith("unit-") and artifact.suffix == ".folded"
+    assert any("_busy_loop" in line for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+
+def test_profiling_requires_flag_and_matching_token(tmp_path: Path) -> None:
+    settings = Settings(
+        openai_api_key="sk-test",
+        chat_model="gpt-test",
+        embedding_model="text-embedding-test",
+        docs_path=tmp_path,
+        admin_token="secret",
+    )
+
+    assert not profiling_authorized(settings, "secret")
+    settings.profiling_enabled = True
+    assert profiling_authorized(settings, "secret")
+    assert not profiling_authorized(settings, "wrong")
+    assert not profiling_authorized(settings, None)
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from pathlib import Path
+from typing import Iterator, Optional
+
+import pytest
+from langchain_openai import ChatOpenAI
+
+import mock_project.resilience as resilience
+from mock_project.chatbot import CustomerSupportChatbot
+from mock_project.config import Settings
+from mock_project.fakes import FakeChatModel, FakeEmbeddings, FakeOpenAIServer
+from mock_project.observability import CONDENSE, DEADLINE_EXCEEDED, HEDGE_WINS
+from mock_project.resilience import DeadlineBudget, DeadlineExceeded, HedgedChatModel, deadline_budget
+
+
+@pytest.fixture()
+def server() -> Iterator[FakeOpenAIServer]:
+    # Request đầu tiên chậm (tail latency), các request sau nhanh
+    with FakeOpenAIServer(latency_fn=lambda number: 1.0 if number == 1 else 0.01) as fake:
+        yield fake
+
+
+def _chat(server: FakeOpenAIServer, *, streaming: bool = False) -> ChatOpenAI:
+    return ChatOpenAI(
+        model="gpt-4o-mini", api_key="sk-test", base_url=server.base_url, streaming=streaming, max_retries=0
+    )
+
+
+def test_budget_rolls_unused_time_over_to_later_stages() -> None:
+    budget = DeadlineBudget(total=10.0, started=time.perf_counter())
+
+    assert budget.timeout_for("condense") == pytest.approx(2.5, abs=0.05)
+    assert budget.timeout_for("generate") == pytest.approx(10.0, abs=0.05)
+    assert budget.timeout_for("summarize") is None
+
+    budget.started -= 1.0  # condense xong sau 1s: retrieve được dùng phần còn lại trừ 60% của generate
+    assert budget.timeout_for("retrieve") == pytest.approx(3.0, abs=0.05)
+
+
+def test_hedged_request_beats_slow_first_attempt(server: FakeOpenAIServer) -> None:
+    model = HedgedChatModel(inner=_chat(server), stage="generate", hedge_delay=0.1)
+    wins = HEDGE_WINS.value(stage="generate", winner="hedge")
+
+    started = time.perf_counter()
+    answer = model.invoke("Hotline Premium là gì?")
+
+    assert answer.content
+    assert time.perf_counter() - started < 0.8
+    assert server.requests == 2
+    assert HEDGE_WINS.value(stage="generate", winner="hedge") == wins + 1
+
+
+def test_streaming_hedge_switches_to_first_stream_with_a_token(server: FakeOpenAIServer) -> None:
+    model = HedgedChatModel(inner=_chat(server, streaming=True), stage="generate", hedge_delay=0.1, streaming=True)
+
+    async def collect() -> list:
+        return [chunk.content async for chunk in model.astream("Chính sách đổi trả?")]
+
+    started = time.perf_counter()
+    chunks = asyncio.run(collect())
+
+    assert "".join(chunks).split()
+    assert time.perf_counter() - started < 0.8
+
+
+def test_generation_deadline_raises(server: FakeOpenAIServer) -> None:
+    model = HedgedChatModel(inner=_chat(server), stage="generate")
+    before = DEADLINE_EXCEEDED.value(stage="generate")
+
+    with deadline_budget(DeadlineBudget(total=0.2)), pytest.raises(DeadlineExceeded) as excinfo:
+        model.invoke("Hotline Premium là gì?")
+
+    assert excinfo.value.stage == "generate"
+    assert DEADLINE_EXCEEDED.value(stage="generate") == before + 1
+
+
+def test_slow_condense_falls_back_to_raw_question_within_the_request_budget(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.chdir(tmp_path)
+    docs_path = tmp_path / "docs"
+    docs_path.mkdir()
+    (docs_path / "faq.txt").write_text("Hotline Premium: 1900-123-456. Đổi trả trong 30 ngày.", encoding="utf-8")
+    settings = Settings(
+        openai_api_key="sk-test",
+        chat_model="gpt-test",
+        embedding_model="text-embedding-test",
+        docs_path=docs_path,
+        persist_index_path=tmp_path / "faiss",
+        parse_cache_path=tmp_path / "parse_cache",
+        chat_history_path=tmp_path / "chat_history",
+        condense_model="gpt-fast",
+        request_deadline=2.0,
+    )
+    timeouts = []
+    real_stage_timeout = resilience.stage_timeout
+
+    def recording_stage_timeout(stage: str) -> Optional[float]:
+        timeout = real_stage_timeout(stage)
+        timeouts.append((stage, timeout))
+        return timeout
+
+    def llm_factory(*, streaming: bool = False, callbacks: Optional[list] = None, model: Optional[str] = None):
+        # Model condense treo lâu hơn phần budget của nó (25% của 2s)
+        return FakeChatModel(
+            response_tokens=8, latency=1.5 if model else 0.0, streaming=streaming, callbacks=callbacks or []
+        )
+
+    bot = CustomerSupportChatbot(settings=settings, llm_factory=llm_factory, embeddings=FakeEmbeddings())
+    bot.ask("Hotline Premium là gì?", session_id="deadline")
+    monkeypatch.setattr(resilience, "stage_timeout", recording_stage_timeout)
+    fallbacks = CONDENSE.value(outcome="deadline")
+
+    started = time.perf_counter()
+    answer = bot.ask("Còn chính sách đổi trả thì sao?", session_id="deadline")
+
+    assert len(answer.split()) == 8
+    assert time.perf_counter() - started < 1.5
+    assert CONDENSE.value(outcome="deadline") == fallbacks + 1
+    seen = {stage: timeout for stage, timeout in timeouts if stage in resilience.STAGE_ORDER}
+    # condense được 25%; retrieve được phần còn lại trừ 60% dành cho generate; generate nhận phần dư
+    assert seen["condense"] == pytest.approx(0.5, abs=0.05)
+    assert seen["retrieve"] == pytest.approx(0.3, abs=0.05)
+    assert 1.2 <= seen["generate"] <= 1.5
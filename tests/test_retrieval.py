@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import numpy as np
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from mock_project.fakes import FakeEmbeddings
+from mock_project.retrieval import (
+    CachedQueryEmbeddings,
+    ShardedRetriever,
+    merge_adjacent,
+    mmr_select,
+    pack_to_budget,
+)
+
+
+def test_mmr_select_drops_near_duplicates_and_diversifies() -> None:
+    vectors = np.array([[1.0, 0.0, 0.0], [0.999, 0.01, 0.0], [0.9, 0.43, 0.0], [0.0, 0.0, 1.0]])
+
+    order = mmr_select(np.array([1.0, 0.0, 0.0]), vectors, k=3, lambda_mult=0.5, duplicate_threshold=0.99)
+
+    assert order[0] == 0
+    assert 1 not in order
+    assert set(order) == {0, 2, 3}
+
+
+def test_merge_adjacent_joins_overlapping_chunks_of_same_source() -> None:
+    text = "0123456789abcdefghij"
+    documents = [
+        Document(page_content=text[8:16], metadata={"source": "a.txt", "start_index": 8}),
+        Document(page_content="other", metadata={"source": "b.txt", "start_index": 0}),
+        Document(page_content=text[0:10], metadata={"source": "a.txt", "start_index": 0}),
+    ]
+
+    merged = merge_adjacent(documents)
+
+    assert [document.page_content for document in merged] == [text[0:16], "other"]
+    assert merged[0].metadata["start_index"] == 0
+
+
+def test_pack_to_budget_keeps_rank_order_within_budget() -> None:
+    documents = [Document(page_content="x" * 400), Document(page_content="y" * 4000), Document(page_content="z" * 40)]
+
+    packed = pack_to_budget(documents, token_budget=120)
+
+    assert [document.page_content[0] for document in packed] == ["x", "z"]
+
+
+def test_packed_retriever_skips_duplicate_chunks() -> None:
+    texts = ["hotline premium 1900", "hotline premium 1900", "đổi trả 30 ngày", "sandbox miễn phí 60 ngày"]
+    store = FAISS.from_texts(texts, FakeEmbeddings(), metadatas=[{"source": f"{i}.txt"} for i in range(4)])
+    retriever = ShardedRetriever(shards={"default": store}, k=3, fetch_k=4, token_budget=1000)
+
+    documents = retriever.invoke("hotline premium")
+
+    contents = [document.page_content for document in documents]
+    assert contents[0] == "hotline premium 1900"
+    assert contents.count("hotline premium 1900") == 1
+    assert len(contents) == 3
+
+
+def test_sharded_retriever_merges_shards_and_scopes_by_collection_and_filter() -> None:
+    embeddings = FakeEmbeddings()
+    billing = FAISS.from_texts(
+        ["hóa đơn gói premium", "hoàn tiền hóa đơn"],
+        embeddings,
+        metadatas=[{"collection": "billing", "lang": "vi"}, {"collection": "billing", "lang": "en"}],
+    )
+    manuals = FAISS.from_texts(["hướng dẫn cài đặt sandbox"], embeddings, metadatas=[{"collection": "manuals"}])
+    retriever = ShardedRetriever(shards={"billing": billing, "manuals": manuals}, k=3, packing=False)
+
+    everything = retriever.invoke("hóa đơn sandbox")
+    scoped = retriever.scoped(["manuals"]).invoke("hóa đơn sandbox")
+    filtered = retriever.scoped(metadata_filter={"lang": ["en"]}).invoke("hóa đơn")
+
+    assert {document.metadata["collection"] for document in everything} == {"billing", "manuals"}
+    assert [document.page_content for document in scoped] == ["hướng dẫn cài đặt sandbox"]
+    assert [document.page_content for document in filtered] == ["hoàn tiền hóa đơn"]
+    with pytest.raises(ValueError):
+        retriever.scoped(["legal"])
+
+
+def test_batched_search_returns_scored_hits_and_caches_query_embeddings() -> None:
+    calls = []
+
+    class CountingEmbeddings(FakeEmbeddings):
+        def embed_documents(self, texts):
+            calls.append(list(texts))
+            return super().embed_documents(texts)
+
+    embeddings = CachedQueryEmbeddings(CountingEmbeddings(), maxsize=8)
+    store = FAISS.from_texts(["hotline premium 1900", "đổi trả 30 ngày", "sandbox 60 ngày"], embeddings)
+    retriever = ShardedRetriever(shards={"default": store}, k=2)
+    calls.clear()
+
+    first = retriever.search(["hotline premium", "đổi trả"], k=1)
+    again = retriever.search(["đổi trả", "sandbox"])
+
+    assert [hits[0][0].page_content for hits in first] == ["hotline premium 1900", "đổi trả 30 ngày"]
+    assert [len(hits) for hits in again] == [2, 2]
+    assert again[0][0][1] <= again[0][1][1]
+    assert calls == [["hotline premium", "đổi trả"], ["sandbox"]]
+
+
+def test_stored_vectors_are_only_read_back_for_packing() -> None:
+    reconstructed = []
+
+    class CountingIndex:
+        def __init__(self, inner) -> None:
+            self.inner = inner
+
+        def __getattr__(self, name: str):
+            return getattr(self.inner, name)
+
+        def reconstruct_batch(self, positions):
+            reconstructed.append(len(positions))
+            return self.inner.reconstruct_batch(positions)
+
+    store = FAISS.from_texts(["hotline premium 1900", "đổi trả 30 ngày", "sandbox 60 ngày"], FakeEmbeddings())
+    store.index = CountingIndex(store.index)
+    retriever = ShardedRetriever(shards={"default": store}, k=2, packing=False)
+
+    assert len(retriever.invoke("hotline premium")) == 2
+    assert len(retriever.search(["đổi trả"])[0]) == 2
+    assert reconstructed == []
+
+    packed = retriever.model_copy(update={"packing": True, "fetch_k": 3})
+    assert packed.invoke("hotline premium")[0].page_content == "hotline premium 1900"
+    assert reconstructed == [3]
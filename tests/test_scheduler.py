@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from mock_project.observability import SCHEDULER_REQUESTS
+from mock_project.scheduler import FairScheduler, SchedulerBusy
+
+
+def test_chatty_session_does_not_starve_others_and_premium_goes_first() -> None:
+    scheduler = FairScheduler(concurrency=1, queue_timeout=10)
+    order = []
+
+    def request(session_id: str, tier: str) -> None:
+        with scheduler.slot(session_id, tier, 100):
+            order.append(session_id)
+
+    threads = []
+    with scheduler.slot("holder", "standard", 100):
+        for session_id, tier in [("chatty", "standard")] * 3 + [("quiet", "standard"), ("vip", "premium")]:
+            thread = threading.Thread(target=request, args=(session_id, tier))
+            thread.start()
+            threads.append(thread)
+            # Chờ request vào hàng đợi để thứ tự enqueue cố định
+            while len(scheduler._queue) < len(threads):
+                time.sleep(0.005)
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert order == ["vip", "chatty", "quiet", "chatty", "chatty"]
+
+
+def test_token_bucket_delays_admission_and_settle_refunds_estimate() -> None:
+    scheduler = FairScheduler(tokens_per_minute=600)
+
+    with scheduler.slot("s1", "standard", 600) as ticket:
+        ticket.settle(100)
+    started = time.monotonic()
+    with scheduler.slot("s2", "standard", 400):
+        pass
+    assert time.monotonic() - started < 0.1
+
+    started = time.monotonic()
+    with scheduler.slot("s3", "standard", 105):
+        pass
+    # Bucket còn ~100 token, nạp 10 token/giây: phải chờ ~0.5s
+    assert time.monotonic() - started >= 0.3
+
+
+def test_waiting_past_the_queue_timeout_raises_busy() -> None:
+    scheduler = FairScheduler(concurrency=1, queue_timeout=0.2, max_queue=1)
+    timeouts = SCHEDULER_REQUESTS.value(tier="premium", outcome="timeout")
+
+    with pytest.raises(ValueError):
+        scheduler.tier_for("gold")
+
+    async def queued() -> None:
+        async with scheduler.aslot("s2", "premium", 10):
+            pass
+
+    with scheduler.slot("s1", "standard", 10):
+        with pytest.raises(SchedulerBusy):
+            asyncio.run(queued())
+        with pytest.raises(SchedulerBusy):
+            with scheduler.slot("s3", "standard", 10):
+                pass
+    assert SCHEDULER_REQUESTS.value(tier="premium", outcome="timeout") == timeouts + 1
+    assert not scheduler._queue and scheduler._active == 0